@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Insert and query benchmark for HistoryManager.
+
+Compares the previous connect-per-call access pattern (default rollback
+journal, one commit and fsync per entry) with the shared WAL connection,
+writing synchronously and through the write-behind queue. For the queue,
+insert time includes the final flush.
+Each implementation gets its own fresh database in a temporary directory,
+which should live on the same disk as ~/.nlsh for meaningful numbers.
+
+Usage:
+    python benchmarks/bench_history.py [--inserts 2000] [--queries 500] [--dir /tmp]
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, 'src')
+
+from nlsh.history import HistoryManager
+
+
+class LegacyHistory:
+    """The connect-per-call pattern used before the shared connection"""
+    
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        # Reuse the current schema so both sides query the same table
+        HistoryManager(db_path).close()
+        with sqlite3.connect(db_path) as conn:
+            conn.execute("PRAGMA journal_mode=DELETE")
+    
+    def log_tool_call(self, tool_name: str, tool_args: dict, tool_result: str):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("""
+                INSERT INTO history_entries (timestamp, session_id, entry_type, cwd, data)
+                VALUES (?, ?, ?, ?, ?)
+            """, (datetime.now().isoformat(), 'bench', 'tool_call', os.getcwd(),
+                  json.dumps({'tool_name': tool_name, 'tool_args': tool_args,
+                              'tool_result': tool_result})))
+            conn.commit()
+    
+    def get_recent_commands(self, limit: int = 10):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.execute(
+                "SELECT * FROM history_entries ORDER BY timestamp DESC LIMIT ?", (limit,))
+            return [dict(row) | {'data': json.loads(row['data'])} for row in cursor.fetchall()]
+
+
+def run(history, inserts: int, queries: int) -> dict:
+    started = time.perf_counter()
+    for i in range(inserts):
+        history.log_tool_call('execute_shell_command', {'command': f'ls {i}'}, 'file.txt\n' * 20)
+    if hasattr(history, 'flush'):
+        history.flush()
+    insert_seconds = time.perf_counter() - started
+    
+    latencies = []
+    for _ in range(queries):
+        started = time.perf_counter()
+        history.get_recent_commands(10)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    
+    return {
+        'inserts_per_sec': inserts / insert_seconds,
+        'query_p50_ms': latencies[len(latencies) // 2] * 1000,
+        'query_p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--inserts', type=int, default=2000, help="Entries to log")
+    parser.add_argument('--queries', type=int, default=500, help="get_recent_commands calls to time")
+    parser.add_argument('--dir', default=None, help="Directory for the benchmark databases")
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        results = {
+            'connect per call': run(LegacyHistory(os.path.join(tmp, 'legacy.db')),
+                                    args.inserts, args.queries),
+            'shared WAL connection': run(HistoryManager(os.path.join(tmp, 'shared.db'),
+                                                        write_behind=False),
+                                         args.inserts, args.queries),
+            'write-behind queue': run(HistoryManager(os.path.join(tmp, 'queued.db')),
+                                      args.inserts, args.queries),
+        }
+    
+    print(f"{'implementation':<24} {'inserts/s':>10} {'query p50':>10} {'query p99':>10}")
+    for name, r in results.items():
+        print(f"{name:<24} {r['inserts_per_sec']:>10.0f} {r['query_p50_ms']:>8.3f}ms {r['query_p99_ms']:>8.3f}ms")
+
+
+if __name__ == '__main__':
+    main()
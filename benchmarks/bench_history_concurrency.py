@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Contention benchmark for several nlsh sessions sharing one history database.
+
+Spawns N processes, each a simulated session with its own HistoryManager,
+logging shell commands (with output of varying size), LLM interactions and
+their tool calls at a given mean rate, and now and then reading recent
+entries or searching, as the REPL does. At the end every logged entry is
+looked up, so entries lost to "database is locked" errors show up.
+
+Reported latencies:
+    log     time of the log_* call as the session sees it
+    commit  time of each transaction writing entries, including waits for
+            the write lock (with the write-behind queue, one per flush)
+
+Usage:
+    python benchmarks/bench_history_concurrency.py [--sessions 16] [--duration 10]
+        [--rate 20] [--sync] [--busy-timeout-ms 5000] [--dir /tmp]
+"""
+
+import argparse
+import multiprocessing
+import os
+import queue
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, 'src')
+
+from nlsh import history
+from nlsh.history import HistoryManager
+from nlsh.shell import CommandResult
+
+WORDS = ['src', 'build', 'test', 'main.py', 'README.md', 'error:', 'warning:', 'ok', 'done', 'line']
+
+
+class TimedHistoryManager(HistoryManager):
+    """Records how long each flush that wrote entries took"""
+    
+    def __init__(self, *args, **kwargs):
+        self.commit_latencies = []
+        super().__init__(*args, **kwargs)
+    
+    def flush(self):
+        queued = len(self._pending)
+        started = time.perf_counter()
+        super().flush()
+        if queued:
+            self.commit_latencies.append(time.perf_counter() - started)
+
+
+def random_output(rng: random.Random) -> str:
+    """Command output from a few bytes to tens of kilobytes"""
+    lines = int(rng.lognormvariate(2.5, 1.5)) + 1
+    return '\n'.join(' '.join(rng.choices(WORDS, k=8)) for _ in range(min(lines, 2000)))
+
+
+def session(index: int, db_path: str, args, results):
+    """One simulated nlsh session; puts its counters on `results`"""
+    if args.busy_timeout_ms is not None:
+        history.BUSY_TIMEOUT_MS = args.busy_timeout_ms
+    rng = random.Random(index)
+    log_latencies = []
+    logged = errors = 0
+    manager = None
+    try:
+        # Opening fails too if the database stays locked throughout
+        manager = TimedHistoryManager(db_path, write_behind=not args.sync)
+        deadline = time.monotonic() + args.duration
+        while time.monotonic() < deadline:
+            time.sleep(rng.expovariate(args.rate))
+            action = rng.random()
+            started = time.perf_counter()
+            try:
+                # Counted before the call: an entry that raised is lost too
+                if action < 0.7:
+                    output = random_output(rng)
+                    result = CommandResult(command='', output=output, error='',
+                                           return_code=rng.choice([0, 0, 0, 1]), cwd='/',
+                                           wall_time_ms=rng.randint(1, 500))
+                    logged += 1
+                    manager.log_shell_command(f"cmd s{index}-{logged}", result)
+                elif action < 0.9:
+                    logged += 1
+                    manager.log_llm_interaction(f"prompt s{index}-{logged}",
+                                                llm_response='run the tests', llm_model='bench')
+                    for _ in range(2):
+                        logged += 1
+                        manager.log_tool_call('execute_shell_command', {'command': 'ls'},
+                                              random_output(rng))
+                else:
+                    manager.get_recent_session_entries(15)
+                    if action > 0.98:
+                        manager.search_history(rng.choice(WORDS))
+                    continue
+            except sqlite3.Error:
+                errors += 1
+                continue
+            if args.sync:
+                manager.commit_latencies.append(time.perf_counter() - started)
+            log_latencies.append(time.perf_counter() - started)
+        manager.close()
+    except sqlite3.Error:
+        errors += 1
+    results.put({
+        'session_id': manager.session_id if manager else None,
+        'logged': logged,
+        'errors': errors,
+        'log_latencies': log_latencies,
+        'commit_latencies': manager.commit_latencies if manager else [],
+    })
+
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sessions', type=int, default=16, help="Concurrent nlsh processes")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds each session logs for")
+    parser.add_argument('--rate', type=float, default=20, help="Mean actions per second per session")
+    parser.add_argument('--sync', action='store_true', help="Write each entry as logged, without the queue")
+    parser.add_argument('--busy-timeout-ms', type=int, default=None,
+                        help="Override BUSY_TIMEOUT_MS, e.g. 0 to see what locking costs without it")
+    parser.add_argument('--dir', default=None, help="Directory for the benchmark database")
+    args = parser.parse_args()
+    
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        db_path = os.path.join(tmp, 'history.db')
+        HistoryManager(db_path, write_behind=False).close()  # Create the schema up front
+        
+        results = context.Queue()
+        processes = [context.Process(target=session, args=(i, db_path, args, results))
+                     for i in range(args.sessions)]
+        started = time.perf_counter()
+        for process in processes:
+            process.start()
+        # Collect the reports as they come (a process exits only once its
+        # report is read), watching the size of the WAL meanwhile
+        reports = []
+        wal_bytes = 0
+        while len(reports) < len(processes):
+            try:
+                reports.append(results.get(timeout=0.1))
+            except queue.Empty:
+                pass
+            try:
+                wal_bytes = max(wal_bytes, os.path.getsize(db_path + '-wal'))
+            except OSError:
+                pass
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+        
+        # Opening the database also takes in entries a session had to set aside
+        manager = HistoryManager(db_path, write_behind=False)
+        with manager._connection() as conn:
+            stored = dict(conn.execute(
+                "SELECT session_id, COUNT(*) FROM history_entries GROUP BY session_id").fetchall())
+        manager.close()
+    
+    logged = sum(r['logged'] for r in reports)
+    lost = sum(max(r['logged'] - stored.get(r['session_id'], 0), 0) for r in reports)
+    log_latencies = [x for r in reports for x in r['log_latencies']]
+    commit_latencies = [x for r in reports for x in r['commit_latencies']]
+    
+    print(f"{args.sessions} sessions, {'synchronous writes' if args.sync else 'write-behind queue'}, "
+          f"{elapsed:.1f} s")
+    print(f"entries logged   {logged:>10}  ({logged / elapsed:.0f}/s)")
+    print(f"entries stored   {sum(stored.values()):>10}")
+    print(f"entries lost     {lost:>10}")
+    print(f"errors           {sum(r['errors'] for r in reports):>10}")
+    print(f"log p50/p99      {percentile(log_latencies, 0.5) * 1000:>8.2f} ms "
+          f"{percentile(log_latencies, 0.99) * 1000:>8.2f} ms")
+    print(f"commit p50/p99   {percentile(commit_latencies, 0.5) * 1000:>8.2f} ms "
+          f"{percentile(commit_latencies, 0.99) * 1000:>8.2f} ms "
+          f"(max {max(commit_latencies, default=0) * 1000:.0f} ms)")
+    print(f"largest WAL      {wal_bytes / 1024:>8.0f} KB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Recall and latency benchmark for the prompt similarity index.
+
+Fills a history database with LLM interactions: requests from a set of
+intents, each phrased several ways and filled in with file types, sizes,
+branches and so on, run from a handful of project directories. Then
+queries it three ways:
+
+    paraphrase  an indexed request asked with other words; the suggestion
+                should be the commands it ran
+    variant     an indexed intent with other values ("rust files" instead
+                of "python files"); any suggestion is wrong
+    unrelated   requests like nothing indexed; any suggestion is wrong
+
+For each minimum score it reports how many paraphrases are answered
+correctly (recall), and how often a wrong suggestion is shown. Latency is
+that of HistoryManager.recall().
+
+Usage:
+    python benchmarks/bench_history_recall.py [--prompts 5000] [--queries 300] [--dir /tmp]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, 'src')
+
+from nlsh import history_recall
+from nlsh.history import HistoryManager
+from nlsh.shell import CommandResult
+
+SLOTS = {
+    'lang': [('python', 'py'), ('rust', 'rs'), ('javascript', 'js'), ('go', 'go'), ('c', 'c'),
+             ('markdown', 'md'), ('yaml', 'yaml'), ('json', 'json')],
+    'size': ['1MB', '10MB', '100MB', '500k', '2G'],
+    'days': ['1', '2', '7', '14', '30'],
+    'branch': ['main', 'develop', 'release', 'feature/login', 'hotfix'],
+    'port': ['80', '443', '3000', '5432', '8080'],
+    'name': ['nginx', 'postgres', 'redis', 'node', 'python3'],
+}
+
+# (phrasings, command); phrasings use the slots in {braces}
+INTENTS = [
+    (["find all {lang} files larger than {size}", "list {lang} files bigger than {size}",
+      "which {lang} files are over {size}", "search for {lang} files above {size} in size"],
+     "find . -name '*.{ext}' -size +{size}"),
+    (["show git commits from the last {days} days", "git log for the past {days} days",
+      "list commits made in the last {days} days", "what was committed during the last {days} days"],
+     "git log --since='{days} days ago' --oneline"),
+    (["switch to the {branch} branch", "checkout {branch}", "change branch to {branch}",
+      "go to git branch {branch}"],
+     "git checkout {branch}"),
+    (["what process is listening on port {port}", "who is using port {port}",
+      "find the process bound to port {port}", "check which program has port {port} open"],
+     "lsof -i :{port}"),
+    (["kill all {name} processes", "stop every {name} process", "terminate {name}",
+      "kill the running {name} processes"],
+     "pkill {name}"),
+    (["count lines of {lang} code", "how many lines of {lang} are there",
+      "total line count of {lang} files", "number of lines in all {lang} files"],
+     "find . -name '*.{ext}' | xargs wc -l"),
+    (["delete {lang} files older than {days} days", "remove {lang} files not modified in {days} days",
+      "clean up {lang} files older than {days} days", "purge {lang} files over {days} days old"],
+     "find . -name '*.{ext}' -mtime +{days} -delete"),
+    (["show disk usage of this directory", "how much space does this folder use",
+      "disk space used here", "size of the current directory"],
+     "du -sh ."),
+    (["compress the logs directory", "make a tarball of logs", "archive the logs folder",
+      "create a tar.gz of the logs directory"],
+     "tar czf logs.tar.gz logs"),
+    (["show memory usage of {name}", "how much memory is {name} using", "ram used by {name}",
+      "memory consumption of the {name} processes"],
+     "ps -o rss,cmd -C {name}"),
+    (["list the largest files in this directory", "biggest files here", "show files sorted by size",
+      "which files take the most space"],
+     "ls -lS | head"),
+    (["search for TODO comments in {lang} files", "find TODOs in the {lang} code",
+      "grep {lang} files for TODO", "list TODO markers in {lang} sources"],
+     "grep -rn TODO --include='*.{ext}' ."),
+]
+
+UNRELATED = [
+    "what's the weather like tomorrow", "convert this video to mp4", "set up a python virtualenv",
+    "open the project in vscode", "show my ip address", "restart the docker daemon",
+    "install the requests package", "generate an ssh key", "resize all png images to 800px",
+    "show the calendar for next month", "ping google", "mount the usb drive",
+]
+
+PROJECTS = ['/home/dev/api', '/home/dev/web', '/home/dev/infra', '/home/dev/notes', '/srv/app']
+THRESHOLDS = [0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8]
+
+
+def request(rng: random.Random, intent_index: int, values: dict, phrasing: int = None):
+    phrasings, command = INTENTS[intent_index]
+    if phrasing is None:
+        phrasing = rng.randrange(len(phrasings))
+    lang, ext = values['lang']
+    fields = dict(values, lang=lang, ext=ext)
+    return phrasing, phrasings[phrasing].format(**fields), command.format(**fields)
+
+
+def random_values(rng: random.Random, held_out: bool = False) -> dict:
+    """Slot values for a request; the last value of each slot is never indexed"""
+    return {slot: rng.choice(options if held_out else options[:-1]) for slot, options in SLOTS.items()}
+
+
+class ProjectHistoryManager(HistoryManager):
+    """Logs entries as if run in `cwd` rather than the benchmark's directory"""
+    cwd = '/'
+    
+    def _save_entry(self, entry, extra_data=None):
+        entry.cwd = self.cwd
+        super()._save_entry(entry, extra_data)
+
+
+def percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--prompts', type=int, default=5000, help="LLM interactions in the history")
+    parser.add_argument('--queries', type=int, default=300, help="Queries of each kind")
+    parser.add_argument('--dir', default=None, help="Directory for the benchmark database")
+    args = parser.parse_args()
+    rng = random.Random(1)
+    
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        manager = ProjectHistoryManager(os.path.join(tmp, 'history.db'))
+        # (intent, values, phrasing) -> (command, cwd) of every indexed request
+        indexed = {}
+        started = time.perf_counter()
+        for _ in range(args.prompts):
+            intent = rng.randrange(len(INTENTS))
+            values = random_values(rng)
+            phrasing, prompt, command = request(rng, intent, values)
+            cwd = manager.cwd = rng.choice(PROJECTS)
+            result = CommandResult(command=command, output='', error='', return_code=0, cwd=cwd)
+            manager.log_llm_interaction(prompt, generated_commands=[command], executed_commands=[command],
+                                        execution_results=[result], llm_model='bench')
+            indexed[(intent, tuple(sorted(values.items())), phrasing)] = (command, cwd)
+        manager.flush()
+        index_time = time.perf_counter() - started
+        
+        queries = []  # (kind, prompt, cwd, expected commands or None)
+        keys = list(indexed)
+        while len([q for q in queries if q[0] == 'paraphrase']) < args.queries:
+            intent, values, phrasing = rng.choice(keys)
+            others = [p for p in range(len(INTENTS[intent][0])) if p != phrasing]
+            _, prompt, command = request(rng, intent, dict(values), rng.choice(others))
+            queries.append(('paraphrase', prompt, indexed[(intent, values, phrasing)][1], [command]))
+        indexed_commands = {command for command, _ in indexed.values()}
+        while len([q for q in queries if q[0] == 'variant']) < args.queries:
+            intent = rng.randrange(len(INTENTS))
+            _, prompt, command = request(rng, intent, random_values(rng, held_out=True))
+            # Only values that make a command never run before
+            if command not in indexed_commands:
+                queries.append(('variant', prompt, rng.choice(PROJECTS), None))
+        for _ in range(args.queries):
+            queries.append(('unrelated', rng.choice(UNRELATED), rng.choice(PROJECTS), None))
+        
+        latencies = []
+        outcomes = []  # (kind, score of the best match, whether it is right)
+        for kind, prompt, cwd, expected in queries:
+            started_query = time.perf_counter()
+            matches = manager.recall(prompt, cwd=cwd, limit=1)
+            latencies.append(time.perf_counter() - started_query)
+            # Scores below the default minimum, for the threshold table
+            with manager._connection() as conn:
+                best = history_recall.search(conn, prompt, cwd, limit=1, min_score=0)
+            outcomes.append((kind, best[0].score if best else 0.0,
+                             bool(best) and best[0].commands == expected))
+            assert not matches or matches[0].score == best[0].score
+        
+        db_bytes = os.path.getsize(os.path.join(tmp, 'history.db'))
+        manager.close()
+    
+    print(f"{args.prompts} prompts indexed in {index_time:.1f} s "
+          f"({args.prompts / index_time:.0f}/s), database {db_bytes / 1024 / 1024:.1f} MB")
+    print(f"recall() p50/p99   {percentile(latencies, 0.5) * 1000:.2f} ms "
+          f"{percentile(latencies, 0.99) * 1000:.2f} ms")
+    print()
+    print("min score   paraphrase recall   wrong suggestions: paraphrase  variant  unrelated")
+    for threshold in THRESHOLDS:
+        def share(kind, predicate):
+            kind_outcomes = [o for o in outcomes if o[0] == kind]
+            return sum(predicate(o) for o in kind_outcomes) / len(kind_outcomes)
+        shown = lambda o: o[1] >= threshold
+        marker = '  (default)' if threshold == history_recall.RECALL_MIN_SCORE else ''
+        print(f"{threshold:>9.2f}   {share('paraphrase', lambda o: shown(o) and o[2]):>17.1%}   "
+              f"{share('paraphrase', lambda o: shown(o) and not o[2]):>29.1%}  "
+              f"{share('variant', shown):>7.1%}  {share('unrelated', shown):>9.1%}{marker}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for ShellManager.execute_command_with_live_output.
+
+Compares the previous poll()/readline() loop with the selector-based
+multiplexer on bulk-output commands. Output is written to /dev/null so the
+numbers measure nlsh's own overhead rather than the terminal.
+
+Two workloads are run:
+  - "stderr closed": `exec 2>/dev/null; yes | head -c N`, which the old loop
+    can complete because its blocking stderr readline() sees EOF at once
+  - "stderr open": `yes | head -c N`, where the old loop blocks in
+    stderr.readline() while stdout fills up; it is killed after a timeout
+
+Usage:
+    python benchmarks/bench_live_output.py [--mb 8] [--runs 3] [--skip-legacy]
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, 'src')
+
+from nlsh.shell import ShellManager
+
+
+class Stalled(Exception):
+    """Raised when the legacy loop had to be killed by the watchdog"""
+
+
+def legacy_live_output(shell_path: str, command: str, timeout: float) -> int:
+    """The readline/poll loop used before the multiplexer, kept for comparison"""
+    proc = subprocess.Popen(
+        [shell_path, '-c', command],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        bufsize=1,
+        universal_newlines=True,
+        start_new_session=True
+    )
+    watchdog = threading.Timer(timeout, lambda: os.killpg(proc.pid, 9))
+    watchdog.start()
+    try:
+        return _legacy_loop(proc)
+    finally:
+        watchdog.cancel()
+        if proc.returncode == -9:
+            raise Stalled()
+
+
+def _legacy_loop(proc) -> int:
+    captured = 0
+    while True:
+        if proc.poll() is not None:
+            break
+        line = proc.stdout.readline()
+        if line:
+            print(line, end='', flush=True)
+            captured += len(line)
+        line = proc.stderr.readline()
+        if line:
+            print(line, end='', file=sys.stderr, flush=True)
+            captured += len(line)
+    remaining_stdout, remaining_stderr = proc.communicate()
+    print(remaining_stdout, end='', flush=True)
+    print(remaining_stderr, end='', file=sys.stderr, flush=True)
+    return captured + len(remaining_stdout) + len(remaining_stderr)
+
+
+def measure(label: str, func, size_bytes: int, runs: int):
+    """Run func several times with stdout/stderr sent to /dev/null"""
+    real_stdout, real_stderr = sys.stdout, sys.stderr
+    results = []
+    for _ in range(runs):
+        with open(os.devnull, 'w') as devnull:
+            sys.stdout = sys.stderr = devnull
+            try:
+                usage_before = resource.getrusage(resource.RUSAGE_SELF)
+                start = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - start
+                usage_after = resource.getrusage(resource.RUSAGE_SELF)
+            except Stalled:
+                sys.stdout, sys.stderr = real_stdout, real_stderr
+                print(f"{label:<14} stalled (killed by watchdog)")
+                return
+            finally:
+                sys.stdout, sys.stderr = real_stdout, real_stderr
+        cpu = (usage_after.ru_utime - usage_before.ru_utime) + \
+              (usage_after.ru_stime - usage_before.ru_stime)
+        results.append((elapsed, cpu))
+    
+    best_elapsed = min(r[0] for r in results)
+    best_cpu = min(r[1] for r in results)
+    mb = size_bytes / (1024 * 1024)
+    print(f"{label:<14} {mb / best_elapsed:>10.1f} MB/s  "
+          f"wall {best_elapsed:>7.2f}s  nlsh CPU {best_cpu:>7.2f}s "
+          f"({100 * best_cpu / best_elapsed:.0f}% of a core)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--mb', type=int, default=8, help="Megabytes of output to generate")
+    parser.add_argument('--runs', type=int, default=3, help="Runs per implementation (best is reported)")
+    parser.add_argument('--legacy-timeout', type=float, default=60, help="Seconds before the legacy loop is considered stalled")
+    parser.add_argument('--skip-legacy', action='store_true', help="Only benchmark the current implementation")
+    args = parser.parse_args()
+    
+    size_bytes = args.mb * 1024 * 1024
+    shell_manager = ShellManager()
+    shell_path = shell_manager.get_shell_path()
+    
+    workloads = [
+        ("stderr closed", f"exec 2>/dev/null; yes | head -c {size_bytes}"),
+        ("stderr open", f"yes | head -c {size_bytes}"),
+    ]
+    
+    for name, command in workloads:
+        print(f"\n{name}: {command} (via {shell_path})")
+        if not args.skip_legacy:
+            measure("poll/readline",
+                    lambda: legacy_live_output(shell_path, command, args.legacy_timeout),
+                    size_bytes, args.runs)
+        measure("multiplexer", lambda: shell_manager.execute_command_with_live_output(command),
+                size_bytes, args.runs)
+
+
+if __name__ == "__main__":
+    main()
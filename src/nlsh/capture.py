@@ -0,0 +1,233 @@
+"""Bounded capture of command output with spill-to-disk"""
+
+import codecs
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+# Default in-memory window kept for each stream
+DEFAULT_HEAD_BYTES = 64 * 1024
+DEFAULT_TAIL_BYTES = 64 * 1024
+
+# Bytes inspected to decide whether a stream is binary
+BINARY_SNIFF_BYTES = 8192
+
+# Share of undecodable bytes above which non-UTF-8 output counts as binary
+BINARY_INVALID_RATIO = 0.3
+
+# Spill files live next to the history database so history can refer to them
+DEFAULT_SPILL_DIR = Path.home() / '.nlsh' / 'spill'
+
+
+class OutputCapture:
+    """
+    Capture of a single output stream (stdout or stderr).
+    
+    Everything is kept in memory while the stream fits in the head + tail
+    window. Once it grows past that, the full stream is written to a spill
+    file and only the first `head_bytes` and last `tail_bytes` stay in
+    memory. The full stream can always be read back with `open()`.
+    """
+    
+    def __init__(self, head_bytes: int = DEFAULT_HEAD_BYTES, tail_bytes: int = DEFAULT_TAIL_BYTES,
+                 spill_dir: Optional[str] = None):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.spill_dir = Path(spill_dir) if spill_dir else DEFAULT_SPILL_DIR
+        self.size = 0
+        self.spill_path: Optional[str] = None
+        self._buffer = bytearray()  # Whole stream until we spill, then the head
+        self._tail = bytearray()
+        self._spill: Optional[BinaryIO] = None
+        self._text: Optional[str] = None  # Decoded on first use
+        self._is_binary: Optional[bool] = None
+    
+    @property
+    def truncated(self) -> bool:
+        """Whether the in-memory copy is only a head/tail excerpt"""
+        return self.spill_path is not None
+    
+    def write(self, data: bytes):
+        """Append a chunk of raw output"""
+        if not data:
+            return
+        self.size += len(data)
+        self._text = None
+        if len(self._buffer) < BINARY_SNIFF_BYTES:
+            self._is_binary = None
+        
+        if self.spill_path is None:
+            self._buffer.extend(data)
+            if len(self._buffer) > self.head_bytes + self.tail_bytes:
+                self._start_spill()
+            return
+        
+        self._write_spill(data)
+        self._tail.extend(data)
+        if len(self._tail) > self.tail_bytes:
+            del self._tail[:len(self._tail) - self.tail_bytes]
+    
+    def _start_spill(self):
+        """Move the stream to a spill file and shrink memory to head + tail"""
+        data = bytes(self._buffer)
+        try:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            fd, path = tempfile.mkstemp(prefix='output-', suffix='.log', dir=str(self.spill_dir))
+            self._spill = os.fdopen(fd, 'wb')
+            self.spill_path = path
+        except OSError:
+            # No spill directory available; keep the excerpt only
+            self.spill_path = ''
+        
+        self._write_spill(data)
+        self._buffer = bytearray(data[:self.head_bytes])
+        self._tail = bytearray(data[self.head_bytes:][-self.tail_bytes:] if self.tail_bytes else b'')
+    
+    def _write_spill(self, data: bytes):
+        if self._spill is None:
+            return
+        try:
+            self._spill.write(data)
+        except OSError:
+            # Disk full or similar - stop spilling but keep capturing the tail
+            self._close_spill()
+    
+    def _close_spill(self):
+        if self._spill is not None:
+            try:
+                self._spill.close()
+            except OSError:
+                pass
+            self._spill = None
+    
+    def close(self):
+        """Finish capturing and flush the spill file"""
+        self._close_spill()
+    
+    def excerpt(self) -> bytes:
+        """The bytes held in memory: the whole stream, or its head and tail"""
+        if not self.truncated:
+            return bytes(self._buffer)
+        return bytes(self._buffer) + bytes(self._tail)
+    
+    @property
+    def is_binary(self) -> bool:
+        """Whether the stream looks like binary data rather than text"""
+        if self._is_binary is None:
+            self._is_binary = looks_binary(bytes(self._buffer[:BINARY_SNIFF_BYTES]))
+        return self._is_binary
+    
+    def sha256(self) -> Optional[str]:
+        """Hex digest of the full stream, or None if only an excerpt survives"""
+        if self.truncated and not self.spill_path:
+            return None
+        digest = hashlib.sha256()
+        try:
+            with self.open() as stream:
+                for block in iter(lambda: stream.read(1024 * 1024), b''):
+                    digest.update(block)
+        except OSError:
+            return None
+        return digest.hexdigest()
+    
+    def summary(self) -> str:
+        """One-line description of binary output, used in place of its text"""
+        digest = self.sha256()
+        checksum = f", sha256 {digest}" if digest else ""
+        return f"[binary data: {self.size} bytes{checksum}]"
+    
+    def text(self) -> str:
+        """Decoded output, with a marker where bytes were left out"""
+        if self._text is not None:
+            return self._text
+        
+        if not self.truncated:
+            self._text = self._buffer.decode('utf-8', errors='replace')
+            return self._text
+        
+        omitted = self.size - len(self._buffer) - len(self._tail)
+        where = f"; full output in {self.spill_path}" if self.spill_path else ""
+        marker = f"\n... [{omitted} bytes omitted{where}] ...\n"
+        # The tail starts at an arbitrary byte; skip a split character there
+        tail = bytes(self._tail)
+        for start in range(min(4, len(tail))):
+            if tail[start] & 0xC0 != 0x80:
+                tail = tail[start:]
+                break
+        self._text = (self._buffer.decode('utf-8', errors='replace') + marker +
+                      tail.decode('utf-8', errors='replace'))
+        return self._text
+    
+    def open(self) -> BinaryIO:
+        """Open the full stream for reading"""
+        if not self.truncated:
+            return io.BytesIO(bytes(self._buffer))
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return io.BytesIO(self.excerpt())
+        if self._spill is not None:
+            self._spill.flush()
+        return open(self.spill_path, 'rb')
+    
+    def mmap(self):
+        """Memory-map the full stream (falls back to an in-memory buffer)"""
+        stream = self.open()
+        if isinstance(stream, io.BytesIO):
+            return stream.getbuffer()
+        with stream:
+            if os.fstat(stream.fileno()).st_size == 0:
+                return memoryview(b'')
+            return mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    def read_text(self) -> str:
+        """Read and decode the full stream"""
+        with self.open() as stream:
+            return stream.read().decode('utf-8', errors='replace')
+
+
+def looks_binary(sample: bytes) -> bool:
+    """
+    Guess whether a chunk of output is binary.
+    
+    NUL bytes never appear in text output. Otherwise the sample counts as
+    binary only if a good share of it is not valid UTF-8, so text in other
+    encodings and a character cut off at the end of the sample pass.
+    """
+    if not sample:
+        return False
+    if b'\0' in sample:
+        return True
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    text = decoder.decode(sample, final=False)
+    return text.count('\ufffd') > len(sample) * BINARY_INVALID_RATIO
+
+
+def head_tail_excerpt(text: str, limit: int) -> str:
+    """Shorten text to roughly `limit` characters, keeping its start and end"""
+    if not text or len(text) <= limit:
+        return text
+    half = limit // 2
+    omitted = len(text) - 2 * half
+    return text[:half] + f"\n... [{omitted} characters omitted] ...\n" + text[-half:]
+
+
+def cleanup_spill_files(max_age_days: int, spill_dir: Optional[str] = None) -> int:
+    """Delete spill files older than max_age_days, returning how many were removed"""
+    directory = Path(spill_dir) if spill_dir else DEFAULT_SPILL_DIR
+    if not directory.is_dir():
+        return 0
+    
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    for path in directory.glob('output-*.log'):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except OSError:
+            continue
+    return removed
@@ -1,11 +1,16 @@
 """Main CLI entrypoint for nlsh"""
 
 import os
+import signal
+import sqlite3
 import sys
+import time
+from datetime import datetime, timedelta
 from typing import Optional, List
 import typer
 from rich.console import Console
 from rich.markdown import Markdown
+from rich.markup import escape
 from prompt_toolkit import prompt
 from prompt_toolkit.history import InMemoryHistory
 from prompt_toolkit.shortcuts import CompleteStyle
@@ -14,9 +19,16 @@ from .shell import ShellManager
 from .llm import LLMInterface
 from .langgraph_llm import LangGraphLLMInterface
 from .context import ContextManager
-from .history import HistoryManager
+from .history import HistoryManager, SNIPPET_END, SNIPPET_START
+from .history_analytics import FORMATS as ANALYTICS_FORMATS
+from .history_import import FORMATS, default_history_files
+from .history_recall import RECALLED_MODEL, RecallMatch
+from .history_retention import RetentionPolicy
+from .llm_cache import DEFAULT_LLM_CACHE, ResponseCache
 from .streaming import create_streaming_interface
-from .utils import confirm_action
+from .planner import ExecutionStage, plan_commands, run_parallel_stage
+from .jobs import JobManager
+from .utils import choose_option, confirm_action
 
 console = Console()
 
@@ -44,17 +56,34 @@ class CommandHistory:
 
 
 def main_shell(
+    ctx: typer.Context,
     debug: bool = typer.Option(False, "--debug", help="Enable debug mode"),
     use_langgraph: bool = typer.Option(True, "--use-langgraph/--use-simple", help="Use LangGraph interface"),
-    stream: bool = typer.Option(True, "--stream/--no-stream", help="Enable streaming responses")
+    stream: bool = typer.Option(True, "--stream/--no-stream", help="Enable streaming responses"),
+    persistent_shell: bool = typer.Option(False, "--persistent-shell/--no-persistent-shell", help="Run commands in one long-lived shell so cd/export persist"),
+    auto_pty: bool = typer.Option(True, "--auto-pty/--no-auto-pty", help="Run known interactive programs (top, less, vim, ...) on a PTY"),
+    command_timeout: float = typer.Option(30.0, "--command-timeout", help="Seconds before commands run by the assistant's tools are killed"),
+    live_timeout: Optional[float] = typer.Option(None, "--live-timeout", help="Seconds before commands shown live are killed (default: no limit)"),
+    parallel: bool = typer.Option(True, "--parallel/--no-parallel", help="Run independent read-only commands suggested by llm: concurrently"),
+    recall: bool = typer.Option(True, "--recall/--no-recall", help="Offer commands that worked for similar llm: requests before asking the AI"),
+    cache: bool = typer.Option(False, "--cache/--no-cache", help="Reuse AI responses to repeated requests in an unchanged directory (also NLSH_LLM_CACHE=1)")
 ):
     """Start the natural language shell"""
+    if ctx.invoked_subcommand is not None:
+        return  # `nlsh history`, `nlsh stats`, ...
     
     # Initialize components
-    shell_manager = ShellManager()
+    shell_manager = ShellManager(persistent=persistent_shell, timeout=command_timeout,
+                                 live_timeout=live_timeout)
     context_manager = ContextManager()
-    history_manager = HistoryManager()
+    # Retention, if NLSH_HISTORY_* sets any limit, runs while the shell is idle
+    history_manager = HistoryManager(retention=RetentionPolicy.from_env())
     command_history = CommandHistory()
+    # Finished background jobs are logged from their reader thread
+    job_manager = JobManager(
+        shell_manager,
+        on_finish=lambda job: history_manager.log_shell_command(job.command, job.result)
+    )
     
     # Initialize LLM interface
     try:
@@ -64,6 +93,7 @@ def main_shell(
             llm_interface.setup_shell_integration(shell_manager)
             # Setup history integration for tool call logging
             llm_interface.setup_history_integration(history_manager)
+            llm_interface.setup_response_cache(ResponseCache.from_env(enabled=cache))
             provider_info = f"{llm_interface.provider} ({llm_interface.model_name})"
             console.print(f"[dim]Using LangGraph interface with {provider_info} - tool calling and streaming enabled[/dim]")
         else:
@@ -81,16 +111,24 @@ def main_shell(
     console.print("Commands:")
     console.print("  [yellow]llm:[/yellow] <prompt> - Generate and execute shell commands")
     console.print("  [yellow]llm?[/yellow] <prompt> - Chat mode (information only)")
+    console.print("  [yellow]pty:[/yellow] <command> / [yellow]pipe:[/yellow] <command> - Run on a terminal or with captured pipes")
+    console.print("  <command> [yellow]&[/yellow] or [yellow]bg[/yellow] <command> - Run in the background ([yellow]jobs[/yellow], [yellow]fg[/yellow] %N, [yellow]kill[/yellow] %N)")
     console.print("  [yellow]exit[/yellow] or [yellow]quit[/yellow] - Exit nlsh")
     console.print("  [dim]Use ↑/↓ arrow keys for command history[/dim]")
     if stream and use_langgraph:
         console.print("  [dim]✨ Streaming enabled with animated tool calls[/dim]")
+    if shell_manager.session:
+        console.print("  [dim]Persistent shell session enabled - cd/export carry over between commands[/dim]")
     console.print()
     
     try:
         # Main shell loop
         while True:
             try:
+                # Report background jobs that finished since the last prompt
+                for job in job_manager.pop_finished():
+                    console.print(f"[dim][{job.id}] {job.status}  {job.command}[/dim]")
+                
                 # Get current working directory for prompt
                 cwd = os.getcwd()
                 prompt_text = "nlsh $ "
@@ -123,6 +161,8 @@ def main_shell(
                             use_langgraph,
                             stream
                         )
+                        if debug:
+                            _print_scan_stats(context_manager)
                     else:
                         console.print("[yellow]Please provide a prompt after 'llm?'[/yellow]")
                         
@@ -138,19 +178,36 @@ def main_shell(
                             history_manager,
                             llm_interface,
                             use_langgraph,
-                            stream
+                            stream,
+                            parallel,
+                            recall
                         )
+                        if debug:
+                            _print_scan_stats(context_manager)
                     else:
                         console.print("[yellow]Please provide a prompt after 'llm:'[/yellow]")
                         
+                elif handle_job_command(user_input, job_manager):
+                    command_history.add_command(user_input, "shell")
+                
                 else:
-                    # Execute as regular shell command
+                    # Execute as regular shell command, honouring a pty:/pipe: prefix
+                    command = user_input
+                    mode = None if auto_pty else 'pipe'
+                    for prefix in ('pty:', 'pipe:'):
+                        if user_input.startswith(prefix):
+                            command = user_input[len(prefix):].strip()
+                            mode = prefix[:-1]
+                    if not command:
+                        continue
+                    
                     command_history.add_command(user_input, "shell")
                     handle_shell_command(
-                        user_input,
+                        command,
                         shell_manager,
                         context_manager,
-                        history_manager
+                        history_manager,
+                        mode
                     )
                     
             except KeyboardInterrupt:
@@ -167,6 +224,10 @@ def main_shell(
         else:
             console.print(f"[red]Error: {e}[/red]")
         sys.exit(1)
+    finally:
+        job_manager.close()
+        shell_manager.close()
+        history_manager.close()
     
     console.print("Goodbye!")
 
@@ -192,6 +253,7 @@ def handle_llm_chat(
         # Generate chat response
         console.print("\n[yellow]AI Response:[/yellow]")
         
+        started = time.perf_counter()
         if use_langgraph and stream and hasattr(llm_interface, 'generate_chat_response_streaming'):
             response = llm_interface.generate_chat_response_streaming(prompt, context)
             # Don't display response again - it was already streamed!
@@ -207,6 +269,7 @@ def handle_llm_chat(
             # Fallback to simple chat for original interface
             response = f"Chat mode not fully supported with simple interface. Try: {prompt}"
             console.print(response)
+        llm_time_ms = int((time.perf_counter() - started) * 1000)
         
         # Log the chat interaction
         history_manager.log_llm_interaction(
@@ -216,13 +279,21 @@ def handle_llm_chat(
             executed_commands=[],
             execution_results=[],
             llm_model=getattr(llm_interface, 'model_name', 'unknown'),
-            context_snapshot=context_manager.format_context_for_llm(context, shell_info)
+            context_snapshot=context_manager.format_context_for_llm(context, shell_info),
+            llm_time_ms=llm_time_ms
         )
         
     except Exception as e:
         console.print(f"[red]Chat Error: {e}[/red]")
 
 
+def _print_scan_stats(context_manager: 'ContextManager'):
+    scan_stats = context_manager.scan_stats
+    console.print(f"[dim]Filesystem context: {scan_stats.last_scan_ms:.1f} ms, directory cache "
+                  f"{scan_stats.hits} hits / {scan_stats.misses} misses "
+                  f"({scan_stats.hit_ratio:.0%}), {scan_stats.total_scan_ms:.0f} ms scanning in total[/dim]")
+
+
 def handle_llm_command(
     prompt: str,
     shell_manager: 'ShellManager',
@@ -230,58 +301,87 @@ def handle_llm_command(
     history_manager: 'HistoryManager',
     llm_interface,
     use_langgraph: bool,
-    stream: bool = True
+    stream: bool = True,
+    parallel: bool = True,
+    recall: bool = True
 ):
     """Handle natural language commands via LLM (llm: mode)"""
     try:
-        # Get current context with session history
-        context = context_manager.get_context(history_manager)
-        
-        # Get shell info and add to context
-        shell_info = shell_manager.get_shell_info()
-        context.shell_info = shell_info
-        
-        # Generate shell commands from LLM
-        if use_langgraph and stream and hasattr(llm_interface, 'generate_commands_streaming'):
-            suggested_commands = llm_interface.generate_commands_streaming(prompt, context)
+        # Commands that worked for a similar request need no round-trip
+        recalled = _offer_recalled_commands(prompt, history_manager) if recall else None
+        if recalled:
+            suggested_commands = recalled.commands
+            llm_model = RECALLED_MODEL
+            llm_time_ms = None
+            context_snapshot = None
         else:
-            suggested_commands = llm_interface.generate_commands(prompt, context)
-        
-        if not suggested_commands:
-            console.print("[yellow]No commands generated. Try rephrasing your request.[/yellow]")
-            return
-        
-        # Display suggestions and get user confirmation
-        console.print(f"\n[yellow]AI suggests:[/yellow]")
-        for i, cmd in enumerate(suggested_commands, 1):
-            console.print(f"  {i}. [cyan]{cmd}[/cyan]")
+            # Get current context with session history
+            context = context_manager.get_context(history_manager)
+            
+            # Get shell info and add to context
+            shell_info = shell_manager.get_shell_info()
+            context.shell_info = shell_info
+            
+            # Generate shell commands from LLM
+            started = time.perf_counter()
+            if use_langgraph and stream and hasattr(llm_interface, 'generate_commands_streaming'):
+                suggested_commands = llm_interface.generate_commands_streaming(prompt, context)
+            else:
+                suggested_commands = llm_interface.generate_commands(prompt, context)
+            llm_time_ms = int((time.perf_counter() - started) * 1000)
+            llm_model = getattr(llm_interface, 'model_name', 'unknown')
+            context_snapshot = context_manager.format_context_for_llm(context, shell_info)
+            
+            if not suggested_commands:
+                console.print("[yellow]No commands generated. Try rephrasing your request.[/yellow]")
+                return
+            
+            # Display suggestions and get user confirmation
+            console.print(f"\n[yellow]AI suggests:[/yellow]")
+            for i, cmd in enumerate(suggested_commands, 1):
+                console.print(f"  {i}. [cyan]{cmd}[/cyan]")
         
-        if confirm_action("Do you want to execute these commands?"):
+        # Picking a recalled suggestion already confirmed it
+        if recalled or confirm_action("Do you want to execute these commands?"):
             executed_commands = []
             execution_results = []
             
-            for cmd in suggested_commands:
-                console.print(f"\n[green]Executing:[/green] {cmd}")
-                # Use live output execution for real-time display
-                result = shell_manager.execute_command_with_live_output(cmd)
-                
-                executed_commands.append(cmd)
-                execution_results.append(result)
+            # Independent read-only commands run side by side; anything with
+            # side effects runs on its own, in the suggested order
+            stages = plan_commands(suggested_commands) if parallel else [
+                ExecutionStage([cmd]) for cmd in suggested_commands]
+            for stage in stages:
+                if stage.parallel:
+                    console.print(f"\n[green]Executing {len(stage.commands)} commands in parallel[/green]")
+                    results = run_parallel_stage(shell_manager, stage.commands, console)
+                    executed_commands.extend(stage.commands)
+                    execution_results.extend(results)
+                    continue
                 
-                # Don't need to display output since it was shown live
-                # Just show error status if command failed
-                if result.return_code != 0:
-                    console.print(f"[red]Command failed with exit code: {result.return_code}[/red]")
+                for cmd in stage.commands:
+                    console.print(f"\n[green]Executing:[/green] {cmd}")
+                    # Use live output execution for real-time display
+                    result = shell_manager.execute_command_with_live_output(cmd)
+                    
+                    executed_commands.append(cmd)
+                    execution_results.append(result)
+                    
+                    # Don't need to display output since it was shown live
+                    # Just show error status if command failed
+                    if result.return_code != 0:
+                        console.print(f"[red]Command failed with exit code: {result.return_code}[/red]")
                     
             # Log the interaction
             history_manager.log_llm_interaction(
                 user_prompt=prompt,
-                llm_response=f"Generated {len(suggested_commands)} command(s)",  # Description for command mode
+                llm_response=(f"Recalled from history entry {recalled.entry_id}" if recalled
+                              else f"Generated {len(suggested_commands)} command(s)"),  # Description for command mode
                 generated_commands=suggested_commands,
                 executed_commands=executed_commands,
                 execution_results=execution_results,
-                llm_model=getattr(llm_interface, 'model_name', 'unknown'),
-                context_snapshot=context_manager.format_context_for_llm(context, shell_info)
+                llm_model=llm_model,
+                context_snapshot=context_snapshot,
+                llm_time_ms=llm_time_ms
             )
         else:
             # Log cancelled interaction
@@ -291,8 +391,9 @@ def handle_llm_command(
                 generated_commands=suggested_commands,
                 executed_commands=[],
                 execution_results=[],
-                llm_model=getattr(llm_interface, 'model_name', 'unknown'),
-                context_snapshot=context_manager.format_context_for_llm(context, shell_info)
+                llm_model=llm_model,
+                context_snapshot=context_snapshot,
+                llm_time_ms=llm_time_ms
             )
             console.print("Commands cancelled")
             
@@ -300,19 +401,101 @@ def handle_llm_command(
         console.print(f"[red]LLM Error: {e}[/red]")
 
 
+def _offer_recalled_commands(prompt: str, history_manager: 'HistoryManager') -> Optional[RecallMatch]:
+    """Show what ran for similar past requests; returns the one picked, if any"""
+    try:
+        matches = history_manager.recall(prompt)
+    except sqlite3.Error:
+        return None  # Never in the way of asking the AI
+    if not matches:
+        return None
+    
+    console.print("\n[yellow]From your history:[/yellow]")
+    for i, match in enumerate(matches, 1):
+        console.print(f"  {i}. [dim]{escape(match.prompt)}[/dim] ({match.score:.0%} similar)")
+        for cmd in match.commands:
+            console.print(f"       [cyan]{escape(cmd)}[/cyan]")
+    choice = choose_option("Run one of these again? Its number, or Enter to ask the AI", len(matches))
+    return matches[choice - 1] if choice else None
+
+
+def handle_job_command(user_input: str, job_manager: 'JobManager') -> bool:
+    """
+    Handle background job syntax and builtins.
+    
+    Returns True if the input was a job command: `<command> &`, `bg <command>`,
+    `jobs`, `fg [%N]` or `kill [-SIGNAL] %N`. A `kill` without a %N job
+    spec is left to the shell.
+    """
+    words = user_input.split()
+    if words[0] in ('pty:', 'pipe:') or user_input.startswith(('pty:', 'pipe:')):
+        return False
+    
+    if words[0] == 'jobs' and len(words) == 1:
+        jobs = job_manager.jobs()
+        if not jobs:
+            console.print("No background jobs")
+        for job in jobs:
+            console.print(f"[{job.id}] {job.status:<8} pid {job.pid:<7} {job.command}")
+        return True
+    
+    if words[0] == 'fg' and len(words) <= 2:
+        job = job_manager.get(words[1] if len(words) > 1 else None)
+        if job is None:
+            console.print("[red]fg: no such job[/red]")
+            return True
+        console.print(f"[dim]{job.command}[/dim]")
+        result = job_manager.wait(job)
+        if result.return_code != 0:
+            console.print(f"[red]Command failed with exit code: {result.return_code}[/red]")
+        return True
+    
+    if words[0] == 'kill' and any(word.startswith('%') for word in words[1:]):
+        sig = signal.SIGTERM
+        for word in words[1:]:
+            if word.startswith('-'):
+                name = word[1:].upper()
+                try:
+                    sig = int(name) if name.isdigit() else signal.Signals(
+                        name if name.startswith('SIG') else f'SIG{name}')
+                except ValueError:
+                    console.print(f"[red]kill: unknown signal {word}[/red]")
+                    return True
+            elif word.startswith('%'):
+                job = job_manager.get(word)
+                if job is None:
+                    console.print(f"[red]kill: {word}: no such job[/red]")
+                else:
+                    job_manager.kill(job, sig)
+        return True
+    
+    command = None
+    if words[0] == 'bg' and len(words) > 1:
+        command = user_input[2:].strip()
+    elif user_input.endswith('&') and not user_input.endswith('&&'):
+        command = user_input[:-1].strip()
+    if not command:
+        return False
+    
+    job = job_manager.start(command)
+    console.print(f"[{job.id}] {job.pid}")
+    return True
+
+
 def handle_shell_command(
     command: str,
     shell_manager: 'ShellManager',
     context_manager: 'ContextManager',
-    history_manager: 'HistoryManager'
+    history_manager: 'HistoryManager',
+    mode: Optional[str] = None
 ):
     """Handle regular shell commands"""
     try:
         # Use live output execution for real-time display
-        result = shell_manager.execute_command_with_live_output(command)
+        result = shell_manager.execute_command_with_live_output(command, mode=mode)
         
-        # Log the command
-        history_manager.log_shell_command(command, result)
+        # Log the command along with its measured wall time
+        history_manager.log_shell_command(command, result, execution_time_ms=result.wall_time_ms)
         
         # Don't need to display output since it was shown live
         # Just show error status if command failed
@@ -331,18 +514,31 @@ app = typer.Typer(
     invoke_without_command=True
 )
 
+history_app = typer.Typer(
+    help="Show, search and export command history",
+    invoke_without_command=True
+)
+app.add_typer(history_app, name="history")
 
-@app.command()
+
+@history_app.callback()
 def history(
-    limit: int = typer.Option(10, "--limit", "-l", help="Number of recent entries to show"),
-    search: str = typer.Option(None, "--search", "-s", help="Search term"),
-    entry_type: str = typer.Option(None, "--type", "-t", help="Entry type (shell_command, llm_interaction)")
+    ctx: typer.Context,
+    limit: int = typer.Option(10, "--limit", "-l", help="Number of entries to show"),
+    search: str = typer.Option(None, "--search", "-s", help='Full-text search: words, "a phrase" or prefix*'),
+    entry_type: str = typer.Option(None, "--type", "-t", help="Entry type (shell_command, llm_interaction)"),
+    failed: bool = typer.Option(False, "--failed", help="Only commands that exited with a non-zero code")
 ):
     """Show command history"""
+    if ctx.invoked_subcommand is not None:
+        return
     history_manager = HistoryManager()
     
     if search:
-        entries = history_manager.search_history(search, entry_type)
+        # Best match first
+        entries = list(reversed(history_manager.search_history(search, entry_type, limit)))
+    elif failed:
+        entries = history_manager.find_entries(entry_type=entry_type, failed=True, limit=limit)
     else:
         entries = history_manager.get_recent_commands(limit, entry_type)
     
@@ -363,18 +559,161 @@ def history(
             console.print(f"Command: [green]{entry_data.get('command', 'unknown')}[/green]")
             if entry_data.get('return_code', 0) != 0:
                 console.print(f"[red]Exit code: {entry_data.get('return_code')}[/red]")
+            if entry_data.get('execution_time_ms') is not None:
+                usage = f"Time: {entry_data['execution_time_ms']} ms"
+                if entry_data.get('user_time_ms') is not None:
+                    usage += (f" (user {entry_data['user_time_ms']} ms, sys {entry_data['sys_time_ms']} ms,"
+                              f" max RSS {entry_data['max_rss_kb']} KB)")
+                console.print(f"[dim]{usage}[/dim]")
         
         elif entry['entry_type'] == 'llm_interaction':
             console.print(f"Prompt: [yellow]{entry_data.get('user_prompt', 'unknown')}[/yellow]")
             generated = entry_data.get('generated_commands', [])
             if generated:
                 console.print(f"Generated: [cyan]{', '.join(generated)}[/cyan]")
+        
+        if entry.get('snippet'):
+            console.print(f"Match: {_highlight_snippet(entry['snippet'])}")
+
+
+@history_app.command("export")
+def history_export(
+    output: str = typer.Argument("-", help="File to write, '-' for stdout; a .gz name is gzipped"),
+    session: Optional[str] = typer.Option(None, "--session", help="Only this session id"),
+    entry_type: Optional[str] = typer.Option(None, "--type", "-t", help="Entry type (shell_command, llm_interaction, ...)"),
+    since: Optional[str] = typer.Option(None, "--since", help="Start time: ISO date/time or an age such as 30d or 12h"),
+    until: Optional[str] = typer.Option(None, "--until", help="End time (exclusive), same formats as --since"),
+    gzip_output: Optional[bool] = typer.Option(None, "--gzip/--no-gzip", help="Compress the output (default: by file name)")
+):
+    """Export history as NDJSON, one entry per line"""
+    try:
+        since_time = _parse_time(since)
+        until_time = _parse_time(until)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    
+    history_manager = HistoryManager()
+    count = history_manager.export_history(
+        output, session_id=session, entry_type=entry_type,
+        since=since_time, until=until_time, compress=gzip_output
+    )
+    history_manager.close()
+    # Keep stdout clean when it carries the export
+    Console(stderr=True).print(f"Exported {count} entries" + (f" to {output}" if output != "-" else ""))
+
+
+@history_app.command("analytics")
+def history_analytics(
+    output_dir: str = typer.Argument(..., help="Directory of the dataset; exports into it are incremental"),
+    format: Optional[str] = typer.Option(None, "--format", "-f", help=f"One of {', '.join(ANALYTICS_FORMATS)} (default: parquet if pyarrow is installed)")
+):
+    """Export history as date-partitioned Parquet or CSV for analysis"""
+    history_manager = HistoryManager()
+    try:
+        report = history_manager.export_analytics(output_dir, format=format)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    finally:
+        history_manager.close()
+    console.print(f"Exported {report.rows} entries after id {report.since_id} "
+                  f"to {report.files} {report.format} files in {output_dir}")
+
+
+@history_app.command("prune")
+def history_prune(
+    max_age_days: Optional[int] = typer.Option(None, "--max-age-days", help="Delete entries older than this (0: keep all)"),
+    payload_days: Optional[int] = typer.Option(None, "--payload-days", help="Drop command output older than this (0: keep all)"),
+    max_size_mb: Optional[int] = typer.Option(None, "--max-size-mb", help="Delete the oldest entries beyond this size (0: no limit)"),
+    vacuum: bool = typer.Option(False, "--vacuum", help="Rebuild the database file afterwards to shrink it fully")
+):
+    """Apply the retention policy now (defaults from NLSH_HISTORY_* variables)"""
+    policy = RetentionPolicy.from_env()
+    for field, value, scale in (('max_age_days', max_age_days, 1),
+                                ('payload_max_age_days', payload_days, 1),
+                                ('max_db_bytes', max_size_mb, 1024 * 1024)):
+        if value is not None:
+            setattr(policy, field, value * scale if value > 0 else None)
+    if not policy.enabled:
+        console.print("[yellow]No retention limits set: pass --max-age-days, --payload-days or "
+                      "--max-size-mb, or set NLSH_HISTORY_* variables[/yellow]")
+        return
+    
+    history_manager = HistoryManager()
+    report = history_manager.prune(policy, vacuum=vacuum)
+    history_manager.close()
+    
+    console.print(f"Deleted {report.deleted_entries} entries, dropped output of "
+                  f"{report.dropped_payloads}, removed {report.deleted_blobs} stored payloads "
+                  f"and {report.deleted_spill_files} spill files")
+    console.print(f"Reclaimed {_format_bytes(report.reclaimed_bytes)}"
+                  + (f", {_format_bytes(report.free_bytes)} free for reuse" if report.free_bytes else ""))
+
+
+@history_app.command("import")
+def history_import(
+    files: Optional[List[str]] = typer.Argument(None, help="History files (default: your bash, zsh and fish history)"),
+    shell: Optional[str] = typer.Option(None, "--format", "-f", help=f"File format: {', '.join(FORMATS)} (default: detected)")
+):
+    """Import existing shell history; importing again only adds new commands"""
+    if shell is not None and shell not in FORMATS:
+        raise typer.BadParameter(f"format must be one of {', '.join(FORMATS)}")
+    sources = [(path, shell) for path in files] if files else default_history_files()
+    if not sources:
+        console.print("[yellow]No shell history files found[/yellow]")
+        return
+    
+    # Commands a configured retention policy would delete straight away are left out
+    max_age_days = RetentionPolicy.from_env().max_age_days
+    since = datetime.now() - timedelta(days=max_age_days) if max_age_days else None
+    
+    history_manager = HistoryManager()
+    try:
+        for path, path_shell in sources:
+            try:
+                report = history_manager.import_shell_history(str(path), path_shell, since=since)
+            except OSError as e:
+                console.print(f"[red]Cannot read {escape(str(path))}: {escape(str(e))}[/red]")
+                continue
+            console.print(f"Imported {report.imported} of {report.commands} commands from "
+                          f"{escape(report.path)} ({report.format})")
+            if report.duplicates:
+                console.print(f"  {report.duplicates} already in the history")
+            if report.too_old:
+                console.print(f"  {report.too_old} older than {max_age_days} days "
+                              f"(NLSH_HISTORY_MAX_AGE_DAYS) left out")
+    finally:
+        history_manager.close()
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    """An ISO date/time, or an age like '30d', '12h' or '45m' before now"""
+    if not value:
+        return None
+    units = {'d': 'days', 'h': 'hours', 'm': 'minutes', 'w': 'weeks'}
+    if value[-1] in units and value[:-1].isdigit():
+        return datetime.now() - timedelta(**{units[value[-1]]: int(value[:-1])})
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"not a date/time or age: {value!r}")
+
+
+def _highlight_snippet(snippet: str) -> str:
+    """Rich markup for a search snippet with the matched terms highlighted"""
+    snippet = ' '.join(snippet.split())
+    return (escape(snippet)
+            .replace(SNIPPET_START, '[bold yellow]')
+            .replace(SNIPPET_END, '[/bold yellow]'))
 
 
 @app.command()
-def stats():
+def stats(
+    rebuild: bool = typer.Option(False, "--rebuild", help="Recompute the statistics from the full history first")
+):
     """Show usage statistics"""
     history_manager = HistoryManager()
+    if rebuild:
+        history_manager.rebuild_rollups()
     stats = history_manager.get_command_stats()
     
     console.print("\n[bold]nlsh Usage Statistics[/bold]")
@@ -393,6 +732,61 @@ def stats():
         console.print("\nRecent activity (last 7 days):")
         for date, count in list(recent_activity.items())[:7]:
             console.print(f"  {date}: {count} commands")
+    
+    shell = stats.get('shell_commands')
+    if shell:
+        console.print(f"\nShell commands: {shell['runs']} run, {shell['failures']} failed "
+                      f"({shell['failure_rate']:.0%})")
+        if shell['mean_time_ms'] is not None:
+            console.print(f"  Mean execution time: {shell['mean_time_ms']} ms")
+    
+    for title, key in (("Most run commands", 'top_commands'),
+                       ("Most failing commands", 'top_failing_commands')):
+        commands = stats.get(key, [])
+        if commands:
+            console.print(f"\n{title}:")
+            for command in commands:
+                mean = f", mean {command['mean_time_ms']} ms" if command['mean_time_ms'] is not None else ""
+                console.print(f"  {escape(_shorten(command['command']))}: {command['runs']} runs, "
+                              f"{command['failures']} failed{mean}")
+    
+    by_model = stats.get('by_model', {})
+    if by_model:
+        console.print("\nLLM interactions by model:")
+        for model, count in by_model.items():
+            console.print(f"  {escape(model)}: {count}")
+    
+    blob_store = stats.get('blob_store', {})
+    if blob_store.get('blobs'):
+        logged = blob_store['logged_bytes']
+        saved = blob_store['saved_bytes']
+        console.print(f"\nStored payloads: {blob_store['blobs']} unique of {blob_store['references']}")
+        console.print(f"  {_format_bytes(blob_store['stored_bytes'])} on disk for "
+                      f"{_format_bytes(logged)} logged "
+                      f"({_format_bytes(saved)}, {saved * 100 // max(logged, 1)}% saved)")
+    
+    if DEFAULT_LLM_CACHE.exists():
+        response_cache = ResponseCache()
+        cache_stats = response_cache.stats()
+        response_cache.close()
+        console.print(f"\nResponse cache: {cache_stats.hits} hits, {cache_stats.misses} misses "
+                      f"({cache_stats.hit_rate:.0%} hit rate)")
+        console.print(f"  {cache_stats.entries} responses in {_format_bytes(cache_stats.size_bytes)}, "
+                      f"{cache_stats.skipped} not stored (tool calls with side effects), "
+                      f"{cache_stats.evictions} evicted")
+
+
+def _shorten(text: str, width: int = 60) -> str:
+    text = ' '.join(text.split())
+    return text if len(text) <= width else text[:width - 3] + "..."
+
+
+def _format_bytes(size: int) -> str:
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
 
 
 if __name__ == "__main__":
@@ -2,10 +2,20 @@
 
 import os
 import platform
+import threading
+import time
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 
+# Directory listings kept between requests, least recently used dropped first
+SCAN_CACHE_DIRS = 256
+
+# A directory changed this recently may change again within the same mtime
+# tick (whole seconds on some filesystems), so its listing is not kept
+RACY_MTIME_S = 2.0
+
 
 @dataclass
 class FileInfo:
@@ -28,13 +38,32 @@ class ContextInfo:
     session_history: Optional[List[Dict]] = None
 
 
+@dataclass
+class ScanStats:
+    """Directory scans served from the cache, and the time spent scanning"""
+    hits: int = 0
+    misses: int = 0
+    last_scan_ms: float = 0.0  # Filesystem context of the latest request
+    total_scan_ms: float = 0.0
+    
+    @property
+    def hit_ratio(self) -> float:
+        return self.hits / max(self.hits + self.misses, 1)
+
+
 class ContextManager:
     """Manages context information for LLM requests"""
     
-    def __init__(self, max_depth: int = 3, max_files_per_dir: int = 50):
+    def __init__(self, max_depth: int = 3, max_files_per_dir: int = 50,
+                 scan_cache_dirs: int = SCAN_CACHE_DIRS):
         self.max_depth = max_depth
         self.max_files_per_dir = max_files_per_dir
-        
+        self.scan_cache_dirs = scan_cache_dirs
+        # path -> (stamp of the directory when scanned, its entries)
+        self._scan_cache: 'OrderedDict[str, Tuple[tuple, List[FileInfo]]]' = OrderedDict()
+        self._scan_lock = threading.Lock()
+        self.scan_stats = ScanStats()
+    
     def get_context(self, history_manager=None) -> ContextInfo:
         """Get complete context information"""
         cwd = os.getcwd()
@@ -56,11 +85,8 @@ class ContextManager:
     def _get_session_history(self, history_manager, limit: int = 15) -> List[Dict]:
         """Get formatted session history for context"""
         try:
-            # Get recent entries from current session
-            entries = history_manager.get_session_history()
-            
-            # Limit to recent entries and format for context
-            recent_entries = entries[-limit:] if len(entries) > limit else entries
+            # Only the latest entries of the current session are read
+            recent_entries = history_manager.get_recent_session_entries(limit)
             
             formatted_history = []
             for entry in recent_entries:
@@ -121,6 +147,7 @@ class ContextManager:
     def _get_filesystem_context(self, root_path: str) -> Dict[str, List[FileInfo]]:
         """Get recursive filesystem context with depth limits"""
         filesystem = {}
+        started = time.perf_counter()
         
         try:
             # Scan current directory and subdirectories
@@ -151,36 +178,76 @@ class ContextManager:
         except Exception as e:
             # If filesystem scanning fails, at least provide current directory info
             filesystem["."] = []
-            
+        
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.scan_stats.last_scan_ms = elapsed_ms
+        self.scan_stats.total_scan_ms += elapsed_ms
         return filesystem
     
     def _scan_directory(self, path: str, depth: int = 0) -> List[FileInfo]:
-        """Scan a single directory and return file information"""
+        """
+        Scan a single directory and return file information.
+        
+        Listings are cached per directory and reused while the directory's
+        inode and mtime are unchanged, i.e. no entry was added, removed or
+        renamed. Sizes and times of files rewritten in place are not noticed
+        until then.
+        """
+        # Don't scan if we're at max depth
+        if depth >= self.max_depth:
+            return []
+        
+        try:
+            stat_info = os.stat(path)
+        except OSError:
+            return []
+        stamp = (stat_info.st_dev, stat_info.st_ino, stat_info.st_mtime_ns)
+        
+        with self._scan_lock:
+            cached = self._scan_cache.get(path)
+            if cached and cached[0] == stamp:
+                self._scan_cache.move_to_end(path)
+                self.scan_stats.hits += 1
+                return list(cached[1])
+            self.scan_stats.misses += 1
+        
+        files = self._read_directory(path)
+        
+        if time.time() - stat_info.st_mtime >= RACY_MTIME_S:
+            with self._scan_lock:
+                self._scan_cache[path] = (stamp, files)
+                self._scan_cache.move_to_end(path)
+                while len(self._scan_cache) > self.scan_cache_dirs:
+                    self._scan_cache.popitem(last=False)
+        return list(files)
+    
+    def _read_directory(self, path: str) -> List[FileInfo]:
         files = []
         
         try:
-            # Don't scan if we're at max depth
-            if depth >= self.max_depth:
-                return files
-                
-            entries = list(os.listdir(path))
+            # The entry types come with the listing, so only kept entries are stat'ed
+            with os.scandir(path) as scanned:
+                entries = []
+                for entry in scanned:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    entries.append((entry, is_dir))
             
             # Sort entries: directories first, then files, both alphabetically
-            entries.sort(key=lambda x: (not os.path.isdir(os.path.join(path, x)), x.lower()))
+            entries.sort(key=lambda item: (not item[1], item[0].name.lower()))
             
             # Limit number of files to prevent overwhelming context
             entries = entries[:self.max_files_per_dir]
             
-            for entry in entries:
+            for entry, is_dir in entries:
                 try:
-                    entry_path = os.path.join(path, entry)
-                    stat_info = os.stat(entry_path)
-                    
-                    is_dir = os.path.isdir(entry_path)
+                    stat_info = entry.stat()
                     
                     files.append(FileInfo(
-                        name=entry,
-                        path=entry_path,
+                        name=entry.name,
+                        path=entry.path,
                         is_dir=is_dir,
                         size=None if is_dir else stat_info.st_size,
                         modified=stat_info.st_mtime
@@ -3,12 +3,130 @@
 import sqlite3
 import json
 import os
-from datetime import datetime
+import sys
+import gzip
+import glob
+import atexit
+import random
+import signal
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta
 from dataclasses import dataclass, asdict
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterator
 from pathlib import Path
 
 from .shell import CommandResult
+from .capture import head_tail_excerpt, cleanup_spill_files
+from .history_blobs import (BLOB_THRESHOLD_BYTES, add_refs, blob_stats, externalize, referenced_hashes,
+                            remove_unreferenced, resolve)
+from .history_import import IMPORT_BATCH_ROWS, IMPORT_CACHE_KIB, PARSERS, ImportReport, detect_format
+from .history_retention import (RETENTION_BATCH_ROWS, RETENTION_INTERVAL_S, RETENTION_STEP_S,
+                                VACUUM_STEP_PAGES, RetentionPolicy, RetentionReport, RetentionRun,
+                                drop_payload, page_size, size_cutoff_id, used_bytes)
+from .history_analytics import (ANALYTICS_BATCH_ROWS, AnalyticsReport, PartitionedWriter,
+                                default_format, flatten, read_watermark, write_watermark)
+from . import history_backfill, history_recall, history_rollups
+from .history_recall import RecallMatch
+from .history_schema import TYPED_COLUMNS, backfill_typed_columns, migrate, to_epoch_ms, typed_columns
+
+# Longest output/error text stored inline in a history row; anything larger
+# is kept as a head/tail excerpt (the full stream stays in its spill file)
+MAX_STORED_OUTPUT_CHARS = 16 * 1024
+
+# How long a statement waits for another nlsh process holding the write lock
+BUSY_TIMEOUT_MS = 5000
+
+# A write transaction still locked out after BUSY_TIMEOUT_MS is retried this
+# many times, backing off exponentially (with jitter) from WRITE_BACKOFF_S
+WRITE_RETRIES = 3
+WRITE_BACKOFF_S = 0.1
+
+# SQLite checkpoints the WAL every WAL_AUTOCHECKPOINT_PAGES pages, but cannot
+# start it over while another session is reading. Each session checks at most
+# every CHECKPOINT_INTERVAL_S between writes and, once the WAL has grown past
+# WAL_SIZE_LIMIT_BYTES, forces a checkpoint that empties it, waiting at most
+# CHECKPOINT_BUSY_TIMEOUT_MS for other sessions. After any checkpoint the
+# file is cut back to WAL_SIZE_LIMIT_BYTES.
+WAL_AUTOCHECKPOINT_PAGES = 1000
+WAL_SIZE_LIMIT_BYTES = 16 * 1024 * 1024
+CHECKPOINT_INTERVAL_S = 1
+CHECKPOINT_BUSY_TIMEOUT_MS = 200
+
+# Queued entries that cannot be written before exit, because the database
+# stays locked, are set aside in <db>.pending-<pid>-<ns>.jsonl files; the
+# next HistoryManager to open the database writes them
+PENDING_FILE_PATTERN = '.pending-*.jsonl'
+
+# Prepared statements kept per connection (sqlite3 caches them by SQL text)
+STATEMENT_CACHE_SIZE = 128
+
+# Write-behind defaults: flush once this many entries are queued, or after
+# this many seconds, whichever comes first
+FLUSH_BATCH_SIZE = 64
+FLUSH_INTERVAL_S = 0.5
+
+# Rows fetched per query by iter_entries; the lock is released in between
+ITER_BATCH_SIZE = 500
+
+# Latest entries of the current session kept in memory for context building
+SESSION_WINDOW_SIZE = 50
+
+# Full-text index over the searchable parts of each entry. The rowid is the
+# history_entries id; the writer adds rows (payloads may be in the blob store,
+# out of a trigger's reach) and a trigger removes them.
+FTS_SCHEMA_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+        command, prompt, response, output, tool, tokenize='unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS history_fts_delete AFTER DELETE ON history_entries BEGIN
+        DELETE FROM history_fts WHERE rowid = old.id;
+    END
+    """,
+    # Indexing used to be done by this trigger, on the inline JSON
+    "DROP TRIGGER IF EXISTS history_fts_insert",
+]
+
+INSERT_FTS_SQL = """
+    INSERT OR REPLACE INTO history_fts (rowid, command, prompt, response, output, tool)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+# bm25 weights for command, prompt, response, output and tool columns
+FTS_SEARCH_SQL = """
+    SELECT history_entries.*,
+           snippet(history_fts, -1, char(1), char(2), '…', 12) AS snippet,
+           bm25(history_fts, 10.0, 5.0, 2.0, 1.0, 2.0) AS rank
+    FROM history_fts JOIN history_entries ON history_entries.id = history_fts.rowid
+    WHERE history_fts MATCH ?
+"""
+
+# Markers around matched terms in search snippets
+SNIPPET_START = '\x01'
+SNIPPET_END = '\x02'
+
+# Imported shell history: skipped when the same command is already stored at
+# the same time (found through idx_command)
+IMPORT_ENTRY_SQL = """
+    INSERT INTO history_entries (timestamp, session_id, entry_type, cwd, data, ts_epoch, command)
+    SELECT :timestamp, :session_id, 'shell_command', '', :data, :ts_epoch, :command
+    WHERE NOT EXISTS (
+        SELECT 1 FROM history_entries WHERE command = :command AND ts_epoch = :ts_epoch
+    )
+"""
+
+ENTRY_COLUMNS = ['timestamp', 'session_id', 'entry_type', 'cwd', 'data', *TYPED_COLUMNS]
+
+INSERT_ENTRY_SQL = f"""
+    INSERT INTO history_entries ({', '.join(ENTRY_COLUMNS)})
+    VALUES ({', '.join(':' + name for name in ENTRY_COLUMNS)})
+"""
 
 
 @dataclass
@@ -28,7 +146,16 @@ class ShellCommandEntry(HistoryEntry):
     output: str
     error: str
     return_code: int
-    execution_time_ms: Optional[int] = None
+    execution_time_ms: Optional[int] = None  # Wall time
+    user_time_ms: Optional[int] = None  # CPU time of the command and its children
+    sys_time_ms: Optional[int] = None
+    max_rss_kb: Optional[int] = None  # Peak resident memory of the largest process
+    output_size: Optional[int] = None  # Full size in bytes when output was truncated
+    output_spill: Optional[str] = None  # Spill file holding the full output
+    error_size: Optional[int] = None
+    error_spill: Optional[str] = None
+    output_sha256: Optional[str] = None  # Set for binary output, stored as a summary
+    error_sha256: Optional[str] = None
 
 
 @dataclass
@@ -41,6 +168,8 @@ class LLMInteractionEntry(HistoryEntry):
     execution_results: List[Dict[str, Any]] = None  # List of CommandResult dicts
     llm_model: str = "unknown"
     context_snapshot: Optional[str] = None
+    interaction_id: Optional[str] = None  # Referenced by the tool calls it made
+    llm_time_ms: Optional[int] = None  # Time taken to generate the response
 
 
 @dataclass
@@ -52,10 +181,137 @@ class ToolCallEntry(HistoryEntry):
     parent_interaction_id: Optional[str] = None  # Link to parent LLM interaction
 
 
+# Managers with a write-behind queue, flushed at exit and on SIGTERM/SIGHUP
+_open_managers: 'weakref.WeakSet[HistoryManager]' = weakref.WeakSet()
+_exit_hooks_installed = False
+
+
+def _flush_open_managers():
+    for manager in list(_open_managers):
+        try:
+            manager._flush_or_set_aside()
+        except Exception:
+            pass
+
+
+def _is_locked(error: sqlite3.Error) -> bool:
+    """Whether an error means another connection holds the lock (SQLITE_BUSY/LOCKED)"""
+    return isinstance(error, sqlite3.OperationalError) and 'locked' in str(error)
+
+
+def _retry_locked(operation):
+    """Run `operation`, retrying with backoff while the database is locked"""
+    for attempt in range(WRITE_RETRIES + 1):
+        try:
+            return operation()
+        except sqlite3.OperationalError as e:
+            if not _is_locked(e) or attempt == WRITE_RETRIES:
+                raise
+        time.sleep(WRITE_BACKOFF_S * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def _install_exit_hooks():
+    """Flush queued history at interpreter exit and on termination signals"""
+    global _exit_hooks_installed
+    if _exit_hooks_installed:
+        return
+    _exit_hooks_installed = True
+    atexit.register(_flush_open_managers)
+    
+    for signum in (signal.SIGTERM, signal.SIGHUP):
+        try:
+            previous = signal.getsignal(signum)
+            if previous is signal.SIG_IGN:
+                continue
+            
+            def handler(signum, frame, previous=previous):
+                _flush_open_managers()
+                if callable(previous):
+                    previous(signum, frame)
+                else:
+                    # Die from the signal as we would have without the hook
+                    signal.signal(signum, signal.SIG_DFL)
+                    os.kill(os.getpid(), signum)
+            
+            signal.signal(signum, handler)
+        except ValueError:
+            break  # Not the main thread; atexit still covers normal exits
+
+
+def _quote_fts_terms(text: str) -> str:
+    """Turn free text into an FTS5 query matching each word literally"""
+    return ' '.join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+
+def _fts_columns(entry_type: str, data: Dict[str, Any]) -> tuple:
+    """Text indexed for an entry: command, prompt, response, output and tool"""
+    def text(*values) -> str:
+        return ' '.join(str(value) for value in values if value)
+    
+    results = data.get('execution_results') or []
+    commands = data.get('generated_commands') or data.get('executed_commands') or []
+    tool_args = data.get('tool_args')
+    return (
+        text(data.get('command'), *commands),
+        text(data.get('user_prompt')),
+        text(data.get('llm_response')),
+        text(data.get('output'), data.get('error'), data.get('tool_result'),
+             *(result.get('output') for result in results if isinstance(result, dict))),
+        text(data.get('tool_name'), json.dumps(tool_args) if tool_args else None),
+    )
+
+
+def _escape_glob(text: str) -> str:
+    """Quote GLOB wildcards so text matches literally"""
+    return ''.join(f'[{c}]' if c in '*?[' else c for c in text)
+
+
 class HistoryManager:
-    """Manages command and interaction history in SQLite"""
+    """
+    Manages command and interaction history in SQLite.
     
-    def __init__(self, db_path: str = None):
+    One connection is kept open for the lifetime of the manager and shared
+    between threads behind a lock (background jobs log from their own
+    threads). The database runs in WAL mode with synchronous=NORMAL, so a
+    logged entry costs a WAL append rather than an fsync of the database,
+    and readers in other nlsh processes are not blocked by writers.
+    
+    With `write_behind` (the default), logging only queues the entry. A
+    writer thread inserts queued entries in one transaction once
+    `flush_batch_size` are waiting or `flush_interval` seconds have passed.
+    Queries see queued entries too: `get_session_history` merges them in,
+    and the other queries flush the queue first.
+    
+    The latest `session_window` entries of the current session are also
+    kept in memory, as logged, so `get_recent_session_entries` (called for
+    every LLM request) costs the same however long the session has run.
+    
+    Strings of `blob_threshold` bytes or more (outputs, tool results,
+    context snapshots) are compressed into a content-addressed blob store
+    when written, so repeated output is stored once; reads restore them.
+    
+    Several nlsh processes can share the database. Writes take the write
+    lock at the start of their transaction and retry with backoff while
+    other sessions hold it; entries still unwritten at exit are set aside
+    in a file for the next session to add. The writer thread also keeps the
+    WAL from growing while other sessions read.
+    
+    With a `retention` policy, the writer thread also enforces it while
+    nothing is queued, i.e. between commands: a small batch of old entries
+    at a time, followed by an incremental vacuum. `prune` does the same in
+    one go.
+    
+    The schema is versioned (see history_schema). Opening an older database
+    upgrades it in place; rows written before the upgrade get their typed
+    columns filled in by a background thread, in short transactions.
+    """
+    
+    def __init__(self, db_path: str = None, max_output_chars: int = MAX_STORED_OUTPUT_CHARS,
+                 write_behind: bool = True, flush_batch_size: int = FLUSH_BATCH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL_S,
+                 blob_threshold: int = BLOB_THRESHOLD_BYTES,
+                 session_window: int = SESSION_WINDOW_SIZE,
+                 retention: Optional[RetentionPolicy] = None):
         if db_path is None:
             # Default to user's home directory
             home_dir = Path.home()
@@ -64,9 +320,254 @@ class HistoryManager:
             db_path = nlsh_dir / 'history.db'
             
         self.db_path = str(db_path)
+        self.max_output_chars = max_output_chars
+        self.blob_threshold = blob_threshold
         self.session_id = self._generate_session_id()
+        # A policy without limits has nothing for the writer thread to do
+        self.retention = retention if retention is not None and retention.enabled else None
+        self._next_retention = 0.0  # time.monotonic() of the next background run
+        self._retention_run: Optional[RetentionRun] = None
+        self._next_checkpoint = 0.0
         self.current_interaction_id = None  # Track current LLM interaction for tool calls
+        self._lock = threading.RLock()
+        self._closing = False
+        self._conn = _retry_locked(self._connect)
         self._init_database()
+        self._add_set_aside_entries()
+        
+        self.write_behind = write_behind
+        self.flush_batch_size = flush_batch_size
+        self.flush_interval = flush_interval
+        self._pending: List[Dict[str, Any]] = []  # Rows waiting for the writer thread
+        self._pending_changed = threading.Condition()
+        # Guarded by _pending_changed, like the queue
+        self._window: deque = deque(maxlen=session_window)
+        self._session_entries = 0  # Entries logged in this session, for the window
+        self._writer = None
+        self._migrator = None
+        if self._needs_backfill():
+            self._migrator = threading.Thread(target=self._backfill_loop,
+                                              name="nlsh-history-migrate", daemon=True)
+            self._migrator.start()
+        if write_behind:
+            self._writer = threading.Thread(target=self._write_loop, name="nlsh-history-writer",
+                                            daemon=True)
+            self._writer.start()
+            _open_managers.add(self)
+            _install_exit_hooks()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open the shared connection and configure it for a write-heavy log"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.row_factory = sqlite3.Row
+        try:
+            # Only takes effect for a new database; `nlsh history prune --vacuum`
+            # converts an existing one
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            conn.execute(f"PRAGMA wal_autocheckpoint={WAL_AUTOCHECKPOINT_PAGES}")
+            conn.execute(f"PRAGMA journal_size_limit={WAL_SIZE_LIMIT_BYTES}")
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn
+    
+    @contextmanager
+    def _connection(self):
+        """Use the shared connection; commits on success, rolls back on error"""
+        with self._lock:
+            with self._conn:
+                yield self._conn
+    
+    @contextmanager
+    def _write_transaction(self):
+        """
+        Like _connection, but for writes: the write lock is taken up front
+        with BEGIN IMMEDIATE, so what the transaction reads cannot change
+        under it, and it cannot fail half way with SQLITE_BUSY (which the
+        busy timeout does not cover). Retried with backoff while locked.
+        """
+        with self._lock:
+            _retry_locked(lambda: self._conn.execute("BEGIN IMMEDIATE"))
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
+    
+    def _write_loop(self):
+        """Writer thread: flush the queue when it is full enough or old enough"""
+        while True:
+            with self._pending_changed:
+                if not self._closing and len(self._pending) < self.flush_batch_size:
+                    self._pending_changed.wait(self.flush_interval)
+                closing = self._closing
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass  # Entries stay queued; retried on the next round
+            if closing:
+                return
+            if not self._pending:
+                self._checkpoint_tick()
+            if self.retention is not None and not self._pending:
+                self._retention_tick()
+    
+    def _checkpoint_tick(self):
+        """Between writes: empty the WAL once it has grown too large"""
+        if time.monotonic() < self._next_checkpoint:
+            return
+        self._next_checkpoint = time.monotonic() + CHECKPOINT_INTERVAL_S
+        try:
+            if os.path.getsize(self.db_path + '-wal') > WAL_SIZE_LIMIT_BYTES:
+                self.checkpoint()
+        except (OSError, sqlite3.Error):
+            pass  # No WAL yet, or another session is checkpointing
+    
+    def checkpoint(self) -> bool:
+        """
+        Copy the WAL into the database and empty it, waiting at most
+        CHECKPOINT_BUSY_TIMEOUT_MS for other sessions' transactions.
+        Returns False when some of it could not be copied yet.
+        """
+        self.flush()
+        with self._lock:
+            self._conn.execute(f"PRAGMA busy_timeout={CHECKPOINT_BUSY_TIMEOUT_MS}")
+            try:
+                busy, pages, copied = self._conn.execute(
+                    "PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+            finally:
+                self._conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        return not busy and pages == copied
+    
+    def _retention_tick(self):
+        """Writer thread, while idle: a few milliseconds of retention work"""
+        if time.monotonic() < self._next_retention:
+            return
+        deadline = time.monotonic() + RETENTION_STEP_S
+        try:
+            while time.monotonic() < deadline:
+                if self._pending or self._closing:
+                    return  # Let the new entries through first
+                if self._retention_run is None:
+                    self._retention_run = RetentionRun(self.retention)
+                if not self._retention_batch(self._retention_run):
+                    if not self._vacuum_step():
+                        self._cleanup_spill_files(self._retention_run)
+                        self._retention_run = None
+                        self._next_retention = time.monotonic() + RETENTION_INTERVAL_S
+                    return
+        except sqlite3.Error:
+            # e.g. another nlsh holding the lock; try again later
+            self._next_retention = time.monotonic() + self.flush_interval * 10
+    
+    def flush(self):
+        """Write all queued entries in a single transaction"""
+        # Holding the connection lock while the batch is in flight means a
+        # reader sees each entry either in the queue or in the database
+        with self._lock:
+            with self._pending_changed:
+                batch, self._pending = self._pending, []
+            if not batch or self._conn is None:
+                return
+            try:
+                with self._write_transaction() as conn:
+                    self._insert_rows(conn, batch)
+            except sqlite3.Error:
+                with self._pending_changed:
+                    self._pending[:0] = batch
+                raise
+    
+    def _flush_or_set_aside(self):
+        """Flush, or set the queue aside if the database cannot be written"""
+        try:
+            self.flush()
+        except sqlite3.Error:
+            with self._pending_changed:
+                batch, self._pending = self._pending, []
+            self._set_aside(batch)
+    
+    def _set_aside(self, rows: List[Dict[str, Any]]):
+        """Save rows to a file for the next session opening the database to add"""
+        if not rows:
+            return
+        path = self.db_path + PENDING_FILE_PATTERN.replace('*', f"{os.getpid()}-{time.time_ns()}")
+        with open(path, 'w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row) + '\n')
+    
+    def _add_set_aside_entries(self):
+        """Write entries other sessions set aside when they could not"""
+        for path in glob.glob(glob.escape(self.db_path) + PENDING_FILE_PATTERN):
+            # Claim the file first, so two sessions starting together do not
+            # both add its entries
+            claimed = f"{path}.{os.getpid()}"
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            try:
+                with open(claimed, encoding='utf-8') as f:
+                    rows = [json.loads(line) for line in f if line.strip()]
+                with self._write_transaction() as conn:
+                    self._insert_rows(conn, rows)
+            except (OSError, ValueError, sqlite3.Error):
+                os.rename(claimed, path)  # Left for a later session
+                continue
+            os.remove(claimed)
+    
+    def _needs_backfill(self) -> bool:
+        with self._connection() as conn:
+            return conn.execute("""
+                SELECT EXISTS (SELECT 1 FROM history_entries WHERE ts_epoch IS NULL)
+                    OR EXISTS (SELECT 1 FROM history_backfills)
+            """).fetchone()[0] == 1
+    
+    def _backfill_loop(self):
+        """
+        Migration thread: fill in typed columns, then the indexes of entries
+        stored before they existed, a chunk per short transaction
+        """
+        while not self._closing:
+            try:
+                with self._write_transaction() as conn:
+                    if backfill_typed_columns(conn) == 0 and not self._fill_indexes(conn):
+                        return
+            except sqlite3.Error:
+                return  # Picked up again the next time nlsh starts
+    
+    def _fill_indexes(self, conn: sqlite3.Connection) -> bool:
+        """Add a chunk of entries to a pending index; False when none is pending"""
+        if self.has_fts and history_backfill.fill(conn, history_backfill.FTS, self._fill_fts):
+            return True
+        return (history_backfill.fill(conn, history_backfill.ROLLUPS, history_rollups.add_range)
+                or history_backfill.fill(conn, history_backfill.RECALL, history_recall.index_range))
+    
+    def close(self):
+        """Flush queued entries, stop the writer and close the connection"""
+        self._closing = True
+        if self._migrator is not None:
+            self._migrator.join()
+            self._migrator = None
+        if self._writer is not None:
+            with self._pending_changed:
+                self._pending_changed.notify()
+            self._writer.join()
+            self._writer = None
+            _open_managers.discard(self)
+        self._flush_or_set_aside()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
     
     def _generate_session_id(self) -> str:
         """Generate a unique session ID"""
@@ -77,28 +578,74 @@ class HistoryManager:
         return datetime.now().strftime("%Y%m%d_%H%M%S_%f")
     
     def _init_database(self):
-        """Initialize the SQLite database with required tables"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS history_entries (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT NOT NULL,
-                    session_id TEXT NOT NULL,
-                    entry_type TEXT NOT NULL,
-                    cwd TEXT NOT NULL,
-                    data TEXT NOT NULL  -- JSON data specific to entry type
-                )
-            """)
-            
-            # Create indexes for better query performance
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_session_id ON history_entries(session_id)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON history_entries(timestamp)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_entry_type ON history_entries(entry_type)")
-            
-            conn.commit()
+        """Create or upgrade the schema and the full-text index"""
+        with self._lock:
+            _retry_locked(lambda: migrate(self._conn))
+        with self._write_transaction() as conn:
+            self.has_fts = self._init_fts(conn)
+    
+    def _init_fts(self, conn: sqlite3.Connection) -> bool:
+        """
+        Create the full-text index. Entries already stored are added to it
+        in the background (see _backfill_loop), not while holding up startup.
+        """
+        try:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'history_fts'").fetchone()
+            for statement in FTS_SCHEMA_SQL:
+                conn.execute(statement)
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5; search falls back to LIKE
+            return False
+        if not exists:
+            history_backfill.schedule(conn, history_backfill.FTS)
+        return True
+    
+    def _fill_fts(self, conn: sqlite3.Connection, after_id: int, up_to_id: int):
+        rows = conn.execute("SELECT id, entry_type, data FROM history_entries WHERE id > ? AND id <= ?",
+                            (after_id, up_to_id)).fetchall()
+        datas = resolve(conn, [json.loads(row['data']) for row in rows])
+        conn.executemany(INSERT_FTS_SQL, [
+            (row['id'], *_fts_columns(row['entry_type'], data))
+            for row, data in zip(rows, datas)
+        ])
+    
+    def _insert_rows(self, conn: sqlite3.Connection, rows: List[Dict[str, Any]]):
+        """
+        Insert entries, moving large payloads to the blob store, indexing
+        them and adding them to the statistics rollups
+        """
+        rollup_rows = []
+        for row in rows:
+            data = json.loads(row['data'])
+            rollup_rows.append(dict(row, execution_time_ms=data.get('execution_time_ms')))
+            stored, hashes = externalize(conn, data, self.blob_threshold)
+            if hashes:
+                row = dict(row, data=json.dumps(stored))
+            entry_id = conn.execute(INSERT_ENTRY_SQL, row).lastrowid
+            add_refs(conn, entry_id, hashes)
+            if self.has_fts:
+                conn.execute(INSERT_FTS_SQL, (entry_id, *_fts_columns(row['entry_type'], data)))
+            if row['entry_type'] == 'llm_interaction':
+                history_recall.index(conn, entry_id, row['cwd'], data)
+        history_rollups.apply(conn, rollup_rows)
+    
+    def _load_entries(self, conn: sqlite3.Connection, rows,
+                      resolve_blobs: bool = True) -> List[Dict[str, Any]]:
+        """Entry dicts for fetched rows, with data decoded and blobs restored"""
+        entries = [dict(row) for row in rows]
+        datas = [json.loads(entry['data']) for entry in entries]
+        if resolve_blobs:
+            datas = resolve(conn, datas)
+        for entry, data in zip(entries, datas):
+            entry['data'] = data
+        return entries
     
     def log_shell_command(self, command: str, result: CommandResult, execution_time_ms: int = None):
-        """Log a shell command execution"""
+        """Log a shell command execution, with the timings measured for it"""
+        result_data = self._result_to_dict(result)
+        if execution_time_ms is None:
+            execution_time_ms = result.wall_time_ms
         entry = ShellCommandEntry(
             id=None,
             timestamp=datetime.now(),
@@ -106,10 +653,19 @@ class HistoryManager:
             entry_type='shell_command',
             cwd=result.cwd,
             command=command,
-            output=result.output,
-            error=result.error,
+            output=result_data['output'],
+            error=result_data['error'],
             return_code=result.return_code,
-            execution_time_ms=execution_time_ms
+            execution_time_ms=execution_time_ms,
+            user_time_ms=result.user_time_ms,
+            sys_time_ms=result.sys_time_ms,
+            max_rss_kb=result.max_rss_kb,
+            output_size=result_data.get('output_size'),
+            output_spill=result_data.get('output_spill'),
+            error_size=result_data.get('error_size'),
+            error_spill=result_data.get('error_spill'),
+            output_sha256=result_data.get('output_sha256'),
+            error_sha256=result_data.get('error_sha256')
         )
         
         self._save_entry(entry)
@@ -117,12 +673,13 @@ class HistoryManager:
     def log_llm_interaction(self, user_prompt: str, llm_response: str = None, 
                           generated_commands: List[str] = None, executed_commands: List[str] = None, 
                           execution_results: List[CommandResult] = None,
-                          llm_model: str = "unknown", context_snapshot: str = None):
+                          llm_model: str = "unknown", context_snapshot: str = None,
+                          llm_time_ms: int = None):
         """Log an LLM interaction with full details"""
         # Convert CommandResult objects to dicts for JSON serialization
         result_dicts = []
         if execution_results:
-            result_dicts = [asdict(result) for result in execution_results]
+            result_dicts = [self._result_to_dict(result) for result in execution_results]
         
         # Generate interaction ID for this LLM interaction
         self.current_interaction_id = self._generate_interaction_id()
@@ -139,12 +696,24 @@ class HistoryManager:
             executed_commands=executed_commands or [],
             execution_results=result_dicts,
             llm_model=llm_model,
-            context_snapshot=context_snapshot
+            context_snapshot=context_snapshot,
+            interaction_id=self.current_interaction_id,
+            llm_time_ms=llm_time_ms
         )
         
         self._save_entry(entry)
         return self.current_interaction_id
     
+    def _result_to_dict(self, result: CommandResult) -> Dict[str, Any]:
+        """Serialize a CommandResult with its output bounded for storage"""
+        data = result.to_dict()
+        for key in ('output', 'error'):
+            text = data[key] or ''
+            if len(text) > self.max_output_chars:
+                data[key] = head_tail_excerpt(text, self.max_output_chars)
+                data.setdefault(f'{key}_size', len(text.encode('utf-8', errors='replace')))
+        return data
+    
     def log_tool_call(self, tool_name: str, tool_args: Dict[str, Any], tool_result: str):
         """Log a tool call during LLM processing"""
         entry = ToolCallEntry(
@@ -175,85 +744,230 @@ class HistoryManager:
         self._save_entry(entry, extra_data=context_data)
     
     def _save_entry(self, entry: HistoryEntry, extra_data: Dict[str, Any] = None):
-        """Save a history entry to the database"""
-        with sqlite3.connect(self.db_path) as conn:
-            # Prepare data for JSON serialization
-            if extra_data:
-                data = extra_data
-            else:
-                data = asdict(entry)
-                # Remove fields that are stored separately
-                data.pop('id', None)
-                data.pop('timestamp', None)
-                data.pop('session_id', None)
-                data.pop('entry_type', None)
-                data.pop('cwd', None)
-            
-            conn.execute("""
-                INSERT INTO history_entries (timestamp, session_id, entry_type, cwd, data)
-                VALUES (?, ?, ?, ?, ?)
-            """, (
-                entry.timestamp.isoformat(),
-                entry.session_id,
-                entry.entry_type,
-                entry.cwd,
-                json.dumps(data, default=str)  # default=str handles datetime objects
-            ))
-            
-            conn.commit()
+        """Save a history entry, or queue it for the writer thread"""
+        # Prepare data for JSON serialization
+        if extra_data:
+            data = extra_data
+        else:
+            data = asdict(entry)
+            # Remove fields that are stored separately
+            data.pop('id', None)
+            data.pop('timestamp', None)
+            data.pop('session_id', None)
+            data.pop('entry_type', None)
+            data.pop('cwd', None)
+        
+        timestamp = entry.timestamp.isoformat()
+        row = typed_columns(entry.entry_type, timestamp, data)
+        row.update(
+            timestamp=timestamp,
+            session_id=entry.session_id,
+            entry_type=entry.entry_type,
+            cwd=entry.cwd,
+            data=json.dumps(data, default=str)  # default=str handles datetime objects
+        )
+        
+        with self._pending_changed:
+            if entry.session_id == self.session_id:
+                # Decoded from the JSON, so it matches what a read returns
+                self._window.append(dict(row, id=None, data=json.loads(row['data'])))
+                self._session_entries += 1
+        
+        if not self.write_behind:
+            try:
+                with self._write_transaction() as conn:
+                    self._insert_rows(conn, [row])
+            except sqlite3.Error as e:
+                if not _is_locked(e):
+                    raise
+                self._set_aside([row])
+            self._checkpoint_tick()  # No writer thread to do it
+            return
+        
+        with self._pending_changed:
+            self._pending.append(row)
+            if len(self._pending) >= self.flush_batch_size:
+                self._pending_changed.notify()
     
     def get_session_history(self, session_id: str = None) -> List[Dict[str, Any]]:
         """Get history for a specific session"""
         if session_id is None:
             session_id = self.session_id
             
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row  # Enable dict-like access
+        # Hold the lock so each entry is seen either stored or still queued
+        with self._lock:
+            entries = list(self.iter_entries(session_id=session_id, flush=False))
             
-            cursor = conn.execute("""
-                SELECT * FROM history_entries 
-                WHERE session_id = ? 
-                ORDER BY timestamp ASC
-            """, (session_id,))
-            
-            entries = []
-            for row in cursor.fetchall():
-                entry = dict(row)
-                entry['data'] = json.loads(entry['data'])
-                entries.append(entry)
+            # Entries still queued for the writer are newer than any stored one
+            with self._pending_changed:
+                pending = [row for row in self._pending if row['session_id'] == session_id]
+            for row in pending:
+                entries.append(dict(row, id=None, data=json.loads(row['data'])))
                 
             return entries
     
+    def get_recent_session_entries(self, n: int = 15, session_id: str = None) -> List[Dict[str, Any]]:
+        """
+        The last `n` entries of a session, oldest first.
+        
+        For the current session this is answered from the in-memory window
+        when it holds enough entries; otherwise the newest `n` rows are read
+        through the (session_id, id) index, with queued entries merged in.
+        Entries not yet stored have an `id` of None.
+        """
+        if n <= 0:
+            return []
+        if session_id is None:
+            session_id = self.session_id
+        if session_id == self.session_id:
+            with self._pending_changed:
+                # An empty window proves nothing: another manager in this
+                # process may have logged under the same session id
+                window = len(self._window)
+                if window and (n <= window or self._session_entries == window):
+                    return list(self._window)[-n:]
+        
+        with self._connection() as conn:
+            rows = conn.execute("""
+                SELECT * FROM history_entries
+                WHERE session_id = ?
+                ORDER BY id DESC LIMIT ?
+            """, (session_id, n)).fetchall()
+            entries = self._load_entries(conn, reversed(rows))
+            with self._pending_changed:
+                pending = [row for row in self._pending if row['session_id'] == session_id]
+        for row in pending:
+            entries.append(dict(row, id=None, data=json.loads(row['data'])))
+        return entries[-n:]
+    
+    def iter_entries(self, session_id: str = None, entry_type: str = None,
+                     since: datetime = None, until: datetime = None,
+                     newest_first: bool = False, batch_size: int = ITER_BATCH_SIZE,
+                     flush: bool = True, after_id: int = 0,
+                     resolve_blobs: bool = True) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over stored entries in id order, oldest first by default.
+        
+        Rows are fetched `batch_size` at a time with keyset pagination
+        (`id > last id seen`), so memory use is constant and each query is an
+        index range scan however far into the history it is. The connection
+        is not held between batches. `since` (inclusive) and `until`
+        (exclusive) bound the entry timestamps, `after_id` the ids when
+        iterating oldest first. Without `resolve_blobs`, large payloads are
+        left as blob references, which is much cheaper when they are not used.
+        """
+        if flush:
+            self.flush()
+        conditions = []
+        params: List[Any] = []
+        for column, value in (('session_id', session_id), ('entry_type', entry_type)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            conditions.append("ts_epoch >= ?")
+            params.append(to_epoch_ms(since))
+        if until is not None:
+            conditions.append("ts_epoch < ?")
+            params.append(to_epoch_ms(until))
+        conditions.append("id < ?" if newest_first else "id > ?")
+        query = (f"SELECT * FROM history_entries WHERE {' AND '.join(conditions)} "
+                 f"ORDER BY id {'DESC' if newest_first else 'ASC'} LIMIT ?")
+        
+        last_id = sys.maxsize if newest_first else after_id
+        while True:
+            with self._connection() as conn:
+                rows = conn.execute(query, params + [last_id, batch_size]).fetchall()
+                entries = self._load_entries(conn, rows, resolve_blobs)
+            yield from entries
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1]['id']
+    
     def get_recent_commands(self, limit: int = 10, entry_type: str = None) -> List[Dict[str, Any]]:
         """Get recent commands/interactions"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            
-            query = "SELECT * FROM history_entries"
-            params = []
-            
-            if entry_type:
-                query += " WHERE entry_type = ?"
-                params.append(entry_type)
-                
-            query += " ORDER BY timestamp DESC LIMIT ?"
-            params.append(limit)
-            
+        return self.find_entries(entry_type=entry_type, limit=limit)
+    
+    def find_entries(self, entry_type: str = None, session_id: str = None,
+                     command_prefix: str = None, return_code: int = None, failed: bool = False,
+                     llm_model: str = None, tool_name: str = None,
+                     parent_interaction_id: str = None, since: datetime = None,
+                     limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        Entries matching all the given filters, newest first.
+        
+        Every filter is answered from an indexed column rather than by
+        decoding JSON. `failed` selects shell commands with a non-zero exit
+        code; `since` is a datetime.
+        """
+        self.flush()
+        conditions = []
+        params: List[Any] = []
+        for column, value in (('entry_type', entry_type), ('session_id', session_id),
+                              ('return_code', return_code), ('llm_model', llm_model),
+                              ('tool_name', tool_name),
+                              ('parent_interaction_id', parent_interaction_id)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if command_prefix:
+            # GLOB (unlike LIKE) is case-sensitive, so it can use idx_command
+            conditions.append("command GLOB ?")
+            params.append(_escape_glob(command_prefix) + '*')
+        if failed:
+            conditions.append("return_code != 0")  # Matches the idx_failed predicate
+        if since is not None:
+            conditions.append("ts_epoch >= ?")
+            params.append(to_epoch_ms(since))
+        
+        query = "SELECT * FROM history_entries"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        
+        with self._connection() as conn:
             cursor = conn.execute(query, params)
             
-            entries = []
-            for row in cursor.fetchall():
-                entry = dict(row)
-                entry['data'] = json.loads(entry['data'])
-                entries.append(entry)
+            entries = self._load_entries(conn, cursor.fetchall())
                 
             return entries
     
-    def search_history(self, search_term: str, entry_type: str = None) -> List[Dict[str, Any]]:
-        """Search history entries by content"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            
+    def search_history(self, search_term: str, entry_type: str = None,
+                       limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        Search history entries by content, best matches first.
+        
+        `search_term` is an FTS5 query: words must all match, "quoted text"
+        matches a phrase and word* a prefix. Input that is not valid query
+        syntax (e.g. `ls -la`) is searched as plain words. Each result has
+        a `snippet` with matches between SNIPPET_START and SNIPPET_END.
+        """
+        self.flush()
+        if not self.has_fts:
+            return self._search_like(search_term, entry_type, limit)
+        
+        query = FTS_SEARCH_SQL
+        if entry_type:
+            query += " AND history_entries.entry_type = ?"
+        query += " ORDER BY rank, history_entries.id DESC LIMIT ?"
+        
+        with self._connection() as conn:
+            for match in (search_term, _quote_fts_terms(search_term)):
+                params = [match] + ([entry_type] if entry_type else []) + [limit]
+                try:
+                    rows = conn.execute(query, params).fetchall()
+                    break
+                except sqlite3.OperationalError:
+                    continue  # Not valid FTS5 syntax; retry as plain words
+            else:
+                return []
+            return self._load_entries(conn, rows)
+    
+    def _search_like(self, search_term: str, entry_type: str = None,
+                     limit: int = 50) -> List[Dict[str, Any]]:
+        """Substring search used when SQLite has no FTS5"""
+        with self._connection() as conn:
             query = """
                 SELECT * FROM history_entries 
                 WHERE data LIKE ?
@@ -264,78 +978,372 @@ class HistoryManager:
                 query += " AND entry_type = ?"
                 params.append(entry_type)
                 
-            query += " ORDER BY timestamp DESC LIMIT 50"
+            query += " ORDER BY id DESC LIMIT ?"
+            params.append(limit)
             
             cursor = conn.execute(query, params)
             
-            entries = []
-            for row in cursor.fetchall():
-                entry = dict(row)
-                entry['data'] = json.loads(entry['data'])
-                entries.append(entry)
+            entries = self._load_entries(conn, cursor.fetchall())
                 
             return entries
     
+    def recall(self, prompt: str, cwd: str = None, limit: int = 3) -> List[RecallMatch]:
+        """
+        Commands that ran successfully for past LLM prompts similar to this
+        one, best match first; only matches confident enough to be offered
+        instead of asking the LLM are returned (see history_recall).
+        """
+        self.flush()
+        with self._connection() as conn:
+            return history_recall.search(conn, prompt, cwd or os.getcwd(), limit)
+    
     def get_command_stats(self) -> Dict[str, Any]:
-        """Get statistics about command usage"""
-        with sqlite3.connect(self.db_path) as conn:
-            stats = {}
-            
-            # Total entries
-            cursor = conn.execute("SELECT COUNT(*) FROM history_entries")
-            stats['total_entries'] = cursor.fetchone()[0]
-            
-            # Entries by type
-            cursor = conn.execute("""
-                SELECT entry_type, COUNT(*) as count 
-                FROM history_entries 
-                GROUP BY entry_type
-            """)
-            stats['by_type'] = dict(cursor.fetchall())
-            
-            # Commands by session
-            cursor = conn.execute("""
-                SELECT session_id, COUNT(*) as count 
-                FROM history_entries 
-                GROUP BY session_id 
-                ORDER BY count DESC 
-                LIMIT 10
-            """)
-            stats['top_sessions'] = dict(cursor.fetchall())
-            
-            # Recent activity (last 7 days)
-            cursor = conn.execute("""
-                SELECT DATE(timestamp) as date, COUNT(*) as count
-                FROM history_entries 
-                WHERE timestamp >= datetime('now', '-7 days')
-                GROUP BY DATE(timestamp)
-                ORDER BY date DESC
-            """)
-            stats['recent_activity'] = dict(cursor.fetchall())
-            
+        """
+        Usage statistics: entries by type, session, day and model, shell
+        failure rate and mean execution time, the most run and most often
+        failing commands, and blob store savings.
+        
+        Read from the rollups maintained as entries are written, so the cost
+        does not grow with the size of the history.
+        """
+        self.flush()
+        with self._connection() as conn:
+            stats = history_rollups.read_stats(conn)
+            stats['blob_store'] = blob_stats(conn)
             return stats
     
+    def rebuild_rollups(self):
+        """Recompute the statistics rollups from the stored entries"""
+        self.flush()
+        with self._write_transaction() as conn:
+            history_rollups.rebuild(conn)
+            history_backfill.cancel(conn, history_backfill.ROLLUPS)
+    
     def cleanup_old_entries(self, days_to_keep: int = 30):
         """Remove entries older than specified days"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute("""
-                DELETE FROM history_entries 
-                WHERE timestamp < datetime('now', '-{} days')
-            """.format(days_to_keep))
-            
-            deleted_count = cursor.rowcount
-            conn.commit()
-            
-            return deleted_count
+        policy = RetentionPolicy(max_age_days=days_to_keep, payload_max_age_days=None,
+                                 max_db_bytes=None)
+        return self.prune(policy).deleted_entries
     
-    def export_history(self, output_file: str, session_id: str = None):
-        """Export history to JSON file"""
-        if session_id:
-            entries = self.get_session_history(session_id)
+    def prune(self, policy: RetentionPolicy = None, vacuum: bool = False) -> RetentionReport:
+        """
+        Apply a retention policy (by default the manager's own) to the whole
+        history, in batches of RETENTION_BATCH_ROWS entries per transaction.
+        
+        Freed pages are then returned to the file system with an incremental
+        vacuum, or, with `vacuum`, a full VACUUM that also enables incremental
+        vacuuming on databases created before it was the default.
+        """
+        run = RetentionRun(policy or self.retention or RetentionPolicy())
+        policy, report = run.policy, run.report
+        self.flush()
+        with self._connection() as conn:
+            size_before = conn.execute("PRAGMA page_count").fetchone()[0] * page_size(conn)
+            free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        
+        while self._retention_batch(run):
+            pass
+        
+        self._cleanup_spill_files(run)
+        
+        if vacuum:
+            with self._lock:
+                self._conn.execute("VACUUM")
         else:
-            entries = self.get_recent_commands(limit=1000)  # Export recent 1000 entries
+            while self._vacuum_step():
+                pass
+        
+        with self._connection() as conn:
+            size_after = conn.execute("PRAGMA page_count").fetchone()[0] * page_size(conn)
+            free_after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        report.reclaimed_bytes = max(size_before - size_after, 0)
+        report.free_bytes = max(free_after - free_before, 0) * page_size(self._conn)
+        return report
+    
+    @staticmethod
+    def _cleanup_spill_files(run: RetentionRun):
+        max_age_days = run.policy.spill_max_age_days
+        if max_age_days is not None:
+            run.report.deleted_spill_files += cleanup_spill_files(max_age_days)
+    
+    def import_shell_history(self, path: str, shell: str = None,
+                             since: datetime = None) -> ImportReport:
+        """
+        Add the commands of a bash, zsh or fish history file as shell_command
+        entries with their original times, in an 'import_<shell>' session.
+        
+        The file is parsed as a stream and written IMPORT_BATCH_ROWS commands
+        per transaction, so memory use does not grow with its size. Commands
+        already stored at the same time are skipped: importing a file again
+        only adds what is new. Commands with no recorded time (plain bash
+        history) are placed a millisecond apart from a point fixed when the
+        file is first imported. Commands older than `since` are left out.
+        """
+        path = os.path.abspath(os.path.expanduser(path))
+        shell = shell or detect_format(path)
+        report = ImportReport(path=path, format=shell)
+        since_ms = to_epoch_ms(since) if since else None
+        anchor_ms = None
+        self.flush()
+        
+        with self._lock:
+            cache_size = self._conn.execute("PRAGMA cache_size").fetchone()[0]
+            self._conn.execute(f"PRAGMA cache_size=-{IMPORT_CACHE_KIB}")
+        try:
+            batch = []
+            with open(path, 'rb') as f:
+                for index, (seconds, command) in enumerate(PARSERS[shell](f)):
+                    report.commands += 1
+                    if seconds is not None:
+                        ts_epoch = seconds * 1000
+                    else:
+                        if anchor_ms is None:
+                            anchor_ms = self._import_anchor(path)
+                        ts_epoch = anchor_ms + index
+                    if since_ms is not None and ts_epoch < since_ms:
+                        report.too_old += 1
+                        continue
+                    batch.append((ts_epoch, command))
+                    if len(batch) >= IMPORT_BATCH_ROWS:
+                        self._import_batch(batch, shell, report)
+                        batch = []
+            if batch:
+                self._import_batch(batch, shell, report)
+        finally:
+            with self._lock:
+                self._conn.execute(f"PRAGMA cache_size={cache_size}")
+        return report
+    
+    def _import_anchor(self, path: str) -> int:
+        """Epoch ms of a file's first untimestamped command, the same on every import"""
+        stat = os.stat(path)
+        # Commands are fewer than bytes, so they all fall before the file's mtime
+        anchor_ms = int(stat.st_mtime * 1000) - stat.st_size
+        with self._write_transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO history_imports (source, anchor_ms) VALUES (?, ?)",
+                         (path, anchor_ms))
+            return conn.execute("SELECT anchor_ms FROM history_imports WHERE source = ?",
+                                (path,)).fetchone()[0]
+    
+    def _import_batch(self, batch, shell: str, report: ImportReport):
+        """Insert one batch of imported commands, with their index and rollup entries"""
+        session_id = f"import_{shell}"
+        with self._write_transaction() as conn:
+            last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM history_entries").fetchone()[0]
+            rows = []
+            blob_rows = []  # Commands long enough for the blob store
+            for ts_epoch, command in batch:
+                data = {'command': command, 'imported_from': shell}
+                if len(command) * 4 >= self.blob_threshold:
+                    data, hashes = externalize(conn, data, self.blob_threshold)
+                    if hashes:
+                        blob_rows.append((command, ts_epoch, hashes))
+                rows.append({
+                    'timestamp': datetime.fromtimestamp(ts_epoch / 1000).isoformat(),
+                    'session_id': session_id,
+                    'data': json.dumps(data),
+                    'ts_epoch': ts_epoch,
+                    'command': command,
+                })
+            conn.executemany(IMPORT_ENTRY_SQL, rows)
+            
+            # What was not skipped as a duplicate
+            inserted = conn.execute(history_rollups.ROLLUP_SOURCE_SQL + " WHERE id > ?",
+                                    (last_id,)).fetchall()
+            if blob_rows:
+                for command, ts_epoch, hashes in blob_rows:
+                    row = conn.execute("""
+                        SELECT id FROM history_entries WHERE command = ? AND ts_epoch = ? AND id > ?
+                    """, (command, ts_epoch, last_id)).fetchone()
+                    if row is not None:
+                        add_refs(conn, row[0], hashes)
+                # Blobs written for commands that turned out to be duplicates
+                remove_unreferenced(conn, {h for _, _, hashes in blob_rows for h in hashes})
+            if self.has_fts:
+                conn.execute("""
+                    INSERT INTO history_fts (rowid, command)
+                    SELECT id, command FROM history_entries WHERE id > ?
+                """, (last_id,))
+            history_rollups.apply(conn, inserted)
+        report.imported += len(inserted)
+        report.duplicates += len(batch) - len(inserted)
+    
+    def _retention_batch(self, run: RetentionRun) -> bool:
+        """Carry out one batch of retention work; False once there is none left"""
+        policy, report = run.policy, run.report
+        now = datetime.now()
+        with self._write_transaction() as conn:
+            if policy.max_age_days is not None:
+                cutoff = to_epoch_ms(now - timedelta(days=policy.max_age_days))
+                ids = [row[0] for row in conn.execute(
+                    "SELECT id FROM history_entries WHERE ts_epoch < ? LIMIT ?",
+                    (cutoff, RETENTION_BATCH_ROWS))]
+                if ids:
+                    self._delete_entries(conn, ids, report)
+                    return True
             
-        with open(output_file, 'w') as f:
-            json.dump(entries, f, indent=2, default=str)
+            if policy.payload_max_age_days is not None:
+                cutoff = to_epoch_ms(now - timedelta(days=policy.payload_max_age_days))
+                rows = conn.execute("""
+                    SELECT id, entry_type, data FROM history_entries
+                    WHERE payload_dropped = 0 AND ts_epoch < ? LIMIT ?
+                """, (cutoff, RETENTION_BATCH_ROWS)).fetchall()
+                if rows:
+                    self._drop_payloads(conn, rows, report)
+                    return True
             
-        return len(entries) 
\ No newline at end of file
+            if policy.max_db_bytes is not None:
+                if run.size_cutoff_id is None:
+                    # Deleted rows linger in the search index until it is
+                    # merged, and would count against the limit
+                    if used_bytes(conn) > policy.max_db_bytes and self._merge_fts_step(conn):
+                        return True
+                    run.size_cutoff_id = size_cutoff_id(conn, policy.max_db_bytes)
+                ids = [row[0] for row in conn.execute(
+                    "SELECT id FROM history_entries WHERE id <= ? ORDER BY id LIMIT ?",
+                    (run.size_cutoff_id, RETENTION_BATCH_ROWS))]
+                if ids:
+                    self._delete_entries(conn, ids, report)
+                    return True
+        return False
+    
+    def _delete_entries(self, conn: sqlite3.Connection, ids: List[int], report: RetentionReport):
+        """Delete entries along with their rollup counts and unused blobs"""
+        placeholders = ', '.join('?' * len(ids))
+        # Entries the rollups' background fill has not counted yet are not taken out
+        counted = history_backfill.filled(conn, history_backfill.ROLLUPS, ids)
+        if counted:
+            history_rollups.apply(conn, conn.execute(
+                f"{history_rollups.ROLLUP_SOURCE_SQL} WHERE id IN ({', '.join('?' * len(counted))})",
+                counted), sign=-1)
+        hashes = [row[0] for row in conn.execute(
+            f"SELECT DISTINCT hash FROM history_blob_refs WHERE entry_id IN ({placeholders})", ids)]
+        # Triggers remove the entries' search index rows and blob links
+        report.deleted_entries += conn.execute(
+            f"DELETE FROM history_entries WHERE id IN ({placeholders})", ids).rowcount
+        report.deleted_blobs += remove_unreferenced(conn, hashes)
+    
+    def _drop_payloads(self, conn: sqlite3.Connection, rows, report: RetentionReport):
+        """Empty the output of entries, keeping the commands and prompts"""
+        released = set()
+        for row in rows:
+            data = json.loads(row['data'])
+            before = referenced_hashes(data)
+            data = drop_payload(row['entry_type'], data)
+            kept = referenced_hashes(data)
+            conn.execute("UPDATE history_entries SET data = ?, payload_dropped = 1 WHERE id = ?",
+                         (json.dumps(data), row['id']))
+            if before - kept:
+                conn.execute("DELETE FROM history_blob_refs WHERE entry_id = ?", (row['id'],))
+                add_refs(conn, row['id'], kept)
+                released |= before - kept
+            if self.has_fts:
+                conn.execute("UPDATE history_fts SET output = '' WHERE rowid = ?", (row['id'],))
+        report.dropped_payloads += len(rows)
+        report.deleted_blobs += remove_unreferenced(conn, released)
+    
+    def _merge_fts_step(self, conn: sqlite3.Connection) -> bool:
+        """
+        Merge some search index segments, dropping rows deleted from them;
+        False when the index is already compact
+        """
+        if not self.has_fts:
+            return False
+        # A negative page count merges segments at any level, not only when
+        # enough have piled up; fewer than two changes means no work was done
+        changes = conn.total_changes
+        conn.execute("INSERT INTO history_fts (history_fts, rank) VALUES ('merge', ?)",
+                     (-VACUUM_STEP_PAGES,))
+        return conn.total_changes - changes >= 2
+    
+    def _vacuum_step(self) -> bool:
+        """
+        Compact the search index a little, or return some free pages to the
+        file system; False when there is nothing left to do
+        """
+        with self._write_transaction() as conn:
+            if self._merge_fts_step(conn):
+                return True
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:  # Not INCREMENTAL
+                return False
+            if conn.execute("PRAGMA freelist_count").fetchone()[0] == 0:
+                return False
+            conn.execute(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})").fetchall()
+            return True
+    
+    def export_history(self, output_file: str, session_id: str = None, entry_type: str = None,
+                       since: datetime = None, until: datetime = None,
+                       compress: bool = None) -> int:
+        """
+        Stream entries to a file as NDJSON, one JSON object per line.
+        
+        There is no cap on the number of entries and memory use does not grow
+        with it. `output_file` may be '-' for stdout; output is gzipped when
+        `compress` is set, or by default when the file name ends in .gz.
+        
+        Returns:
+            int: Number of entries written
+        """
+        if compress is None:
+            compress = str(output_file).endswith('.gz')
+        
+        count = 0
+        with ExitStack() as stack:
+            if output_file == '-':
+                stream = sys.stdout.buffer
+            else:
+                stream = stack.enter_context(open(output_file, 'wb'))
+            if compress:
+                stream = stack.enter_context(gzip.GzipFile(fileobj=stream, mode='wb'))
+            
+            for entry in self.iter_entries(session_id=session_id, entry_type=entry_type,
+                                           since=since, until=until):
+                line = json.dumps(entry, default=str, ensure_ascii=False) + '\n'
+                stream.write(line.encode('utf-8', errors='replace'))
+                count += 1
+            stream.flush()
+        
+        return count
+    
+    def export_analytics(self, output_dir: str, format: str = None) -> AnalyticsReport:
+        """
+        Export entries for analysis as columnar files partitioned by date
+        (see history_analytics): Parquet when pyarrow is installed,
+        gzipped CSV otherwise.
+        
+        Exports are incremental. `output_dir` keeps the id of the last entry
+        exported, and the next export into it writes only the entries logged
+        or imported since, so a nightly job reads just the new rows. Entries
+        that retention deletes later stay in the files already written.
+        """
+        state = read_watermark(output_dir)
+        if format is None:
+            format = state.get('format') or default_format()
+        elif state and state.get('format') != format:
+            raise ValueError(f"{output_dir} holds a {state.get('format')} export; "
+                             f"export {format} to another directory")
+        report = AnalyticsReport(format=format, since_id=state.get('last_id', 0))
+        report.last_id = report.since_id
+        
+        writer = PartitionedWriter(output_dir, format)
+        try:
+            rows = []
+            # Only typed fields are exported, so payloads are never decompressed
+            entries = self.iter_entries(after_id=report.since_id, batch_size=ANALYTICS_BATCH_ROWS,
+                                        resolve_blobs=False)
+            for entry in entries:
+                rows.append(flatten(entry))
+                if len(rows) >= ANALYTICS_BATCH_ROWS:
+                    writer.write(rows)
+                    rows = []
+                report.rows += 1
+                report.last_id = entry['id']
+            if rows:
+                writer.write(rows)
+            report.files = writer.files
+            writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+        write_watermark(output_dir, report.last_id, format)
+        return report
@@ -0,0 +1,279 @@
+"""Columnar, date-partitioned export of history for analysis elsewhere"""
+
+import csv
+import glob
+import gzip
+import json
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+    pyarrow = None
+
+FORMATS = ('parquet', 'csv')
+
+# Entries read per query while exporting
+ANALYTICS_BATCH_ROWS = 5000
+
+# Rows buffered per Parquet row group, and partitions written to at once.
+# Imported shell history can span years in a few thousand ids; a partition
+# closed to make room gets a new file when more of its rows turn up.
+ROW_GROUP_ROWS = 10000
+MAX_OPEN_PARTITIONS = 16
+
+# Id of the last entry exported, kept next to the partitions
+WATERMARK_FILE = '_watermark.json'
+
+PARTITION_KEY = 'date'
+
+# One row per entry; the fields of the other entry types are empty
+COLUMNS = {
+    'id': 'int',
+    'time': 'timestamp',  # UTC; the partition date is local, like `nlsh stats`
+    'session_id': 'string',
+    'entry_type': 'string',
+    'cwd': 'string',
+    'command': 'string',  # shell_command entries
+    'return_code': 'int',
+    'execution_time_ms': 'int',
+    'user_time_ms': 'int',
+    'sys_time_ms': 'int',
+    'max_rss_kb': 'int',
+    'imported_from': 'string',  # Shell whose history file it came from
+    'llm_model': 'string',  # llm_interaction entries
+    'interaction_id': 'string',
+    'llm_time_ms': 'int',
+    'generated_commands': 'int',
+    'executed_commands': 'int',
+    'failed_commands': 'int',
+    'tool_name': 'string',  # tool_call entries
+    'parent_interaction_id': 'string',
+    'payload_dropped': 'bool',
+}
+
+
+@dataclass
+class AnalyticsReport:
+    """What one analytics export wrote"""
+    format: str
+    rows: int = 0
+    files: int = 0
+    since_id: int = 0  # Entries after this one were exported
+    last_id: int = 0  # The watermark the next export starts from
+
+
+def default_format() -> str:
+    return 'parquet' if PYARROW_AVAILABLE else 'csv'
+
+
+def read_watermark(output_dir: str) -> Dict[str, Any]:
+    """The state a previous export left in `output_dir`, empty if none"""
+    try:
+        with open(os.path.join(output_dir, WATERMARK_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_watermark(output_dir: str, last_id: int, format: str):
+    path = os.path.join(output_dir, WATERMARK_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'last_id': last_id, 'format': format,
+                   'exported_at': datetime.now().isoformat()}, f)
+    os.replace(path + '.tmp', path)
+
+
+def _int(value: Any) -> Optional[int]:
+    # Anything else would not fit the column's type
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+def _count(value: Any) -> Optional[int]:
+    return len(value) if isinstance(value, list) else None
+
+
+def flatten(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The analytics row for a stored entry (with blob references unresolved:
+    none of the fields taken from its data are large enough to be stored
+    as blobs)
+    """
+    data = entry['data'] if isinstance(entry['data'], dict) else {}
+    results = data.get('execution_results')
+    failed = None
+    if isinstance(results, list):
+        failed = sum(1 for result in results
+                     if isinstance(result, dict) and result.get('return_code') not in (0, None))
+    return {
+        'id': entry['id'],
+        'time': entry['ts_epoch'],
+        'session_id': entry['session_id'],
+        'entry_type': entry['entry_type'],
+        'cwd': entry['cwd'],
+        'command': entry['command'],
+        'return_code': _int(entry['return_code']),
+        'execution_time_ms': _int(data.get('execution_time_ms')),
+        'user_time_ms': _int(data.get('user_time_ms')),
+        'sys_time_ms': _int(data.get('sys_time_ms')),
+        'max_rss_kb': _int(data.get('max_rss_kb')),
+        'imported_from': data.get('imported_from'),
+        'llm_model': entry['llm_model'],
+        'interaction_id': entry['interaction_id'],
+        'llm_time_ms': _int(data.get('llm_time_ms')),
+        'generated_commands': _count(data.get('generated_commands')),
+        'executed_commands': _count(data.get('executed_commands')),
+        'failed_commands': failed,
+        'tool_name': entry['tool_name'],
+        'parent_interaction_id': entry['parent_interaction_id'],
+        'payload_dropped': bool(entry.get('payload_dropped')),
+    }
+
+
+def partition_of(row: Dict[str, Any]) -> str:
+    return date.fromtimestamp((row['time'] or 0) / 1000).isoformat()
+
+
+class _CsvPartitionFile:
+    """Gzipped CSV with a header row; times as ISO 8601, booleans as true/false"""
+    extension = '.csv.gz'
+    
+    def __init__(self, path: str):
+        self._file = gzip.open(path, 'wt', encoding='utf-8', newline='', compresslevel=6)
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(COLUMNS)
+    
+    def write(self, rows: List[Dict[str, Any]]):
+        for row in rows:
+            values = []
+            for name, kind in COLUMNS.items():
+                value = row[name]
+                if value is None:
+                    value = ''
+                elif kind == 'timestamp':
+                    value = datetime.fromtimestamp(value / 1000, timezone.utc).isoformat(
+                        timespec='milliseconds')
+                elif kind == 'bool':
+                    value = 'true' if value else 'false'
+                values.append(value)
+            self._writer.writerow(values)
+    
+    def close(self):
+        self._file.close()
+
+
+class _ParquetPartitionFile:
+    """Parquet, zstd compressed, a row group per ROW_GROUP_ROWS rows"""
+    extension = '.parquet'
+    
+    def __init__(self, path: str):
+        self._schema = parquet_schema()
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema, compression='zstd')
+        # Held as Arrow batches, which take a fraction of the memory of rows
+        self._batches = []
+        self._buffered = 0
+    
+    def write(self, rows: List[Dict[str, Any]]):
+        self._batches.append(pyarrow.RecordBatch.from_pylist(rows, schema=self._schema))
+        self._buffered += len(rows)
+        if self._buffered >= ROW_GROUP_ROWS:
+            self._write_row_group()
+    
+    def _write_row_group(self):
+        if self._batches:
+            self._writer.write_table(pyarrow.Table.from_batches(self._batches, schema=self._schema),
+                                     row_group_size=max(self._buffered, 1))
+            self._batches = []
+            self._buffered = 0
+    
+    def close(self):
+        self._write_row_group()
+        self._writer.close()
+
+
+def parquet_schema():
+    types = {
+        'int': pyarrow.int64(),
+        'string': pyarrow.string(),
+        'bool': pyarrow.bool_(),
+        'timestamp': pyarrow.timestamp('ms', tz='UTC'),
+    }
+    return pyarrow.schema([(name, types[kind]) for name, kind in COLUMNS.items()])
+
+
+class PartitionedWriter:
+    """
+    Writes rows under `<output_dir>/date=YYYY-MM-DD/`, in the Hive layout
+    that pyarrow, DuckDB, Spark and pandas read as one dataset.
+    
+    Each file is named after the first entry id in it, so files from
+    different runs never collide. They are written under temporary names
+    and only renamed by commit(), so an export that fails leaves nothing
+    half-written behind (and the next export removes its remains).
+    """
+    
+    def __init__(self, output_dir: str, format: str):
+        if format not in FORMATS:
+            raise ValueError(f"unknown analytics format {format!r}, expected one of {FORMATS}")
+        if format == 'parquet' and not PYARROW_AVAILABLE:
+            raise ValueError("Parquet export needs pyarrow (pip install pyarrow); use csv instead")
+        self.output_dir = output_dir
+        self.file_class = _ParquetPartitionFile if format == 'parquet' else _CsvPartitionFile
+        self._open: 'OrderedDict[str, Any]' = OrderedDict()
+        self._written: List[str] = []  # Temporary paths of the files closed so far
+        os.makedirs(output_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(glob.escape(output_dir), f'{PARTITION_KEY}=*', '.part-*.tmp')):
+            os.remove(path)
+    
+    @property
+    def files(self) -> int:
+        return len(self._written) + len(self._open)
+    
+    def write(self, rows: List[Dict[str, Any]]):
+        by_partition: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            by_partition.setdefault(partition_of(row), []).append(row)
+        for partition, partition_rows in by_partition.items():
+            self._partition_file(partition, partition_rows[0]['id'])[1].write(partition_rows)
+    
+    def _partition_file(self, partition: str, first_id: int):
+        if partition in self._open:
+            self._open.move_to_end(partition)
+            return self._open[partition]
+        if len(self._open) >= MAX_OPEN_PARTITIONS:
+            self._close(*self._open.popitem(last=False))
+        directory = os.path.join(self.output_dir, f'{PARTITION_KEY}={partition}')
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'.part-{first_id:012d}{self.file_class.extension}.tmp')
+        self._open[partition] = (path, self.file_class(path))
+        return self._open[partition]
+    
+    def _close(self, partition: str, opened):
+        path, partition_file = opened
+        partition_file.close()
+        self._written.append(path)
+    
+    def commit(self):
+        """Finish every file and give it its final name"""
+        while self._open:
+            self._close(*self._open.popitem(last=False))
+        for path in self._written:
+            directory, name = os.path.split(path)
+            os.replace(path, os.path.join(directory, name[1:-len('.tmp')]))
+        self._written = []
+    
+    def abort(self):
+        for path, partition_file in self._open.values():
+            partition_file.close()
+            self._written.append(path)
+        self._open.clear()
+        for path in self._written:
+            os.remove(path)
+        self._written = []
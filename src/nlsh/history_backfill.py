@@ -0,0 +1,79 @@
+"""Indexes of existing history filled in the background, a chunk at a time"""
+
+import sqlite3
+from typing import Callable, Iterable, List, Optional, Tuple
+
+# Entries added to an index per transaction
+BACKFILL_CHUNK_ROWS = 500
+
+# Indexes that can be pending, in the order they are filled
+FTS = 'fts'
+ROLLUPS = 'rollups'
+RECALL = 'recall'
+
+
+def create_table(conn: sqlite3.Connection):
+    """
+    One row per index still being filled: entries with next_id < id <= end_id
+    are not in it yet. Entries written after it was scheduled are added to
+    it as they are inserted, so they never fall in that range.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS history_backfills (
+            name TEXT PRIMARY KEY,
+            next_id INTEGER NOT NULL,  -- Entries up to this id are done
+            end_id INTEGER NOT NULL  -- The last entry when it was scheduled
+        ) WITHOUT ROWID
+    """)
+
+
+def schedule(conn: sqlite3.Connection, name: str):
+    """Have every entry stored so far added to index `name` by fill()"""
+    create_table(conn)
+    end_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM history_entries").fetchone()[0]
+    if end_id:
+        conn.execute("INSERT OR REPLACE INTO history_backfills (name, next_id, end_id) VALUES (?, 0, ?)",
+                     (name, end_id))
+
+
+def cancel(conn: sqlite3.Connection, name: str):
+    """Forget a pending fill, e.g. once the index was rebuilt from scratch"""
+    conn.execute("DELETE FROM history_backfills WHERE name = ?", (name,))
+
+
+def pending(conn: sqlite3.Connection, name: str) -> Optional[Tuple[int, int]]:
+    """The (next_id, end_id) range of entries not in index `name` yet, if any"""
+    row = conn.execute("SELECT next_id, end_id FROM history_backfills WHERE name = ?",
+                       (name,)).fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def filled(conn: sqlite3.Connection, name: str, entry_ids: Iterable[int]) -> List[int]:
+    """The ids among `entry_ids` of entries already in index `name`"""
+    remaining = pending(conn, name)
+    if remaining is None:
+        return list(entry_ids)
+    return [entry_id for entry_id in entry_ids if not remaining[0] < entry_id <= remaining[1]]
+
+
+def fill(conn: sqlite3.Connection, name: str, add: Callable[[sqlite3.Connection, int, int], None],
+         chunk_rows: int = BACKFILL_CHUNK_ROWS) -> bool:
+    """
+    Add the next chunk of pending entries to index `name`, calling
+    add(conn, after_id, up_to_id). Run it in a transaction of its own, so
+    the progress is stored with the rows it covers. False once none are left.
+    """
+    remaining = pending(conn, name)
+    if remaining is None:
+        return False
+    next_id, end_id = remaining
+    row = conn.execute("""
+        SELECT id FROM history_entries WHERE id > ? AND id <= ? ORDER BY id LIMIT 1 OFFSET ?
+    """, (next_id, end_id, chunk_rows - 1)).fetchone()
+    up_to_id = row[0] if row else end_id
+    add(conn, next_id, up_to_id)
+    if up_to_id >= end_id:
+        cancel(conn, name)
+    else:
+        conn.execute("UPDATE history_backfills SET next_id = ? WHERE name = ?", (up_to_id, name))
+    return True
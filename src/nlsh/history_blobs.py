@@ -0,0 +1,177 @@
+"""Compressed, content-addressed storage for large history payloads"""
+
+import hashlib
+import sqlite3
+import zlib
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+    zstandard = None
+
+# Strings at least this long (in UTF-8 bytes) are moved to the blob store
+BLOB_THRESHOLD_BYTES = 1024
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# JSON key marking a string that lives in history_blobs: {"$blob": "<sha256>"}
+BLOB_REF_KEY = '$blob'
+
+
+def compress(data: bytes) -> Tuple[str, bytes]:
+    """Compress with zstd when installed, zlib otherwise; returns (codec, data)"""
+    if ZSTD_AVAILABLE:
+        return 'zstd', zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return 'zlib', zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    """Inverse of compress(); raises ValueError for a codec not available here"""
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    if codec == 'zstd' and ZSTD_AVAILABLE:
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'raw':
+        return data
+    raise ValueError(f"cannot decompress {codec} blob")
+
+
+def _is_ref(value: Any) -> bool:
+    return isinstance(value, dict) and len(value) == 1 and BLOB_REF_KEY in value
+
+
+def externalize(conn: sqlite3.Connection, value: Any,
+                threshold: int = BLOB_THRESHOLD_BYTES) -> Tuple[Any, Set[str]]:
+    """
+    Move the large strings of a JSON value into history_blobs.
+    
+    Returns a copy with each such string replaced by a reference, and the
+    hashes referenced. A payload already in the store is not compressed or
+    written again.
+    """
+    hashes: Set[str] = set()
+    
+    def walk(item):
+        if isinstance(item, dict):
+            return {key: walk(child) for key, child in item.items()}
+        if isinstance(item, list):
+            return [walk(child) for child in item]
+        if isinstance(item, str) and len(item) * 4 >= threshold:
+            data = item.encode('utf-8', errors='surrogatepass')
+            if len(data) >= threshold:
+                digest = hashlib.sha256(data).hexdigest()
+                if digest not in hashes and conn.execute(
+                        "SELECT 1 FROM history_blobs WHERE hash = ?", (digest,)).fetchone() is None:
+                    codec, stored = compress(data)
+                    if len(stored) >= len(data):
+                        codec, stored = 'raw', data  # Incompressible, e.g. random bytes
+                    conn.execute("""
+                        INSERT OR IGNORE INTO history_blobs (hash, codec, size, stored_size, data)
+                        VALUES (?, ?, ?, ?, ?)
+                    """, (digest, codec, len(data), len(stored), stored))
+                hashes.add(digest)
+                return {BLOB_REF_KEY: digest}
+        return item
+    
+    return walk(value), hashes
+
+
+def referenced_hashes(value: Any, hashes: Set[str] = None) -> Set[str]:
+    """Hashes of the blobs a decoded JSON value refers to"""
+    if hashes is None:
+        hashes = set()
+    if _is_ref(value):
+        hashes.add(value[BLOB_REF_KEY])
+    elif isinstance(value, dict):
+        for child in value.values():
+            referenced_hashes(child, hashes)
+    elif isinstance(value, list):
+        for child in value:
+            referenced_hashes(child, hashes)
+    return hashes
+
+
+def resolve(conn: sqlite3.Connection, values: List[Any]) -> List[Any]:
+    """Replace blob references in decoded JSON values with their text, in place"""
+    wanted: Set[str] = set()
+    for value in values:
+        referenced_hashes(value, wanted)
+    if not wanted:
+        return values
+    
+    texts = dict(_load(conn, wanted))
+    
+    def substitute(item):
+        if _is_ref(item):
+            digest = item[BLOB_REF_KEY]
+            return texts.get(digest, f"[missing history blob {digest[:12]}]")
+        if isinstance(item, dict):
+            for key, child in item.items():
+                item[key] = substitute(child)
+        elif isinstance(item, list):
+            item[:] = [substitute(child) for child in item]
+        return item
+    
+    return [substitute(value) for value in values]
+
+
+def _load(conn: sqlite3.Connection, hashes: Iterable[str]):
+    hashes = list(hashes)
+    # Stay under SQLite's limit on bound parameters
+    for start in range(0, len(hashes), 500):
+        chunk = hashes[start:start + 500]
+        placeholders = ', '.join('?' * len(chunk))
+        for digest, codec, data in conn.execute(
+                f"SELECT hash, codec, data FROM history_blobs WHERE hash IN ({placeholders})",
+                chunk):
+            try:
+                yield digest, decompress(codec, data).decode('utf-8', errors='surrogatepass')
+            except (ValueError, zlib.error) as e:
+                yield digest, f"[unreadable history blob {digest[:12]}: {e}]"
+
+
+def add_refs(conn: sqlite3.Connection, entry_id: int, hashes: Iterable[str]):
+    """Record which blobs an entry uses, so unused ones can be removed"""
+    conn.executemany("INSERT OR IGNORE INTO history_blob_refs (entry_id, hash) VALUES (?, ?)",
+                     [(entry_id, digest) for digest in hashes])
+
+
+def remove_unreferenced(conn: sqlite3.Connection, hashes: Iterable[str] = None) -> int:
+    """Delete blobs no remaining entry refers to, among `hashes` if given"""
+    query = """
+        DELETE FROM history_blobs WHERE NOT EXISTS (
+            SELECT 1 FROM history_blob_refs WHERE history_blob_refs.hash = history_blobs.hash
+        )
+    """
+    if hashes is None:
+        return conn.execute(query).rowcount
+    hashes = list(hashes)
+    deleted = 0
+    for start in range(0, len(hashes), 500):
+        chunk = hashes[start:start + 500]
+        deleted += conn.execute(query + f" AND hash IN ({', '.join('?' * len(chunk))})",
+                                chunk).rowcount
+    return deleted
+
+
+def blob_stats(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Blob count and the bytes logged versus the bytes actually stored"""
+    blobs, stored_bytes, unique_bytes = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(stored_size), 0), COALESCE(SUM(size), 0) FROM history_blobs"
+    ).fetchone()
+    refs, logged_bytes = conn.execute("""
+        SELECT COUNT(*), COALESCE(SUM(history_blobs.size), 0)
+        FROM history_blob_refs JOIN history_blobs USING (hash)
+    """).fetchone()
+    return {
+        'blobs': blobs,
+        'references': refs,
+        'logged_bytes': logged_bytes,  # What inline storage would have used
+        'unique_bytes': unique_bytes,  # After deduplication
+        'stored_bytes': stored_bytes,  # After deduplication and compression
+        'saved_bytes': logged_bytes - stored_bytes,
+    }
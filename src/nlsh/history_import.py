@@ -0,0 +1,178 @@
+"""Streaming parsers for bash, zsh and fish history files"""
+
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+# Commands per transaction; memory use is bounded by this, not the file size
+IMPORT_BATCH_ROWS = 10000
+
+# SQLite page cache while importing, in KiB; inserts touch pages all over the
+# indexes, which the default 2 MB cache keeps evicting on large histories
+IMPORT_CACHE_KIB = 64 * 1024
+
+FORMATS = ('bash', 'zsh', 'fish')
+
+# (epoch seconds or None when the file does not record it, command)
+Command = Tuple[Optional[int], str]
+
+# `: <start>:<elapsed>;<command>` written by zsh with EXTENDED_HISTORY
+ZSH_EXTENDED = re.compile(rb': *(\d+):\d*;')
+BASH_TIMESTAMP = re.compile(rb'#(\d+)\s*$')
+
+# zsh stores bytes >= 0x83 as 0x83 followed by the byte xor 0x20
+ZSH_META = 0x83
+
+
+@dataclass
+class ImportReport:
+    """What importing one history file did"""
+    path: str
+    format: str
+    commands: int = 0  # Read from the file
+    imported: int = 0
+    duplicates: int = 0  # Already in the history, or repeated in the file
+    too_old: int = 0  # Older than the retention period
+
+
+def default_history_files() -> List[Tuple[Path, str]]:
+    """The shell history files of the current user that exist, with their format"""
+    home = Path.home()
+    data_home = Path(os.getenv('XDG_DATA_HOME') or home / '.local' / 'share')
+    candidates = [
+        (home / '.bash_history', 'bash'),
+        (Path(os.getenv('HISTFILE') or home / '.zsh_history'), 'zsh'),
+        (data_home / 'fish' / 'fish_history', 'fish'),
+    ]
+    found = []
+    for path, shell in candidates:
+        if path.is_file() and (path, shell) not in found:
+            found.append((path, shell))
+    return found
+
+
+def detect_format(path: str) -> str:
+    """Guess a history file's format from its first line, then from its name"""
+    with open(path, 'rb') as f:
+        first = f.readline()
+    if ZSH_EXTENDED.match(first):
+        return 'zsh'
+    if first.startswith(b'- cmd:'):
+        return 'fish'
+    name = os.path.basename(path)
+    if 'zsh' in name:
+        return 'zsh'
+    if 'fish' in name:
+        return 'fish'
+    return 'bash'
+
+
+def _decode(data: bytes) -> str:
+    return data.decode('utf-8', errors='replace')
+
+
+def _unmetafy(line: bytes) -> bytes:
+    if ZSH_META not in line:
+        return line
+    out = bytearray()
+    meta = False
+    for byte in line:
+        if meta:
+            out.append(byte ^ 0x20)
+            meta = False
+        elif byte == ZSH_META:
+            meta = True
+        else:
+            out.append(byte)
+    return bytes(out)
+
+
+def parse_bash(f: BinaryIO) -> Iterator[Command]:
+    """
+    ~/.bash_history: one command per line, or, with HISTTIMEFORMAT set, a
+    `#<epoch>` line before each command, whose following lines (up to the
+    next timestamp) all belong to it.
+    """
+    timestamp = None
+    lines: List[bytes] = []
+    for line in f:
+        match = BASH_TIMESTAMP.match(line) if line.startswith(b'#') else None
+        if match:
+            if lines:
+                yield timestamp, _decode(b'\n'.join(lines))
+                lines = []
+            timestamp = int(match.group(1))
+            continue
+        line = line.rstrip(b'\r\n')
+        if timestamp is None:
+            if line.strip():
+                yield None, _decode(line)
+        elif line or lines:
+            lines.append(line)
+    if lines:
+        yield timestamp, _decode(b'\n'.join(lines))
+
+
+def parse_zsh(f: BinaryIO) -> Iterator[Command]:
+    """
+    ~/.zsh_history, extended (`: <epoch>:<elapsed>;<command>`) or plain.
+    A command continues on the next line while its line ends in a backslash.
+    """
+    pending: Optional[bytes] = None
+    timestamp = None
+    for line in f:
+        line = _unmetafy(line.rstrip(b'\r\n'))
+        if pending is None:
+            match = ZSH_EXTENDED.match(line)
+            if match:
+                timestamp = int(match.group(1))
+                line = line[match.end():]
+            else:
+                timestamp = None
+            pending = line
+        else:
+            pending += b'\n' + line
+        if pending.endswith(b'\\'):
+            pending = pending[:-1]
+            continue
+        if pending.strip():
+            yield timestamp, _decode(pending)
+        pending = None
+    if pending is not None and pending.strip():
+        yield timestamp, _decode(pending)
+
+
+def _unescape_fish(value: bytes) -> str:
+    # fish escapes only backslashes and newlines in its history file
+    return _decode(value).replace('\\\\', '\x00').replace('\\n', '\n').replace('\x00', '\\')
+
+
+def parse_fish(f: BinaryIO) -> Iterator[Command]:
+    """
+    fish_history, a YAML subset: a `- cmd:` item per command with a `when:`
+    line holding its epoch time (and `paths:`, ignored here).
+    """
+    command = None
+    timestamp = None
+    for line in f:
+        if line.startswith(b'- cmd: '):
+            if command is not None:
+                yield timestamp, command
+            command = _unescape_fish(line[7:].rstrip(b'\r\n'))
+            timestamp = None
+        elif line.startswith(b'  when: ') and command is not None:
+            try:
+                timestamp = int(line[8:])
+            except ValueError:
+                pass
+    if command is not None:
+        yield timestamp, command
+
+
+PARSERS = {
+    'bash': parse_bash,
+    'zsh': parse_zsh,
+    'fish': parse_fish,
+}
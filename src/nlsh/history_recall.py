@@ -0,0 +1,314 @@
+"""Similarity index over past LLM prompts, to recall commands without the LLM"""
+
+import json
+import math
+import os
+import re
+import sqlite3
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, List, Set
+
+# llm_model logged for requests answered from the index instead of the LLM
+RECALLED_MODEL = 'history'
+
+# Lowest combined score shown as a suggestion (see search())
+RECALL_MIN_SCORE = 0.6
+
+# Documents scored in full per query, best partial matches first
+RECALL_CANDIDATES = 50
+
+# How much a match counts for by where it ran, relative to the current directory
+CWD_SAME = 1.0
+CWD_RELATED = 0.9  # One directory contains the other
+CWD_OTHER = 0.75
+
+WORD = re.compile(r"[\w][\w.+-]*")
+ARGUMENT_PIECE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+    a an and are all any as at be by can do for from get give how i in into is it
+    its me my of on or please show tell that the them then this to up us we what
+    which with you your
+""".split())
+
+# Query terms in more than this share of prompts do not select candidates,
+# except for the rarest few, which always do
+COMMON_TERM_SHARE = 0.05
+MIN_DISTINCTIVE_TERMS = 3
+
+# Character n-grams of each word, so "listing" still matches "list"
+NGRAM = 4
+
+
+@dataclass
+class RecallMatch:
+    """A past prompt similar to the current one, with the commands it ran"""
+    entry_id: int
+    prompt: str
+    commands: List[str]
+    cwd: str
+    score: float  # Cosine similarity of the prompts, weighted by directory
+
+
+def _stem(word: str) -> str:
+    for suffix, replacement in (('ies', 'y'), ('ing', ''), ('ed', ''), ('es', ''), ('s', '')):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)] + replacement
+    return word
+
+
+def words(text: str, stem: bool = True) -> List[str]:
+    """The (stemmed) words of a prompt, without stopwords"""
+    found = [word for word in WORD.findall(text.lower()) if word not in STOPWORDS]
+    return [_stem(word) for word in found] if stem else found
+
+
+def _abbreviates(piece: str, word: str) -> bool:
+    # "py" for "python", "rs" for "rust", "md" for "markdown"
+    if piece == word:
+        return True
+    if len(piece) < 2 or piece[0] != word[0]:
+        return False
+    rest = iter(word[1:])
+    return all(char in rest for char in piece[1:])
+
+
+def features(text: str) -> Counter:
+    """Terms of a prompt: its stemmed words, and the n-grams within each word"""
+    terms = Counter()
+    for word in words(text):
+        terms['w:' + word] += 1
+        padded = f' {word} '
+        for i in range(len(padded) - NGRAM + 1):
+            terms[padded[i:i + NGRAM]] += 1
+    return terms
+
+
+def create_tables(conn: sqlite3.Connection):
+    """
+    An inverted index of prompt terms with their document frequencies. Rows
+    go with their entry: a trigger removes them when the entry is deleted.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS recall_prompts (
+            entry_id INTEGER PRIMARY KEY,  -- The llm_interaction entry
+            prompt TEXT NOT NULL,
+            commands TEXT NOT NULL,  -- JSON list of the commands it executed
+            cwd TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS recall_terms (
+            term TEXT NOT NULL,
+            entry_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (term, entry_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_recall_terms_entry ON recall_terms(entry_id)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS recall_df (
+            term TEXT PRIMARY KEY,
+            prompts INTEGER NOT NULL  -- Indexed prompts containing the term
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS recall_delete AFTER DELETE ON history_entries
+        WHEN old.entry_type = 'llm_interaction' BEGIN
+            UPDATE recall_df SET prompts = prompts - 1
+            WHERE term IN (SELECT term FROM recall_terms WHERE entry_id = old.id);
+            DELETE FROM recall_df
+            WHERE prompts = 0 AND term IN (SELECT term FROM recall_terms WHERE entry_id = old.id);
+            DELETE FROM recall_terms WHERE entry_id = old.id;
+            DELETE FROM recall_prompts WHERE entry_id = old.id;
+        END
+    """)
+
+
+def succeeded(data: Dict[str, Any]) -> bool:
+    """Whether an LLM interaction executed commands, all of which succeeded"""
+    results = data.get('execution_results')
+    if not data.get('executed_commands') or not isinstance(results, list):
+        return False
+    return all(isinstance(result, dict) and result.get('return_code') == 0 for result in results)
+
+
+def index(conn: sqlite3.Connection, entry_id: int, cwd: str, data: Dict[str, Any]):
+    """Add an llm_interaction entry to the index if its commands succeeded"""
+    prompt = data.get('user_prompt')
+    if not isinstance(prompt, str) or not succeeded(data):
+        return
+    terms = features(prompt)
+    if not terms:
+        return
+    conn.execute("INSERT OR REPLACE INTO recall_prompts (entry_id, prompt, commands, cwd) "
+                 "VALUES (?, ?, ?, ?)",
+                 (entry_id, prompt, json.dumps(data['executed_commands']), cwd))
+    conn.executemany("INSERT INTO recall_terms (term, entry_id, count) VALUES (?, ?, ?)",
+                     [(term, entry_id, count) for term, count in terms.items()])
+    conn.executemany("""
+        INSERT INTO recall_df (term, prompts) VALUES (?, 1)
+        ON CONFLICT (term) DO UPDATE SET prompts = prompts + 1
+    """, [(term,) for term in terms])
+
+
+def _index_rows(conn: sqlite3.Connection, rows):
+    for entry_id, cwd, data in rows.fetchall():
+        try:
+            data = json.loads(data)
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            index(conn, entry_id, cwd, data)
+
+
+def index_range(conn: sqlite3.Connection, after_id: int, up_to_id: int):
+    """Index the LLM interactions with after_id < id <= up_to_id, for a background fill"""
+    _index_rows(conn, conn.execute("""
+        SELECT id, cwd, data FROM history_entries
+        WHERE entry_type = 'llm_interaction' AND id > ? AND id <= ? ORDER BY id
+    """, (after_id, up_to_id)))
+
+
+def rebuild(conn: sqlite3.Connection):
+    """Index every stored LLM interaction from scratch"""
+    conn.execute("DELETE FROM recall_terms")
+    conn.execute("DELETE FROM recall_df")
+    conn.execute("DELETE FROM recall_prompts")
+    _index_rows(conn, conn.execute("""
+        SELECT id, cwd, data FROM history_entries WHERE entry_type = 'llm_interaction' ORDER BY id
+    """))
+
+
+def _weights(counts: Dict[str, int], idf: Dict[str, float]) -> Dict[str, float]:
+    # Sublinear term frequency, so a repeated word does not dominate
+    return {term: (1 + math.log(count)) * idf[term] for term, count in counts.items() if term in idf}
+
+
+def _norm(weights: Dict[str, float]) -> float:
+    return math.sqrt(sum(weight * weight for weight in weights.values()))
+
+
+def argument_words(prompt: str, commands: List[str]) -> Set[str]:
+    """
+    Words of a prompt that ended up in the arguments of its commands ("main"
+    in "git checkout main", "python" for "*.py"), and any with digits. A
+    prompt lacking one of them asks for something else, however similar.
+    """
+    pieces = set()
+    for command in commands:
+        for token in command.lower().split()[1:]:
+            if token.startswith('-'):
+                token = token.partition('=')[2]  # The value of --option=value
+            pieces.update(ARGUMENT_PIECE.findall(token))
+    return {word for word in words(prompt, stem=False)
+            if any(char.isdigit() for char in word)
+            or any(_abbreviates(piece, word) for piece in pieces)}
+
+
+def cwd_weight(cwd: str, other: str) -> float:
+    if cwd == other:
+        return CWD_SAME
+    if (cwd + os.sep).startswith(other.rstrip(os.sep) + os.sep) or \
+            (other + os.sep).startswith(cwd.rstrip(os.sep) + os.sep):
+        return CWD_RELATED
+    return CWD_OTHER
+
+
+def search(conn: sqlite3.Connection, prompt: str, cwd: str, limit: int = 3,
+           min_score: float = RECALL_MIN_SCORE) -> List[RecallMatch]:
+    """
+    Past prompts most similar to `prompt` by TF-IDF cosine similarity,
+    weighted by how close the directory they ran in is to `cwd`.
+    
+    Candidates are the prompts sharing the query's more distinctive terms;
+    their full term vectors are then read to score them exactly, with
+    document frequencies as they are now. A past prompt with an argument
+    word (see argument_words) that `prompt` lacks never matches. Matches
+    running the same commands are only returned once, best first.
+    """
+    query_terms = features(prompt)
+    if not query_terms:
+        return []
+    total = conn.execute("SELECT COUNT(*) FROM recall_prompts").fetchone()[0]
+    if not total:
+        return []
+    
+    def idf_of(terms) -> Dict[str, float]:
+        terms = list(terms)
+        found = {}
+        # Stay under SQLite's limit on bound parameters
+        for start in range(0, len(terms), 500):
+            chunk = terms[start:start + 500]
+            found.update(conn.execute(
+                f"SELECT term, prompts FROM recall_df WHERE term IN ({', '.join('?' * len(chunk))}) "
+                f"AND prompts > 0", chunk).fetchall())
+        return {term: math.log((1 + total) / (1 + prompts)) + 1 for term, prompts in found.items()}
+    
+    indexed = idf_of(query_terms)
+    if not indexed:
+        return []
+    # Words no indexed prompt has still count against every match
+    unseen = math.log(1 + total) + 1
+    idf = {term: indexed.get(term, unseen) for term in query_terms}
+    query = _weights(query_terms, idf)
+    query_norm = _norm(query)
+    
+    # Partial dot products over the rarer query terms select the candidates;
+    # terms in most prompts would only make every prompt a candidate
+    distinctive = sorted(indexed, key=indexed.get, reverse=True)
+    common = math.log((1 + total) / (1 + total * COMMON_TERM_SHARE)) + 1
+    distinctive = [term for i, term in enumerate(distinctive)
+                   if i < MIN_DISTINCTIVE_TERMS or idf[term] > common]
+    # (Summed in SQL, with term frequencies left out until the exact scoring)
+    values = ', '.join(['(?, ?)'] * len(distinctive))
+    candidates = [row[0] for row in conn.execute(f"""
+        WITH query (term, weight) AS (VALUES {values})
+        SELECT entry_id FROM recall_terms JOIN query USING (term)
+        GROUP BY entry_id ORDER BY SUM(weight) DESC LIMIT ?
+    """, [*(x for term in distinctive for x in (term, query[term] * idf[term])), RECALL_CANDIDATES])]
+    if not candidates:
+        return []
+    
+    placeholders = ', '.join('?' * len(candidates))
+    vectors: Dict[int, Dict[str, int]] = {}
+    for entry_id, term, count in conn.execute(
+            f"SELECT entry_id, term, count FROM recall_terms WHERE entry_id IN ({placeholders})",
+            candidates):
+        vectors.setdefault(entry_id, {})[term] = count
+    idf.update(idf_of({term for vector in vectors.values() for term in vector} - idf.keys()))
+    
+    prompts = {row[0]: row[1:] for row in conn.execute(
+        f"SELECT entry_id, prompt, commands, cwd FROM recall_prompts WHERE entry_id IN ({placeholders})",
+        candidates)}
+    query_words = set(words(prompt, stem=False))
+    scored = []
+    for entry_id in candidates:
+        if entry_id not in prompts:
+            continue
+        weights = _weights(vectors.get(entry_id, {}), idf)
+        norm = _norm(weights)
+        if not norm:
+            continue
+        dot = sum(weight * weights.get(term, 0.0) for term, weight in query.items())
+        past_prompt, commands, past_cwd = prompts[entry_id]
+        score = dot / (query_norm * norm) * cwd_weight(cwd, past_cwd)
+        if score < min_score:
+            continue
+        commands = json.loads(commands)
+        if argument_words(past_prompt, commands) <= query_words:
+            scored.append(RecallMatch(entry_id, past_prompt, commands, past_cwd, round(score, 3)))
+    
+    # The newest of equally good matches first
+    scored.sort(key=lambda match: (match.score, match.entry_id), reverse=True)
+    matches: List[RecallMatch] = []
+    seen = set()
+    for match in scored:
+        key = tuple(match.commands)
+        if key not in seen:
+            seen.add(key)
+            matches.append(match)
+            if len(matches) == limit:
+                break
+    return matches
@@ -0,0 +1,153 @@
+"""Retention policies for the history database"""
+
+import os
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+# Entries deleted or stripped per transaction, so the write lock is only
+# ever held briefly
+RETENTION_BATCH_ROWS = 200
+
+# Pages returned to the file system per incremental vacuum step
+VACUUM_STEP_PAGES = 256
+
+# Time the writer thread spends on retention per wake-up while idle, and how
+# long it waits before checking again once everything is within policy
+RETENTION_STEP_S = 0.05
+RETENTION_INTERVAL_S = 3600
+
+# Fields holding command output and other bulky results. They are emptied
+# once an entry passes payload_max_age_days; commands and prompts are kept.
+PAYLOAD_FIELDS = ('output', 'error', 'tool_result', 'context_snapshot')
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    How much history to keep. None disables a limit, and all are disabled
+    unless asked for: nothing is deleted automatically by default.
+    
+    Entries older than `max_age_days` are deleted. Past `payload_max_age_days`
+    only their output is dropped (context snapshots are emptied). While the
+    database holds more than `max_db_bytes` of data, the oldest entries go.
+    """
+    max_age_days: Optional[int] = None
+    payload_max_age_days: Optional[int] = None
+    max_db_bytes: Optional[int] = None
+    
+    @property
+    def enabled(self) -> bool:
+        return any(limit is not None for limit in
+                   (self.max_age_days, self.payload_max_age_days, self.max_db_bytes))
+    
+    @property
+    def spill_max_age_days(self) -> Optional[int]:
+        """Spill files hold full output, so they go with the payload or the entry, whichever first"""
+        ages = [days for days in (self.payload_max_age_days, self.max_age_days) if days is not None]
+        return min(ages) if ages else None
+    
+    @classmethod
+    def from_env(cls) -> 'RetentionPolicy':
+        """
+        Limits set by NLSH_HISTORY_MAX_AGE_DAYS, NLSH_HISTORY_PAYLOAD_DAYS and
+        NLSH_HISTORY_MAX_MB; unset or 0 leaves a limit off
+        """
+        policy = cls()
+        for name, field, scale in (('NLSH_HISTORY_MAX_AGE_DAYS', 'max_age_days', 1),
+                                   ('NLSH_HISTORY_PAYLOAD_DAYS', 'payload_max_age_days', 1),
+                                   ('NLSH_HISTORY_MAX_MB', 'max_db_bytes', 1024 * 1024)):
+            value = os.getenv(name)
+            if value:
+                try:
+                    number = int(value)
+                except ValueError:
+                    continue
+                setattr(policy, field, number * scale if number > 0 else None)
+        return policy
+
+
+@dataclass
+class RetentionReport:
+    """What a retention run removed"""
+    deleted_entries: int = 0
+    dropped_payloads: int = 0
+    deleted_blobs: int = 0
+    deleted_spill_files: int = 0
+    reclaimed_bytes: int = 0  # Returned to the file system by vacuuming
+    free_bytes: int = 0  # Freed inside the database file, reused for new entries
+
+
+@dataclass
+class RetentionRun:
+    """Progress of one pass over the history with a policy"""
+    policy: RetentionPolicy
+    report: RetentionReport = field(default_factory=RetentionReport)
+    # Entries up to this id are deleted for the size limit; planned once per
+    # run, since deleting does not shrink the file (or the search index)
+    # straight away. None until planned, 0 for nothing to delete.
+    size_cutoff_id: Optional[int] = None
+
+
+def drop_payload(entry_type: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """A copy of an entry's data without its output"""
+    if entry_type == 'context_snapshot':
+        return {'payload_dropped': True}
+    data = dict(data)
+    for field in PAYLOAD_FIELDS:
+        if data.get(field):
+            data[field] = ''
+    results = data.get('execution_results')
+    if isinstance(results, list):
+        data['execution_results'] = [
+            dict(result, output='', error='') if isinstance(result, dict) else result
+            for result in results
+        ]
+    data['payload_dropped'] = True
+    return data
+
+
+def page_size(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA page_size").fetchone()[0]
+
+
+def used_bytes(conn: sqlite3.Connection) -> int:
+    """Bytes of the database file holding data (free pages excluded)"""
+    pages = conn.execute("PRAGMA page_count").fetchone()[0]
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return (pages - free) * page_size(conn)
+
+
+def size_cutoff_id(conn: sqlite3.Connection, max_db_bytes: int) -> int:
+    """
+    Id of the newest entry to delete, oldest first, so the database fits in
+    `max_db_bytes`; 0 if it already does.
+    
+    Entries are weighed by their JSON plus the compressed blobs they use,
+    scaled up by the overhead of indexes and the search index observed over
+    the whole database. A blob shared with newer entries is not actually
+    freed, so this errs on the side of deleting too little; the next run
+    continues from there.
+    """
+    used = used_bytes(conn)
+    if used <= max_db_bytes:
+        return 0
+    entry_bytes = """
+        SELECT id, length(data) + COALESCE((
+            SELECT SUM(history_blobs.stored_size)
+            FROM history_blob_refs JOIN history_blobs USING (hash)
+            WHERE history_blob_refs.entry_id = history_entries.id
+        ), 0) AS size
+        FROM history_entries
+    """
+    total = conn.execute(f"SELECT SUM(size) FROM ({entry_bytes})").fetchone()[0]
+    if not total:
+        return 0
+    excess = (used - max_db_bytes) * total / used
+    row = conn.execute(f"""
+        SELECT id FROM (SELECT id, SUM(size) OVER (ORDER BY id) AS running FROM ({entry_bytes}))
+        WHERE running >= ? ORDER BY id LIMIT 1
+    """, (excess,)).fetchone()
+    if row is None:
+        return conn.execute("SELECT MAX(id) FROM history_entries").fetchone()[0] or 0
+    return row[0]
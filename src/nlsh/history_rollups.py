@@ -0,0 +1,157 @@
+"""Statistics rollups kept up to date as history entries are written"""
+
+import sqlite3
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Tuple
+
+# Rollup dimensions and the SQL expression giving an entry's key in each
+DIMENSIONS = {
+    'type': "entry_type",
+    'session': "session_id",
+    'day': "date(ts_epoch / 1000, 'unixepoch', 'localtime')",
+    'command': "command",
+    'model': "llm_model",
+}
+
+# Columns an entry needs for apply(); also the shape rebuild() aggregates
+ROLLUP_SOURCE_SQL = """
+    SELECT ts_epoch, entry_type, session_id, command, return_code, llm_model,
+           CASE WHEN entry_type = 'shell_command'
+                THEN json_extract(data, '$.execution_time_ms') END AS execution_time_ms
+    FROM history_entries
+"""
+
+UPSERT_ROLLUP_SQL = """
+    INSERT INTO history_rollups (dimension, key, entries, failures, timed, total_time_ms)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (dimension, key) DO UPDATE SET
+        entries = entries + excluded.entries,
+        failures = failures + excluded.failures,
+        timed = timed + excluded.timed,
+        total_time_ms = total_time_ms + excluded.total_time_ms
+"""
+
+
+def create_tables(conn: sqlite3.Connection):
+    """Counters per (dimension, key); entries, failures and timings add up"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS history_rollups (
+            dimension TEXT NOT NULL,  -- A key of DIMENSIONS
+            key TEXT NOT NULL,
+            entries INTEGER NOT NULL,
+            failures INTEGER NOT NULL,  -- Shell commands with a non-zero exit code
+            timed INTEGER NOT NULL,  -- Entries with an execution time
+            total_time_ms INTEGER NOT NULL,
+            PRIMARY KEY (dimension, key)
+        ) WITHOUT ROWID
+    """)
+
+
+def _day(ts_epoch: int) -> str:
+    return date.fromtimestamp(ts_epoch / 1000).isoformat()  # Local date, as YYYY-MM-DD
+
+
+def apply(conn: sqlite3.Connection, entries: Iterable[Dict[str, Any]], sign: int = 1):
+    """
+    Add entries to the rollups, or take them out again with sign=-1.
+    
+    Each entry is a mapping with the ROLLUP_SOURCE_SQL columns. Only
+    entries with a ts_epoch are counted, like in rebuild().
+    """
+    totals: Dict[Tuple[str, str], List[int]] = {}
+    for entry in entries:
+        if entry['ts_epoch'] is None:
+            continue
+        failed = entry['return_code'] not in (None, 0)
+        elapsed = entry['execution_time_ms'] if entry['entry_type'] == 'shell_command' else None
+        keys = [('type', entry['entry_type']), ('session', entry['session_id']),
+                ('day', _day(entry['ts_epoch']))]
+        if entry['command'] is not None:
+            keys.append(('command', entry['command']))
+        if entry['llm_model'] is not None:
+            keys.append(('model', entry['llm_model']))
+        for key in keys:
+            total = totals.setdefault(key, [0, 0, 0, 0])
+            total[0] += 1
+            total[1] += failed
+            if elapsed is not None:
+                total[2] += 1
+                total[3] += int(elapsed)
+    
+    conn.executemany(UPSERT_ROLLUP_SQL, [
+        (dimension, key, *(sign * value for value in total))
+        for (dimension, key), total in totals.items()
+    ])
+    if sign < 0:
+        conn.execute("DELETE FROM history_rollups WHERE entries <= 0")
+
+
+def add_range(conn: sqlite3.Connection, after_id: int, up_to_id: int):
+    """Add the entries with after_id < id <= up_to_id, for a background fill"""
+    apply(conn, conn.execute(f"{ROLLUP_SOURCE_SQL} WHERE id > ? AND id <= ?", (after_id, up_to_id)))
+
+
+def rebuild(conn: sqlite3.Connection):
+    """Recompute every rollup from the raw entries"""
+    conn.execute("DELETE FROM history_rollups")
+    for dimension, expression in DIMENSIONS.items():
+        conn.execute(f"""
+            INSERT INTO history_rollups (dimension, key, entries, failures, timed, total_time_ms)
+            SELECT ?, {expression}, COUNT(*),
+                   SUM(return_code IS NOT NULL AND return_code != 0),
+                   COUNT(execution_time_ms), COALESCE(SUM(execution_time_ms), 0)
+            FROM ({ROLLUP_SOURCE_SQL}) AS source
+            WHERE ts_epoch IS NOT NULL AND {expression} IS NOT NULL
+            GROUP BY {expression}
+        """, (dimension,))
+
+
+def _mean(timed: int, total_time_ms: int):
+    return round(total_time_ms / timed) if timed else None
+
+
+def read_stats(conn: sqlite3.Connection, days: int = 7, top: int = 10) -> Dict[str, Any]:
+    """Usage statistics from the rollups alone, without touching the entries"""
+    def rows(dimension: str, order: str = "entries DESC", where: str = "1", params=()):
+        return conn.execute(f"""
+            SELECT key, entries, failures, timed, total_time_ms FROM history_rollups
+            WHERE dimension = ? AND {where} ORDER BY {order}, key LIMIT ?
+        """, (dimension, *params, top if dimension != 'type' else -1)).fetchall()
+    
+    stats: Dict[str, Any] = {}
+    by_type = rows('type')
+    stats['total_entries'] = sum(row['entries'] for row in by_type)
+    stats['by_type'] = {row['key']: row['entries'] for row in by_type}
+    stats['top_sessions'] = {row['key']: row['entries'] for row in rows('session')}
+    
+    since = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+    stats['recent_activity'] = {
+        row['key']: row['entries']
+        for row in rows('day', order="key DESC", where="key >= ?", params=(since,))
+    }
+    
+    shell = next((row for row in by_type if row['key'] == 'shell_command'), None)
+    if shell is not None:
+        stats['shell_commands'] = {
+            'runs': shell['entries'],
+            'failures': shell['failures'],
+            'failure_rate': shell['failures'] / shell['entries'],
+            'mean_time_ms': _mean(shell['timed'], shell['total_time_ms']),
+        }
+    
+    def command_stats(row) -> Dict[str, Any]:
+        return {
+            'command': row['key'],
+            'runs': row['entries'],
+            'failures': row['failures'],
+            'failure_rate': row['failures'] / row['entries'],
+            'mean_time_ms': _mean(row['timed'], row['total_time_ms']),
+        }
+    
+    stats['top_commands'] = [command_stats(row) for row in rows('command')]
+    stats['top_failing_commands'] = [
+        command_stats(row)
+        for row in rows('command', order="failures DESC, entries DESC", where="failures > 0")
+    ]
+    stats['by_model'] = {row['key']: row['entries'] for row in rows('model')}
+    return stats
@@ -0,0 +1,253 @@
+"""Versioned schema and migrations for the history database"""
+
+import json
+import sqlite3
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+from . import history_backfill, history_recall, history_rollups
+
+# Stored in PRAGMA user_version; databases from before versioning read as 0
+SCHEMA_VERSION = 8
+
+# Rows converted per transaction when typed columns are backfilled
+MIGRATION_CHUNK_ROWS = 500
+
+# Columns copied out of each entry's JSON so they can be filtered and indexed.
+# `data` still holds the full entry, so older readers keep working.
+TYPED_COLUMNS = {
+    'ts_epoch': 'INTEGER',  # Milliseconds since the Unix epoch
+    'command': 'TEXT',  # shell_command entries
+    'return_code': 'INTEGER',
+    'llm_model': 'TEXT',  # llm_interaction entries
+    'interaction_id': 'TEXT',
+    'tool_name': 'TEXT',  # tool_call entries
+    'parent_interaction_id': 'TEXT',
+}
+
+INDEXES = {
+    'idx_session': "history_entries(session_id, id)",
+    'idx_entry_type': "history_entries(entry_type)",
+    'idx_type_time': "history_entries(entry_type, ts_epoch)",
+    'idx_time': "history_entries(ts_epoch)",
+    # Also finds a command at a given time, to skip it when importing again
+    'idx_command': "history_entries(command, ts_epoch) WHERE command IS NOT NULL",
+    'idx_return_code': "history_entries(return_code) WHERE return_code IS NOT NULL",
+    'idx_failed': "history_entries(id) WHERE return_code != 0",
+    'idx_llm_model': "history_entries(llm_model) WHERE llm_model IS NOT NULL",
+    'idx_interaction': "history_entries(interaction_id) WHERE interaction_id IS NOT NULL",
+    'idx_tool_name': "history_entries(tool_name) WHERE tool_name IS NOT NULL",
+    'idx_parent_interaction': (
+        "history_entries(parent_interaction_id) WHERE parent_interaction_id IS NOT NULL"),
+    # Rows whose typed columns have not been filled in yet
+    'idx_unmigrated': "history_entries(id) WHERE ts_epoch IS NULL",
+}
+
+# Indexes of the version 1 schema that the ones above replace
+RETIRED_INDEXES = ['idx_session_id', 'idx_timestamp']
+
+
+def to_epoch_ms(timestamp: datetime) -> int:
+    """Epoch milliseconds for a naive local or an aware datetime"""
+    return int(timestamp.timestamp() * 1000)
+
+
+def typed_columns(entry_type: str, timestamp: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Values of the typed columns for an entry's ISO timestamp and JSON data"""
+    try:
+        ts_epoch = to_epoch_ms(datetime.fromisoformat(timestamp))
+    except (TypeError, ValueError):
+        ts_epoch = 0  # Unparseable; 0 still marks the row as migrated
+    columns = {name: None for name in TYPED_COLUMNS}
+    columns['ts_epoch'] = ts_epoch
+    if entry_type == 'shell_command':
+        columns['command'] = data.get('command')
+        columns['return_code'] = data.get('return_code')
+    elif entry_type == 'llm_interaction':
+        columns['llm_model'] = data.get('llm_model')
+        columns['interaction_id'] = data.get('interaction_id')
+    elif entry_type == 'tool_call':
+        columns['tool_name'] = data.get('tool_name')
+        columns['parent_interaction_id'] = data.get('parent_interaction_id')
+    return columns
+
+
+def _create_entries_table(conn: sqlite3.Connection):
+    """Version 1: the entries table with everything but the basics in JSON"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS history_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            entry_type TEXT NOT NULL,
+            cwd TEXT NOT NULL,
+            data TEXT NOT NULL  -- JSON data specific to entry type
+        )
+    """)
+
+
+def _add_typed_columns(conn: sqlite3.Connection):
+    """
+    Version 2: typed, indexed columns and integer epoch timestamps.
+    
+    Adding nullable columns only rewrites the table definition, so this is
+    quick on any size of database; existing rows are filled in afterwards by
+    `backfill_typed_columns`, a chunk at a time.
+    """
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(history_entries)")}
+    for name, column_type in TYPED_COLUMNS.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE history_entries ADD COLUMN {name} {column_type}")
+    for name in RETIRED_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    for name, definition in INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+
+
+def _create_blob_store(conn: sqlite3.Connection):
+    """
+    Version 3: deduplicated, compressed payloads (see history_blobs).
+    
+    Entries refer to blobs from their JSON; history_blob_refs records the
+    same links so blobs can be removed once no entry uses them.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS history_blobs (
+            hash TEXT PRIMARY KEY,  -- sha256 of the uncompressed UTF-8 text
+            codec TEXT NOT NULL,  -- 'zlib', 'zstd' or 'raw'
+            size INTEGER NOT NULL,
+            stored_size INTEGER NOT NULL,
+            data BLOB NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS history_blob_refs (
+            entry_id INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            PRIMARY KEY (entry_id, hash)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_blob_refs_hash ON history_blob_refs(hash)")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS history_blob_refs_delete AFTER DELETE ON history_entries BEGIN
+            DELETE FROM history_blob_refs WHERE entry_id = old.id;
+        END
+    """)
+
+
+def _create_rollups(conn: sqlite3.Connection):
+    """
+    Version 4: statistics rollups (see history_rollups). The entries already
+    stored are counted in the background, not while other sessions wait.
+    """
+    history_rollups.create_tables(conn)
+    history_backfill.schedule(conn, history_backfill.ROLLUPS)
+
+
+def _add_payload_marker(conn: sqlite3.Connection):
+    """Version 5: mark entries whose output retention has dropped"""
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(history_entries)")}
+    if 'payload_dropped' not in existing:
+        conn.execute("ALTER TABLE history_entries "
+                     "ADD COLUMN payload_dropped INTEGER NOT NULL DEFAULT 0")
+    # Entries that still have output, by age
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_payload_time "
+                 "ON history_entries(ts_epoch) WHERE payload_dropped = 0")
+
+
+def _add_import_tracking(conn: sqlite3.Connection):
+    """
+    Version 6: index commands by time too, for deduplicating imported shell
+    history, and remember where untimestamped imports were placed in time
+    """
+    conn.execute("DROP INDEX IF EXISTS idx_command")
+    conn.execute(f"CREATE INDEX idx_command ON {INDEXES['idx_command']}")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS history_imports (
+            source TEXT PRIMARY KEY,  -- Absolute path of the history file
+            anchor_ms INTEGER NOT NULL  -- Epoch ms given to its first untimestamped command
+        )
+    """)
+
+
+def _create_recall_index(conn: sqlite3.Connection):
+    """
+    Version 7: the similarity index over LLM prompts (see history_recall).
+    The interactions already stored are indexed in the background.
+    """
+    history_recall.create_tables(conn)
+    history_backfill.schedule(conn, history_backfill.RECALL)
+
+
+def _track_backfills(conn: sqlite3.Connection):
+    """
+    Version 8: indexes of the existing history are filled in the background
+    after startup (see history_backfill), rather than during a migration
+    """
+    history_backfill.create_table(conn)
+
+
+# MIGRATIONS[n] upgrades a database from version n to n + 1
+MIGRATIONS: List[Callable[[sqlite3.Connection], None]] = [
+    _create_entries_table,
+    _add_typed_columns,
+    _create_blob_store,
+    _create_rollups,
+    _add_payload_marker,
+    _add_import_tracking,
+    _create_recall_index,
+    _track_backfills,
+]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Bring the schema up to SCHEMA_VERSION in one transaction.
+    
+    The write lock is taken before the version is read, so two nlsh
+    processes starting together do not both run a migration. Returns the
+    version the database was at.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for step in MIGRATIONS[version:]:
+            step(conn)
+        if version < SCHEMA_VERSION:
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return version
+
+
+def backfill_typed_columns(conn: sqlite3.Connection, chunk_rows: int = MIGRATION_CHUNK_ROWS) -> int:
+    """
+    Fill in the typed columns of one chunk of rows written before version 2
+    (or by an older nlsh since). Run it repeatedly, each call in its own
+    short transaction, until it returns 0.
+    """
+    rows = conn.execute("""
+        SELECT id, timestamp, session_id, entry_type, data FROM history_entries
+        WHERE ts_epoch IS NULL LIMIT ?
+    """, (chunk_rows,)).fetchall()
+    updates = []
+    for row_id, timestamp, session_id, entry_type, data in rows:
+        try:
+            data = json.loads(data)
+        except ValueError:
+            data = {}
+        if not isinstance(data, dict):
+            data = {}
+        columns = typed_columns(entry_type, timestamp, data)
+        columns.update(id=row_id, session_id=session_id, entry_type=entry_type,
+                       execution_time_ms=data.get('execution_time_ms'))
+        updates.append(columns)
+    assignments = ', '.join(f"{name} = :{name}" for name in TYPED_COLUMNS)
+    conn.executemany(f"UPDATE history_entries SET {assignments} WHERE id = :id", updates)
+    # Rows without typed columns were left out of the rollups until now,
+    # unless the rollups' own background fill has yet to reach them
+    counted = set(history_backfill.filled(conn, history_backfill.ROLLUPS, [u['id'] for u in updates]))
+    history_rollups.apply(conn, [update for update in updates if update['id'] in counted])
+    return len(updates)
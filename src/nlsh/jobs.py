@@ -0,0 +1,224 @@
+"""Background jobs started from the REPL"""
+
+import os
+import signal
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from .process import ResourceUsage, kill_process_group, process_group_kwargs, wait_with_usage
+from .shell import CommandResult, PipeMultiplexer, ShellManager, _ConsoleOutput, _utf8_decoder
+
+# Recent output kept per job for `jobs` and `fg`, stdout and stderr interleaved
+JOB_BUFFER_BYTES = 64 * 1024
+
+
+class RingBuffer:
+    """Fixed-size byte buffer that keeps only the most recent data"""
+    
+    def __init__(self, capacity: int = JOB_BUFFER_BYTES):
+        self.capacity = capacity
+        self.total = 0  # Bytes ever written
+        self._data = bytearray()
+        self._lock = threading.Lock()
+    
+    def write(self, data: bytes):
+        with self._lock:
+            self.total += len(data)
+            self._data.extend(data)
+            if len(self._data) > self.capacity:
+                del self._data[:len(self._data) - self.capacity]
+    
+    def read(self) -> bytes:
+        with self._lock:
+            return bytes(self._data)
+    
+    def text(self) -> str:
+        """Buffered output as text, starting at a line boundary once wrapped"""
+        data = self.read()
+        if self.total > len(data):
+            newline = data.find(b'\n')
+            if newline != -1:
+                data = data[newline + 1:]
+        return data.decode('utf-8', errors='replace')
+
+
+@dataclass
+class Job:
+    """A command running in the background"""
+    id: int
+    command: str
+    cwd: str
+    proc: subprocess.Popen
+    started: float
+    buffer: RingBuffer = field(default_factory=RingBuffer)
+    result: Optional[CommandResult] = None
+    # Receives live output while the job is in the foreground
+    attached: Optional[Callable[[str, str], None]] = None
+    finished: threading.Event = field(default_factory=threading.Event)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    
+    @property
+    def pid(self) -> int:
+        return self.proc.pid
+    
+    @property
+    def status(self) -> str:
+        """'running', 'done', 'exit N' or the name of the killing signal"""
+        if self.result is None:
+            return 'running'
+        code = self.result.return_code
+        if code == 0:
+            return 'done'
+        if code < 0:
+            try:
+                return signal.Signals(-code).name
+            except ValueError:
+                pass
+        return f'exit {code}'
+
+
+class JobManager:
+    """
+    Runs commands in the background while the REPL stays usable.
+    
+    Each job is a fresh shell in its own process group with stdin from
+    /dev/null. A reader thread drains its output into a bounded capture (for
+    the result and history) and a ring buffer (for `jobs`/`fg`). When a job
+    finishes, `on_finish` is called from that thread and the job is queued
+    for `pop_finished()`, so the REPL can report it before the next prompt.
+    """
+    
+    def __init__(self, shell_manager: ShellManager,
+                 on_finish: Optional[Callable[[Job], None]] = None,
+                 buffer_bytes: int = JOB_BUFFER_BYTES):
+        self.shell_manager = shell_manager
+        self.on_finish = on_finish
+        self.buffer_bytes = buffer_bytes
+        self._jobs: Dict[int, Job] = {}
+        self._finished: List[Job] = []
+        self._next_id = 1
+        self._lock = threading.Lock()
+    
+    def start(self, command: str) -> Job:
+        """Start a command in the background"""
+        cwd = os.getcwd()
+        started = time.monotonic()
+        proc = subprocess.Popen(
+            [self.shell_manager.get_shell_path(), '-c', command],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            **process_group_kwargs()
+        )
+        with self._lock:
+            job = Job(self._next_id, command, cwd, proc, started, RingBuffer(self.buffer_bytes))
+            self._jobs[job.id] = job
+            self._next_id += 1
+        
+        thread = threading.Thread(target=self._drain, args=(job,), name=f"nlsh-job-{job.id}",
+                                  daemon=True)
+        thread.start()
+        return job
+    
+    def _drain(self, job: Job):
+        """Reader thread: collect a job's output until it exits"""
+        captures = {'stdout': self.shell_manager.new_capture(),
+                    'stderr': self.shell_manager.new_capture()}
+        decoders = {name: _utf8_decoder() for name in captures}
+        proc = job.proc
+        try:
+            with PipeMultiplexer({'stdout': proc.stdout, 'stderr': proc.stderr}) as mux:
+                for name, chunk in mux.read():
+                    captures[name].write(chunk)
+                    with job.lock:
+                        job.buffer.write(chunk)
+                        attached = job.attached
+                    if attached:
+                        text = decoders[name].decode(chunk, final=not chunk)
+                        if text:
+                            attached(name, text)
+            proc.stdout.close()
+            proc.stderr.close()
+            return_code, usage = wait_with_usage(proc, job.started)
+        except Exception as e:
+            captures['stderr'].write(f"Job failed: {e}".encode())
+            return_code, usage = -1, ResourceUsage.from_rusage(job.started)
+        
+        job.result = CommandResult.from_captures(
+            job.command, captures['stdout'], captures['stderr'], return_code, job.cwd,
+            usage=usage
+        )
+        with self._lock:
+            self._finished.append(job)
+        if self.on_finish:
+            try:
+                self.on_finish(job)
+            except Exception:
+                pass  # A failed log write must not take the job down with it
+        job.finished.set()
+    
+    def jobs(self) -> List[Job]:
+        """All jobs not yet reported as finished, oldest first"""
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.id)
+    
+    def get(self, spec: Optional[str] = None) -> Optional[Job]:
+        """Look up a job by `%N`/`N`, or the most recent one when spec is empty"""
+        with self._lock:
+            if not spec:
+                return self._jobs[max(self._jobs)] if self._jobs else None
+            try:
+                return self._jobs.get(int(spec.lstrip('%')))
+            except ValueError:
+                return None
+    
+    def pop_finished(self) -> List[Job]:
+        """Jobs that finished since the last call; they leave the job table"""
+        with self._lock:
+            finished, self._finished = self._finished, []
+            for job in finished:
+                self._jobs.pop(job.id, None)
+            return finished
+    
+    def wait(self, job: Job, on_output: Optional[Callable[[str, str], None]] = None) -> CommandResult:
+        """
+        Bring a job to the foreground: replay its buffered output, then
+        stream the rest (to the console by default) until it exits. The first
+        Ctrl-C sends SIGINT to the job, a second one kills it.
+        """
+        on_output = on_output or _ConsoleOutput()
+        with job.lock:
+            backlog = job.buffer.text()
+            if backlog:
+                on_output('stdout', backlog)
+            job.attached = on_output
+        
+        interrupts = 0
+        while not job.finished.is_set():
+            try:
+                job.finished.wait(0.1)
+            except KeyboardInterrupt:
+                interrupts += 1
+                self.kill(job, signal.SIGINT if interrupts == 1 else signal.SIGKILL)
+        job.attached = None
+        with self._lock:
+            self._jobs.pop(job.id, None)
+            if job in self._finished:
+                self._finished.remove(job)
+        return job.result
+    
+    def kill(self, job: Job, sig: int = signal.SIGTERM):
+        """Signal every process of a job"""
+        if job.result is None:
+            kill_process_group(job.pid, sig)
+    
+    def close(self):
+        """Stop all running jobs, e.g. when the REPL exits"""
+        for job in self.jobs():
+            self.kill(job, signal.SIGKILL)
+        for job in self.jobs():
+            job.finished.wait(1)
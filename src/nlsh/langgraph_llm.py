@@ -21,7 +21,8 @@ except ImportError:
 
 from .context import ContextInfo
 from .tools import AVAILABLE_TOOLS, set_shell_manager, set_confirmation_callback
-from .streaming import create_streaming_interface, StreamingResponse, ConfirmationHandler
+from .streaming import create_streaming_interface, StreamingResponse, ConfirmationHandler, console
+from .llm_cache import ResponseCache, is_cacheable
 
 
 class GraphState(TypedDict):
@@ -92,6 +93,9 @@ class LangGraphLLMInterface:
         
         # History manager for logging tool calls
         self.history_manager = None
+        
+        # Persistent response cache, off unless set up
+        self.response_cache: Optional[ResponseCache] = None
     
     def setup_shell_integration(self, shell_manager, confirmation_callback=None):
         """Setup shell manager and confirmation callback for tools"""
@@ -110,6 +114,39 @@ class LangGraphLLMInterface:
         """Setup history manager for logging interactions and tool calls"""
         self.history_manager = history_manager
     
+    def setup_response_cache(self, response_cache: Optional[ResponseCache]):
+        """Answer repeated requests in an unchanged directory from `response_cache`"""
+        self.response_cache = response_cache
+    
+    def _cache_key(self, prompt: str, mode: str, context: ContextInfo) -> Optional[str]:
+        # Taken before the request runs, so it describes the context it was asked in
+        if not self.response_cache:
+            return None
+        return ResponseCache.key(prompt, mode, f"{self.provider}:{self.model_name}", context)
+    
+    def _cached_response(self, cache_key: Optional[str]) -> Optional[str]:
+        if cache_key is None:
+            return None
+        response = self.response_cache.get(cache_key)
+        if response is not None:
+            console.print("[dim](cached response)[/dim]")
+        return response
+    
+    def _cache_response(self, cache_key: Optional[str], mode: str, response: str,
+                        tool_calls: List[Dict[str, Any]]):
+        """Keep a response for next time, unless one of its tool calls may have changed something"""
+        if cache_key is None or not response:
+            return
+        if is_cacheable(tool_calls):
+            self.response_cache.put(cache_key, mode, f"{self.provider}:{self.model_name}", response)
+        else:
+            self.response_cache.skip()
+    
+    @staticmethod
+    def _tool_calls(messages: list) -> List[Dict[str, Any]]:
+        return [tool_call for message in messages if isinstance(message, AIMessage)
+                for tool_call in (getattr(message, 'tool_calls', None) or [])]
+    
     def _build_graph(self) -> StateGraph:
         """Build the LangGraph workflow"""
         
@@ -172,6 +209,11 @@ class LangGraphLLMInterface:
     def generate_chat_response(self, prompt: str, context: ContextInfo) -> str:
         """Generate a chat response using LangGraph (llm? mode)"""
         try:
+            cache_key = self._cache_key(prompt, "chat", context)
+            cached = self._cached_response(cache_key)
+            if cached is not None:
+                return cached
+            
             # Create initial state
             initial_state = {
                 "messages": [HumanMessage(content=prompt)],
@@ -195,11 +237,12 @@ class LangGraphLLMInterface:
                     for block in content:
                         if isinstance(block, dict) and block.get('type') == 'text':
                             text_content += block.get('text', '')
-                    return text_content
-                elif isinstance(content, str):
-                    return content
-                else:
-                    return str(content)
+                    content = text_content
+                elif not isinstance(content, str):
+                    content = str(content)
+                
+                self._cache_response(cache_key, "chat", content, self._tool_calls(result["messages"]))
+                return content
             
             return "No response generated"
             
@@ -209,6 +252,11 @@ class LangGraphLLMInterface:
     def generate_commands(self, prompt: str, context: ContextInfo) -> List[str]:
         """Generate shell commands using LangGraph (llm: mode)"""
         try:
+            cache_key = self._cache_key(prompt, "command", context)
+            cached = self._cached_response(cache_key)
+            if cached is not None:
+                return self._parse_commands(cached)
+            
             # Create initial state
             initial_state = {
                 "messages": [HumanMessage(content=prompt)],
@@ -236,6 +284,7 @@ class LangGraphLLMInterface:
                 elif not isinstance(content, str):
                     content = str(content)
                 
+                self._cache_response(cache_key, "command", content, self._tool_calls(result["messages"]))
                 commands = self._parse_commands(content)
                 return commands
             
@@ -391,6 +440,15 @@ Remember: Your final response should contain ONLY the commands, nothing else.
             if not self.streaming_response:
                 self.streaming_response, self.confirmation_handler = create_streaming_interface()
             
+            cache_key = self._cache_key(prompt, "chat", context)
+            cached = self._cached_response(cache_key)
+            if cached is not None:
+                # The caller does not print streamed responses again
+                print()
+                self.streaming_response.stream_text_chunk(cached)
+                self.streaming_response.finish_streaming()
+                return cached
+            
             # Create initial state
             initial_state = {
                 "messages": [HumanMessage(content=prompt)],
@@ -478,6 +536,7 @@ Remember: Your final response should contain ONLY the commands, nothing else.
                                 self.streaming_response.finish_tool_call(tool_result)
             
             self.streaming_response.finish_streaming()
+            self._cache_response(cache_key, "chat", response_content, list(current_tool_calls.values()))
             return response_content or "No response generated"
             
         except Exception as e:
@@ -492,6 +551,11 @@ Remember: Your final response should contain ONLY the commands, nothing else.
             if not self.streaming_response:
                 self.streaming_response, self.confirmation_handler = create_streaming_interface()
             
+            cache_key = self._cache_key(prompt, "command", context)
+            cached = self._cached_response(cache_key)
+            if cached is not None:
+                return self._parse_commands(cached)
+            
             # Create initial state
             initial_state = {
                 "messages": [HumanMessage(content=prompt)],
@@ -579,6 +643,7 @@ Remember: Your final response should contain ONLY the commands, nothing else.
                                 self.streaming_response.finish_tool_call(tool_result)
             
             self.streaming_response.finish_streaming()
+            self._cache_response(cache_key, "command", final_response, list(current_tool_calls.values()))
             
             # Extract commands from the final response
             if final_response:
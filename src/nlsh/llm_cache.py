@@ -0,0 +1,288 @@
+"""Persistent cache of LLM responses, keyed on the prompt and its context"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+from .context import ContextInfo
+
+DEFAULT_LLM_CACHE = Path.home() / '.nlsh' / 'llm_cache.db'
+
+# Part of every key; bump it when prompts or response parsing change
+CACHE_KEY_VERSION = 1
+
+DEFAULT_TTL_S = 24 * 3600
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+# Tools whose calls leave nothing behind. Their results depend on the files,
+# repository and system the fingerprint covers. Shell commands are left out:
+# they may change things, and their output (date, ps, curl) is not covered.
+CACHEABLE_TOOLS = frozenset({
+    'list_files', 'read_file', 'find_files', 'get_working_directory',
+    'get_directory_tree', 'git_status', 'git_log', 'get_system_info', 'get_file_info',
+})
+
+COUNTERS = ('hits', 'misses', 'stores', 'skipped', 'evictions')
+
+
+def normalize_prompt(prompt: str) -> str:
+    # Whitespace only: case can matter ("files named README")
+    return ' '.join(prompt.split())
+
+
+def _git_dir(cwd: str) -> Optional[Path]:
+    path = Path(cwd)
+    for directory in (path, *path.parents):
+        dot_git = directory / '.git'
+        if dot_git.is_dir():
+            return dot_git
+        if dot_git.is_file():
+            # Worktrees and submodules: "gitdir: <path>"
+            try:
+                content = dot_git.read_text().strip()
+            except OSError:
+                return None
+            if content.startswith('gitdir:'):
+                return (directory / content[len('gitdir:'):].strip()).resolve()
+            return None
+    return None
+
+
+def git_head(cwd: str) -> str:
+    """
+    The checked out ref and commit of the repository containing `cwd`, plus
+    the index's mtime, read from files rather than by running git. Empty
+    outside a repository.
+    """
+    git_dir = _git_dir(cwd)
+    if git_dir is None:
+        return ''
+    try:
+        head = (git_dir / 'HEAD').read_text().strip()
+    except OSError:
+        return ''
+    commit = head
+    if head.startswith('ref:'):
+        ref = head[len('ref:'):].strip()
+        try:
+            commit = (git_dir / ref).read_text().strip()
+        except OSError:
+            commit = ''
+            try:
+                with open(git_dir / 'packed-refs') as f:
+                    for line in f:
+                        if line.rstrip('\n').endswith(' ' + ref):
+                            commit = line.split(' ', 1)[0]
+                            break
+            except OSError:
+                pass
+    try:
+        index_mtime = os.stat(git_dir / 'index').st_mtime_ns
+    except OSError:
+        index_mtime = 0
+    return f"{head} {commit} {index_mtime}"
+
+
+def context_fingerprint(context: Optional[ContextInfo]) -> str:
+    """
+    Hash of what a response depends on besides the prompt: the directory,
+    the name, size and mtime of everything in it, the shell and git HEAD.
+    Session history is left out, or no two requests would share a key.
+    """
+    cwd = context.cwd if context else os.getcwd()
+    shell = context.shell_info.get('name', '') if context and context.shell_info else ''
+    digest = hashlib.sha256()
+    digest.update(f"{cwd}\0{shell}\0{git_head(cwd)}\0".encode('utf-8', 'surrogateescape'))
+    try:
+        with os.scandir(cwd) as entries:
+            listing = []
+            for entry in entries:
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                    listing.append(f"{entry.name}\0{stat.st_size}\0{stat.st_mtime_ns}")
+                except OSError:
+                    listing.append(entry.name)
+    except OSError:
+        listing = []
+    for line in sorted(listing):
+        digest.update(line.encode('utf-8', 'surrogateescape') + b'\n')
+    return digest.hexdigest()
+
+
+def is_cacheable(tool_calls: Iterable[Dict[str, Any]]) -> bool:
+    """Whether a response whose tool calls were `tool_calls` may be reused"""
+    return all(call.get('name') in CACHEABLE_TOOLS for call in tool_calls)
+
+
+@dataclass
+class CacheStats:
+    """Counters since the cache was created, and what it holds now"""
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    skipped: int = 0  # Responses not stored because of their tool calls
+    evictions: int = 0
+    entries: int = 0
+    size_bytes: int = 0
+    
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / max(self.hits + self.misses, 1)
+
+
+class ResponseCache:
+    """
+    LLM responses in a small SQLite database of their own, so several nlsh
+    sessions share it.
+    
+    Entries expire `ttl_s` seconds after they were stored; once the
+    responses take more than `max_bytes`, the least recently used go.
+    """
+    
+    def __init__(self, path: Optional[str] = None, ttl_s: Optional[int] = DEFAULT_TTL_S,
+                 max_bytes: Optional[int] = DEFAULT_MAX_BYTES):
+        self.path = Path(path) if path else DEFAULT_LLM_CACHE
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), timeout=5, check_same_thread=False,
+                                     isolation_level=None)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                mode TEXT NOT NULL,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        """)
+    
+    @classmethod
+    def from_env(cls, enabled: bool = False) -> Optional['ResponseCache']:
+        """
+        A cache if `enabled` or NLSH_LLM_CACHE is set to 1, else None;
+        NLSH_LLM_CACHE_TTL (seconds) and NLSH_LLM_CACHE_MAX_MB override the
+        defaults, 0 turning a limit off
+        """
+        if not enabled and os.getenv('NLSH_LLM_CACHE', '').lower() not in ('1', 'true', 'yes', 'on'):
+            return None
+        limits = {'ttl_s': DEFAULT_TTL_S, 'max_bytes': DEFAULT_MAX_BYTES}
+        for name, field, scale in (('NLSH_LLM_CACHE_TTL', 'ttl_s', 1),
+                                   ('NLSH_LLM_CACHE_MAX_MB', 'max_bytes', 1024 * 1024)):
+            value = os.getenv(name)
+            if value:
+                try:
+                    number = int(value)
+                except ValueError:
+                    continue
+                limits[field] = number * scale if number > 0 else None
+        return cls(**limits)
+    
+    @staticmethod
+    def key(prompt: str, mode: str, model: str, context: Optional[ContextInfo]) -> str:
+        """Key of the response to `prompt` in `mode` ('chat' or 'command')"""
+        parts = [str(CACHE_KEY_VERSION), mode, model, normalize_prompt(prompt), context_fingerprint(context)]
+        return hashlib.sha256('\0'.join(parts).encode('utf-8', 'surrogateescape')).hexdigest()
+    
+    def _count(self, name: str, amount: int = 1):
+        self._conn.execute("""
+            INSERT INTO counters (name, value) VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value
+        """, (name, amount))
+    
+    def get(self, key: str) -> Optional[str]:
+        """The stored response, or None if there is none or it expired"""
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?",
+                                         (key,)).fetchone()
+                if row and self.ttl_s is not None and now - row[1] > self.ttl_s:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    row = None
+                if row:
+                    self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+                self._count('hits' if row else 'misses')
+            except sqlite3.Error:
+                return None  # A cache that cannot be read is a miss, never an error
+        return row[0] if row else None
+    
+    def put(self, key: str, mode: str, model: str, response: str):
+        """Store a response, evicting the least recently used over max_bytes"""
+        now = time.time()
+        size = len(response.encode('utf-8', 'surrogateescape'))
+        if self.max_bytes is not None and size > self.max_bytes:
+            self.skip()
+            return
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._conn.execute("""
+                        INSERT OR REPLACE INTO responses (key, mode, model, response, size, created, last_used)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """, (key, mode, model, response, size, now, now))
+                    self._count('stores')
+                    self._evict(now)
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            except sqlite3.Error:
+                pass
+    
+    def _evict(self, now: float):
+        evicted = 0
+        if self.ttl_s is not None:
+            evicted += self._conn.execute("DELETE FROM responses WHERE created < ?",
+                                          (now - self.ttl_s,)).rowcount
+        if self.max_bytes is not None:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                doomed = []
+                for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+                    if total <= self.max_bytes:
+                        break
+                    doomed.append((key,))
+                    total -= size
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+                evicted += len(doomed)
+        if evicted:
+            self._count('evictions', evicted)
+    
+    def skip(self):
+        """Count a response that was not stored"""
+        with self._lock:
+            try:
+                self._count('skipped')
+            except sqlite3.Error:
+                pass
+    
+    def stats(self) -> CacheStats:
+        with self._lock:
+            counters = dict(self._conn.execute("SELECT name, value FROM counters").fetchall())
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return CacheStats(**{name: counters.get(name, 0) for name in COUNTERS},
+                          entries=entries, size_bytes=size)
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,228 @@
+"""Execution planning for commands suggested in llm: mode"""
+
+import shlex
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from rich.console import Console, Group
+from rich.live import Live
+from rich.markup import escape
+from rich.panel import Panel
+from rich.text import Text
+
+from .shell import CommandResult, ShellManager
+
+# Programs that only read state and can safely run side by side
+READ_ONLY_COMMANDS = {
+    'ls', 'll', 'la', 'du', 'df', 'find', 'locate', 'grep', 'egrep', 'fgrep', 'rg', 'ag',
+    'cat', 'head', 'tail', 'wc', 'stat', 'file', 'which', 'whereis', 'type', 'uname',
+    'date', 'uptime', 'whoami', 'id', 'hostname', 'pwd', 'ps', 'free', 'lsof',
+    'printenv', 'echo', 'tree', 'sort', 'uniq', 'cut', 'tr', 'md5sum', 'sha1sum',
+    'sha256sum', 'basename', 'dirname', 'realpath', 'readlink', 'nproc', 'lscpu',
+    'lsblk', 'netstat', 'ss', 'dig', 'nslookup', 'host', 'jq', 'true', 'false', 'test', '[',
+}
+
+# git subcommands that do not touch the repository or working tree
+READ_ONLY_GIT = {
+    'status', 'log', 'diff', 'show', 'branch', 'rev-parse', 'ls-files', 'describe',
+    'blame', 'shortlog', 'remote', 'tag', 'grep', 'config', 'count-objects',
+}
+
+# find actions that modify the filesystem or run other programs
+FIND_WRITE_ACTIONS = {'-delete', '-exec', '-execdir', '-ok', '-okdir', '-fprint', '-fprint0', '-fprintf',
+                      '-fls'}
+
+# Programs that change system state when given arguments (`date -s`,
+# `hostname newname`): independent only with these options, which just
+# choose how the current value is shown, and `date +FORMAT`
+DISPLAY_ONLY_OPTIONS = {
+    'date': {'-u', '--utc', '--universal', '-R', '--rfc-email', '--rfc-2822', '-I', '--iso-8601',
+             '--rfc-3339'},
+    'hostname': {'-f', '--fqdn', '--long', '-s', '--short', '-d', '--domain', '-i', '--ip-address',
+                 '-I', '--all-ip-addresses', '-A', '--all-fqdns', '-a', '--alias'},
+}
+
+# Command and process substitutions run commands of their own, which shlex
+# leaves inside the words (e.g. in double quotes)
+SUBSTITUTIONS = ('$(', '`', '<(', '>(')
+
+# Tokens that separate the simple commands of a command line
+COMMAND_SEPARATORS = {'&&', '||', ';', '|', '&', '(', ')', '\n'}
+
+# Lines of output shown per command while a parallel stage runs
+PANE_LINES = 8
+
+
+@dataclass
+class ExecutionStage:
+    """Commands run together: concurrently if `parallel`, otherwise one by one"""
+    commands: List[str]
+    parallel: bool = False
+
+
+def _simple_commands(command: str) -> Optional[List[List[str]]]:
+    """
+    Split a command line into the words of its simple commands.
+    
+    Returns None when the line uses a redirection, substitution or syntax
+    we do not understand, so the caller treats it as having side effects.
+    """
+    # Checked on the whole line, quoted or not: `echo '$(x)'` is only a
+    # barrier too many, while a missed substitution could run anything
+    if any(marker in command for marker in SUBSTITUTIONS):
+        return None
+    lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    try:
+        tokens = list(lexer)
+    except ValueError:
+        return None
+    
+    commands = [[]]
+    tokens = iter(tokens)
+    for token in tokens:
+        if token in COMMAND_SEPARATORS:
+            commands.append([])
+        elif token and set(token) <= set('<>&|;()'):
+            # Redirections are only harmless when they discard or merge output
+            target = next(tokens, '')
+            if token not in ('>', '>>', '>&', '<') or not (
+                    target == '/dev/null' or target.isdigit() or token == '<'):
+                return None
+        else:
+            commands[-1].append(token)
+    return [words for words in commands if words]
+
+
+def is_independent(command: str) -> bool:
+    """
+    Whether a command only reads state, so it can run alongside others.
+    
+    Anything that may write files, change directory or environment, or is
+    not recognised counts as a dependency barrier. Pagers are not a concern:
+    parallel commands run with piped output, so git and friends skip them.
+    """
+    simple_commands = _simple_commands(command)
+    if not simple_commands:
+        return False
+    
+    for words in simple_commands:
+        if '=' in words[0]:
+            return False  # Variable assignment
+        program = words[0].rsplit('/', 1)[-1]
+        if program == 'git':
+            if len(words) < 2 or words[1] not in READ_ONLY_GIT:
+                return False
+            # `git branch foo`, `git tag v1`, `git config k v` write
+            if words[1] in ('branch', 'tag', 'remote', 'config') and not all(
+                    w.startswith('-') for w in words[2:]):
+                return False
+            # `git diff --output=patch` writes its output to a file
+            if any(w == '--output' or w.startswith('--output=') for w in words[2:]):
+                return False
+        elif program == 'find':
+            if FIND_WRITE_ACTIONS & set(words):
+                return False
+        elif program == 'sort':
+            if any(w == '-o' or w.startswith('--output') for w in words):
+                return False
+        elif program in DISPLAY_ONLY_OPTIONS:
+            if not all(w.partition('=')[0] in DISPLAY_ONLY_OPTIONS[program]
+                       or (program == 'date' and w.startswith('+')) for w in words[1:]):
+                return False
+        elif program not in READ_ONLY_COMMANDS:
+            return False
+    return True
+
+
+def plan_commands(commands: List[str]) -> List[ExecutionStage]:
+    """
+    Group commands into stages that preserve their dependencies.
+    
+    Runs of independent (read-only) commands become parallel stages. Every
+    other command, e.g. a `cd`, `export`, write or `&&` chain with side
+    effects, is a barrier that runs on its own after everything before it
+    and before anything after it, so the suggested order is kept where it
+    can matter.
+    """
+    stages: List[ExecutionStage] = []
+    group: List[str] = []
+    
+    def close_group():
+        if group:
+            stages.append(ExecutionStage(list(group), parallel=len(group) > 1))
+            group.clear()
+    
+    for command in commands:
+        if is_independent(command):
+            group.append(command)
+        else:
+            close_group()
+            stages.append(ExecutionStage([command]))
+    close_group()
+    return stages
+
+
+def _status(command: str, result: Optional[CommandResult]):
+    """Pane title and border colour for a command's current state"""
+    command = escape(command)
+    if result is None:
+        return f"[yellow]running[/yellow] {command}", 'yellow'
+    if result.return_code == 0:
+        return f"[green]done[/green] {command}", 'green'
+    return f"[red]exit {result.return_code}[/red] {command}", 'red'
+
+
+@dataclass
+class _Pane:
+    command: str
+    lines: List[str] = field(default_factory=list)
+    partial: str = ""
+    result: Optional[CommandResult] = None
+    
+    def add(self, text: str):
+        *complete, self.partial = (self.partial + text).split('\n')
+        self.lines.extend(complete)
+        del self.lines[:-PANE_LINES]
+    
+    def render(self) -> Panel:
+        lines = self.lines + ([self.partial] if self.partial else [])
+        body = Text('\n'.join(lines[-PANE_LINES:]) or '...', style='dim')
+        title, style = _status(self.command, self.result)
+        return Panel(body, title=title, title_align='left', border_style=style)
+
+
+def run_parallel_stage(shell_manager: ShellManager, commands: List[str],
+                       console: Console) -> List[CommandResult]:
+    """
+    Run independent commands concurrently with a live output pane each.
+    
+    The panes show the latest lines of every command while the stage runs;
+    afterwards each command's captured output is printed in order.
+    """
+    panes: Dict[int, _Pane] = {i: _Pane(command) for i, command in enumerate(commands)}
+    lock = threading.Lock()
+    
+    def render():
+        return Group(*(panes[i].render() for i in range(len(commands))))
+    
+    with Live(render(), console=console, refresh_per_second=10, transient=True) as live:
+        def on_output(index: int, stream_type: str, content: str):
+            with lock:
+                panes[index].add(content)
+                live.update(render())
+        
+        def on_done(index: int, result: CommandResult):
+            with lock:
+                panes[index].result = result
+                live.update(render())
+        
+        results = shell_manager.execute_commands_concurrently(
+            commands, on_output=on_output, on_done=on_done)
+    
+    for result in results:
+        title, style = _status(result.command, result)
+        body = Text((result.output + result.error).rstrip('\n') or '(no output)')
+        console.print(Panel(body, title=title, title_align='left', border_style=style))
+    return results
@@ -0,0 +1,166 @@
+"""Process groups, terminal hand-off, timeouts and resource accounting"""
+
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+# Timeout for captured (non-interactive) commands such as tool calls
+DEFAULT_COMMAND_TIMEOUT = 30.0
+
+# Exit code reported for a command stopped with Ctrl-C, as shells do
+INTERRUPTED_EXIT_CODE = 128 + signal.SIGINT
+
+
+@dataclass
+class ResourceUsage:
+    """Wall time and child resource usage for one command"""
+    wall_time_ms: int
+    user_time_ms: Optional[int] = None
+    sys_time_ms: Optional[int] = None
+    max_rss_kb: Optional[int] = None
+    
+    @classmethod
+    def from_rusage(cls, started: float, rusage=None) -> 'ResourceUsage':
+        """Build from a time.monotonic() start and an os.wait4() rusage"""
+        usage = cls(wall_time_ms=int((time.monotonic() - started) * 1000))
+        if rusage is not None:
+            usage.user_time_ms = int(rusage.ru_utime * 1000)
+            usage.sys_time_ms = int(rusage.ru_stime * 1000)
+            # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+            max_rss = rusage.ru_maxrss
+            usage.max_rss_kb = max_rss // 1024 if sys.platform == 'darwin' else max_rss
+        return usage
+
+
+def process_group_kwargs() -> dict:
+    """Popen keyword arguments that start the child in its own process group"""
+    if sys.version_info >= (3, 11):
+        return {'process_group': 0}
+    return {'preexec_fn': os.setpgrp}
+
+
+def kill_process_group(pid: int, sig: int = signal.SIGKILL):
+    """Signal every process in the group led by pid"""
+    try:
+        os.killpg(pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+@contextmanager
+def foreground(pgid: int):
+    """
+    Make a process group the terminal's foreground group for the duration.
+    
+    A child in its own process group is otherwise a background job: reading
+    the terminal would stop it with SIGTTIN and Ctrl-C would go to nlsh
+    instead. Does nothing (and yields False) when stdin is not a terminal
+    whose foreground group is nlsh's own.
+    """
+    try:
+        fd = sys.stdin.fileno()
+        owned = os.isatty(fd) and os.tcgetpgrp(fd) == os.getpgrp()
+    except (AttributeError, OSError, ValueError):
+        owned = False
+    if not owned:
+        yield False
+        return
+    
+    # Taking the terminal back from a background group raises SIGTTOU unless
+    # it is blocked; a thread signal mask also works off the main thread
+    previous = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTTOU})
+    try:
+        try:
+            os.tcsetpgrp(fd, pgid)
+            handed_off = True
+        except OSError:
+            handed_off = False  # The group already exited
+        if handed_off:
+            # Resume anything that touched the terminal before the hand-off
+            # and was stopped with SIGTTIN
+            kill_process_group(pgid, signal.SIGCONT)
+        yield handed_off
+    finally:
+        try:
+            os.tcsetpgrp(fd, os.getpgrp())
+        except OSError:
+            pass
+        signal.pthread_sigmask(signal.SIG_SETMASK, previous)
+
+
+class Watchdog:
+    """Kill a process group once it has run longer than `timeout` seconds"""
+    
+    def __init__(self, pid: int, timeout: Optional[float]):
+        self.pid = pid
+        self.timeout = timeout
+        self.expired = False
+        self._lock = threading.Lock()
+        self._done = False
+        self._timer = None
+        if timeout is not None:
+            self._timer = threading.Timer(max(timeout, 0), self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+    
+    def _expire(self):
+        with self._lock:
+            if self._done:
+                return
+            self.expired = True
+            kill_process_group(self.pid)
+    
+    def cancel(self):
+        """Stop the timer; after this the group is never signalled"""
+        with self._lock:
+            self._done = True
+        if self._timer is not None:
+            self._timer.cancel()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.cancel()
+
+
+def wait_with_usage(proc: subprocess.Popen, started: float,
+                    watchdog: Optional[Watchdog] = None) -> Tuple[int, ResourceUsage]:
+    """
+    Wait for a child and collect its resource usage with os.wait4.
+    
+    The child is first waited for without being reaped, so a running
+    watchdog is cancelled while the pid (and its process group id) cannot yet
+    be reused. A child stopped by Ctrl-Z is continued, since nlsh does not
+    put commands in the background on its own.
+    
+    Returns:
+        Tuple[int, ResourceUsage]: Exit code (negative signal number if the
+        child was killed, as with Popen) and usage
+    """
+    rusage = None
+    try:
+        if hasattr(os, 'waitid'):
+            while True:
+                info = os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WSTOPPED | os.WNOWAIT)
+                if info is None or info.si_code != os.CLD_STOPPED:
+                    break
+                os.waitid(os.P_PID, proc.pid, os.WSTOPPED)
+                kill_process_group(proc.pid, signal.SIGCONT)
+        if watchdog is not None:
+            watchdog.cancel()
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    except ChildProcessError:
+        # Already reaped elsewhere; exit code only
+        proc.wait()
+    finally:
+        if watchdog is not None:
+            watchdog.cancel()
+    return proc.returncode, ResourceUsage.from_rusage(started, rusage)
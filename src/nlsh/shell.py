@@ -5,25 +5,734 @@ import subprocess
 import shutil
 import asyncio
 import sys
-from dataclasses import dataclass
-from typing import Optional, Iterator, AsyncIterator
+import codecs
+import fcntl
+import io
+import json
+import selectors
+import shlex
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, Iterator, AsyncIterator, Callable, BinaryIO, List, Union
 
+from .capture import OutputCapture, DEFAULT_HEAD_BYTES, DEFAULT_TAIL_BYTES, BINARY_INVALID_RATIO
+from .terminal import run_in_pty, is_interactive_command
+from .process import (
+    DEFAULT_COMMAND_TIMEOUT, INTERRUPTED_EXIT_CODE, ResourceUsage, Watchdog,
+    foreground, kill_process_group, process_group_kwargs, wait_with_usage
+)
 
-@dataclass
+
+class _DeferredText:
+    """Text of a capture that has not been decoded yet"""
+    
+    def __init__(self, capture: OutputCapture, suffix: str = ""):
+        self.capture = capture
+        self.suffix = suffix
+    
+    def resolve(self) -> str:
+        if self.capture.is_binary:
+            return self.capture.summary() + self.suffix
+        return self.capture.text() + self.suffix
+
+
+@dataclass(init=False)
 class CommandResult:
-    """Result of executing a shell command"""
+    """
+    Result of executing a shell command.
+    
+    `output` and `error` hold the captured text, which is only a head/tail
+    excerpt when the stream was larger than the capture window. The full
+    streams are available through `open_output()` / `open_error()`, and the
+    raw bytes kept in memory through `output_bytes` / `error_bytes`.
+    
+    Captured output is only decoded when `output`/`error` is first read. A
+    stream that looks binary reads as a short size/checksum summary instead
+    of undecodable text.
+    
+    The timing fields are filled in when the command ran to completion: wall
+    time always, CPU time and peak memory only when nlsh reaped the command
+    itself (not in persistent shell mode).
+    """
     command: str
-    output: str
-    error: str
+    _output: Union[str, _DeferredText] = field(repr=False, compare=False)
+    _error: Union[str, _DeferredText] = field(repr=False, compare=False)
     return_code: int
     cwd: str
+    wall_time_ms: Optional[int] = None
+    user_time_ms: Optional[int] = None
+    sys_time_ms: Optional[int] = None
+    max_rss_kb: Optional[int] = None
+    stdout_capture: Optional[OutputCapture] = field(default=None, repr=False, compare=False)
+    stderr_capture: Optional[OutputCapture] = field(default=None, repr=False, compare=False)
+    
+    def __init__(self, command: str, output: Union[str, _DeferredText], error: Union[str, _DeferredText],
+                 return_code: int, cwd: str, wall_time_ms: Optional[int] = None,
+                 user_time_ms: Optional[int] = None, sys_time_ms: Optional[int] = None,
+                 max_rss_kb: Optional[int] = None, stdout_capture: Optional[OutputCapture] = None,
+                 stderr_capture: Optional[OutputCapture] = None):
+        self.command = command
+        self._output = output
+        self._error = error
+        self.return_code = return_code
+        self.cwd = cwd
+        self.wall_time_ms = wall_time_ms
+        self.user_time_ms = user_time_ms
+        self.sys_time_ms = sys_time_ms
+        self.max_rss_kb = max_rss_kb
+        self.stdout_capture = stdout_capture
+        self.stderr_capture = stderr_capture
+    
+    @property
+    def output(self) -> str:
+        if isinstance(self._output, _DeferredText):
+            self._output = self._output.resolve()
+        return self._output
+    
+    @output.setter
+    def output(self, value: str):
+        self._output = value
+    
+    @property
+    def error(self) -> str:
+        if isinstance(self._error, _DeferredText):
+            self._error = self._error.resolve()
+        return self._error
+    
+    @error.setter
+    def error(self, value: str):
+        self._error = value
+    
+    @classmethod
+    def from_captures(cls, command: str, stdout: OutputCapture, stderr: OutputCapture,
+                      return_code: int, cwd: str, error_suffix: str = "",
+                      usage: Optional[ResourceUsage] = None) -> 'CommandResult':
+        """Build a result from finished stdout/stderr captures"""
+        stdout.close()
+        stderr.close()
+        return cls(
+            command=command,
+            output=_DeferredText(stdout),
+            error=_DeferredText(stderr, error_suffix),
+            return_code=return_code,
+            cwd=cwd,
+            wall_time_ms=usage.wall_time_ms if usage else None,
+            user_time_ms=usage.user_time_ms if usage else None,
+            sys_time_ms=usage.sys_time_ms if usage else None,
+            max_rss_kb=usage.max_rss_kb if usage else None,
+            stdout_capture=stdout,
+            stderr_capture=stderr
+        )
+    
+    @property
+    def output_truncated(self) -> bool:
+        """Whether `output` or `error` is an excerpt of a larger stream"""
+        return any(c is not None and c.truncated for c in (self.stdout_capture, self.stderr_capture))
+    
+    @property
+    def output_is_binary(self) -> bool:
+        """Whether stdout looks like binary data"""
+        return self.stdout_capture is not None and self.stdout_capture.is_binary
+    
+    @property
+    def output_bytes(self) -> bytes:
+        """Raw stdout bytes held in memory (the head and tail if truncated)"""
+        if self.stdout_capture is not None:
+            return self.stdout_capture.excerpt()
+        return self.output.encode('utf-8')
+    
+    @property
+    def error_bytes(self) -> bytes:
+        """Raw stderr bytes held in memory (the head and tail if truncated)"""
+        if self.stderr_capture is not None:
+            return self.stderr_capture.excerpt()
+        return self.error.encode('utf-8')
+    
+    def open_output(self) -> BinaryIO:
+        """Open the full stdout stream as a binary file"""
+        if self.stdout_capture is not None:
+            return self.stdout_capture.open()
+        return io.BytesIO(self.output.encode('utf-8'))
+    
+    def open_error(self) -> BinaryIO:
+        """Open the full stderr stream as a binary file"""
+        if self.stderr_capture is not None:
+            return self.stderr_capture.open()
+        return io.BytesIO(self.error.encode('utf-8'))
+    
+    def to_dict(self) -> dict:
+        """JSON-friendly form with spill file references instead of capture objects"""
+        data = {
+            'command': self.command,
+            'output': self.output,
+            'error': self.error,
+            'return_code': self.return_code,
+            'cwd': self.cwd,
+        }
+        for key in ('wall_time_ms', 'user_time_ms', 'sys_time_ms', 'max_rss_kb'):
+            if getattr(self, key) is not None:
+                data[key] = getattr(self, key)
+        for name, capture in (('output', self.stdout_capture), ('error', self.stderr_capture)):
+            if capture is None:
+                continue
+            if capture.truncated:
+                data[f'{name}_size'] = capture.size
+                data[f'{name}_spill'] = capture.spill_path or None
+            if capture.is_binary:
+                # `output`/`error` already hold the summary rather than the bytes
+                data[f'{name}_size'] = capture.size
+                data[f'{name}_sha256'] = capture.sha256()
+        return data
 
 
-class ShellManager:
-    """Manages shell detection and command execution"""
+def _show_output(stream_type: str, content: str):
+    """Write a chunk of command output to the matching console stream"""
+    stream = sys.stderr if stream_type == 'stderr' else sys.stdout
+    stream.write(content)
+    stream.flush()
+
+
+class _ConsoleOutput:
+    """Live output callback that stops echoing a stream once it turns out binary"""
     
     def __init__(self):
+        self.binary_streams = set()
+    
+    def __call__(self, stream_type: str, content: str):
+        if stream_type in self.binary_streams:
+            return
+        if '\0' in content or content.count('\ufffd') > len(content) * BINARY_INVALID_RATIO:
+            self.binary_streams.add(stream_type)
+            _show_output(stream_type, f"\n[binary data on {stream_type} not shown]\n")
+            return
+        _show_output(stream_type, content)
+
+
+def _utf8_decoder():
+    """Incremental UTF-8 decoder that copes with characters split across reads"""
+    return codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+
+class PipeMultiplexer:
+    """
+    Event-driven reader for several subprocess pipes at once.
+    
+    Pipes are switched to non-blocking mode and drained in large chunks as
+    the selector reports them readable, so a chatty stderr can never stall
+    behind a stdout read and nothing spins while the command is quiet.
+    Chunks are yielded in the order they become available.
+    """
+    
+    def __init__(self, pipes: dict, read_size: int = 65536):
+        self.read_size = read_size
+        self.timed_out = False
+        self._selector = selectors.DefaultSelector()
+        self._names = {}
+        for name, pipe in pipes.items():
+            if pipe is None:
+                continue
+            fd = pipe.fileno()
+            os.set_blocking(fd, False)
+            self._selector.register(fd, selectors.EVENT_READ)
+            self._names[name] = fd
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def unregister(self, name: str):
+        """Stop watching a pipe (e.g. once it reached EOF)"""
+        fd = self._names.pop(name, None)
+        if fd is not None:
+            self._selector.unregister(fd)
+    
+    def close(self):
+        """Release the selector"""
+        self._selector.close()
+    
+    def read(self, timeout: Optional[float] = None) -> Iterator[tuple[str, bytes]]:
+        """
+        Yield (name, chunk) pairs until every pipe is closed or unregistered.
+        
+        An empty chunk marks EOF for that pipe. If the timeout expires first,
+        iteration stops and `timed_out` is set.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        by_fd = {fd: name for name, fd in self._names.items()}
+        
+        while self._names:
+            wait = None
+            if deadline is not None:
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    self.timed_out = True
+                    return
+            
+            for key, _ in self._selector.select(wait):
+                name = by_fd[key.fd]
+                if name not in self._names:
+                    continue  # Unregistered by the consumer mid-batch
+                try:
+                    chunk = os.read(key.fd, self.read_size)
+                except BlockingIOError:
+                    continue
+                if not chunk:
+                    self.unregister(name)
+                yield name, chunk
+
+
+# Defaults for the async streaming engine
+STREAM_CHUNK_SIZE = 65536
+STREAM_QUEUE_SIZE = 256
+
+
+class _StreamFramer:
+    """Cut one stream's decoded text into the items execute_command_streaming yields"""
+    
+    def __init__(self, line_mode: bool, chunk_size: int):
+        self.line_mode = line_mode
+        self.chunk_size = chunk_size
+        self.pending = ''
+    
+    def feed(self, text: str, final: bool = False) -> List[str]:
+        """Items completed by `text`; `final` flushes an unterminated last line"""
+        if not self.line_mode:
+            return [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        *lines, self.pending = (self.pending + text).split('\n')
+        items = [line + '\n' for line in lines]
+        # Don't let a huge unterminated line grow without bound
+        if self.pending and (len(self.pending) >= self.chunk_size or final):
+            items.append(self.pending)
+            self.pending = ''
+        return items
+
+
+async def _pump_stream(stream: asyncio.StreamReader, stream_type: str, queue: asyncio.Queue,
+                       line_mode: bool, chunk_size: int):
+    """Read one pipe in chunks and feed decoded text into the shared queue"""
+    decoder = _utf8_decoder()
+    framer = _StreamFramer(line_mode, chunk_size)
+    try:
+        while True:
+            chunk = await stream.read(chunk_size)
+            text = decoder.decode(chunk, final=not chunk)
+            for item in framer.feed(text, final=not chunk):
+                await queue.put((stream_type, item))
+            
+            if not chunk:
+                break
+    except (OSError, ValueError) as e:
+        await queue.put(('stderr', f"Error reading {stream_type}: {e}\n"))
+    
+    # Tell the consumer this pipe is finished
+    await queue.put((stream_type, None))
+
+
+# Shells that can run the POSIX bootstrap loop used by ShellSession
+SESSION_SHELLS = {'bash', 'zsh', 'sh', 'dash', 'ksh'}
+
+
+class ShellSession:
+    """
+    A long-lived shell coprocess that runs commands one after another.
+    
+    Commands are written to the shell's stdin followed by a sentinel line.
+    The shell evals the command and then prints the sentinel on stderr and,
+    together with the exit code and working directory, on stdout. This keeps
+    `cd`/`export` state between commands and pays shell startup only once.
+    If the shell dies (e.g. the command ran `exit`) it is restarted on the
+    next command in the last known working directory.
+    """
+    
+    READ_SIZE = 65536
+    
+    # Seconds a new shell has to report that it is ready for commands
+    START_TIMEOUT = 10
+    
+    def __init__(self, shell_path: str, cwd: Optional[str] = None,
+                 capture_factory: Callable[[], OutputCapture] = OutputCapture):
+        self.shell_path = shell_path
+        self.cwd = cwd or os.getcwd()
+        self.capture_factory = capture_factory
+        self.restarts = 0
+        self._proc: Optional[subprocess.Popen] = None
+        self._token = None
+        self._lock = threading.Lock()
+    
+    @property
+    def is_alive(self) -> bool:
+        """Whether the shell coprocess is currently running"""
+        return self._proc is not None and self._proc.poll() is None
+    
+    def _bootstrap_script(self, stdin_fd: int) -> str:
+        """
+        POSIX loop that reads framed commands from fd 3 and evals them. The
+        commands' stdin is reopened from `stdin_fd`, or /dev/null where that
+        cannot be done (a socket, say). "<token> ready" on stdout reports the
+        loop started; a status of "-" that the command could not be read.
+        """
+        token = self._token
+        return f"""exec 3<&0
+if (exec 0</dev/fd/{stdin_fd}) 2>/dev/null; then
+  exec 0</dev/fd/{stdin_fd}
+else
+  exec 0</dev/null
+fi
+printf '%s ready\n' "{token}"
+while :; do
+  __nlsh_cmd=
+  while :; do
+    if ! IFS= read -r __nlsh_line <&3; then
+      printf '%s\n' "{token}" >&2
+      printf '%s - %s\n' "{token}" "$PWD"
+      exit 0
+    fi
+    [ "$__nlsh_line" = "{token}" ] && break
+    __nlsh_cmd="$__nlsh_cmd$__nlsh_line
+"
+  done
+  eval "$__nlsh_cmd" 3<&-
+  __nlsh_rc=$?
+  printf '%s\n' "{token}" >&2
+  printf '%s %s %s\n' "{token}" "$__nlsh_rc" "$PWD"
+done
+"""
+    
+    def start(self):
+        """Start (or restart) the shell coprocess"""
+        if self._token is not None:
+            self.restarts += 1
+        self._terminate()
+        
+        self._token = f"__NLSH_{uuid.uuid4().hex}__"
+        
+        # Give the user's commands our stdin (usually the terminal) while the
+        # shell itself reads commands from the pipe, moved to fd 3
+        try:
+            source_fd = os.dup(sys.stdin.fileno())
+        except (OSError, ValueError, AttributeError):
+            source_fd = os.open(os.devnull, os.O_RDONLY)
+        # Keep it clear of fd 3, which the bootstrap script takes over
+        stdin_fd = fcntl.fcntl(source_fd, fcntl.F_DUPFD, 10)
+        os.close(source_fd)
+        
+        cwd = self.cwd if os.path.isdir(self.cwd) else os.getcwd()
+        try:
+            self._proc = subprocess.Popen(
+                [self.shell_path, '-c', self._bootstrap_script(stdin_fd)],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=cwd,
+                pass_fds=(stdin_fd,),
+                **process_group_kwargs()
+            )
+        finally:
+            os.close(stdin_fd)
+        self.cwd = cwd
+        self._wait_ready()
+    
+    def _wait_ready(self):
+        """Wait for the bootstrap's ready line, so a shell that cannot start is an error"""
+        ready = f"{self._token} ready\n".encode()
+        received = bytearray()
+        with PipeMultiplexer({'stdout': self._proc.stdout}, self.READ_SIZE) as mux:
+            for name, chunk in mux.read(self.START_TIMEOUT):
+                received.extend(chunk)
+                if not chunk or ready in received:
+                    break
+        if ready not in received:
+            self._terminate()
+            self._proc = None
+            raise RuntimeError(f"Shell session did not start ({self.shell_path})")
+    
+    def close(self):
+        """Shut down the shell coprocess"""
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+            self._proc.wait(timeout=1)
+        except Exception:
+            self._terminate()
+        self._proc = None
+    
+    def interrupt(self):
+        """Kill the shell and its commands mid-command; it restarts on the next command"""
+        proc = self._proc
+        if proc is not None and proc.poll() is None:
+            kill_process_group(proc.pid)
+    
+    def _terminate(self):
+        """Forcefully stop the current shell coprocess and everything it started"""
+        proc = self._proc
+        if proc is None:
+            return
+        try:
+            kill_process_group(proc.pid)
+            proc.wait(timeout=1)
+        except Exception:
+            pass
+        for pipe in (proc.stdin, proc.stdout, proc.stderr):
+            try:
+                pipe.close()
+            except Exception:
+                pass
+    
+    def run(self, command: str, on_output: Optional[Callable[[str, str], None]] = None,
+            timeout: Optional[float] = None) -> 'CommandResult':
+        """
+        Run a command in the session shell.
+        
+        Args:
+            command: Command line to evaluate
+            on_output: Optional callback receiving (stream_type, text) chunks
+                as they arrive, where stream_type is 'stdout' or 'stderr'
+            timeout: Seconds to wait before killing the session
+        """
+        with self._lock:
+            if not self.is_alive:
+                self.start()
+            
+            cwd = self.cwd
+            framed = command
+            # Follow directory changes made by nlsh itself
+            current = os.getcwd()
+            if current != self.cwd:
+                framed = f"cd -- {shlex.quote(current)}\n{command}"
+                cwd = current
+            
+            try:
+                self._proc.stdin.write(f"{framed}\n{self._token}\n".encode())
+                self._proc.stdin.flush()
+            except (BrokenPipeError, OSError):
+                # Shell died between commands; restart once and retry
+                self.start()
+                self._proc.stdin.write(f"{framed}\n{self._token}\n".encode())
+                self._proc.stdin.flush()
+            
+            stdout = self.capture_factory()
+            stderr = self.capture_factory()
+            started = time.monotonic()
+            try:
+                with foreground(self._proc.pid):
+                    status, timed_out = self._collect(stdout, stderr, on_output, timeout)
+            except KeyboardInterrupt:
+                self._terminate()
+                self._proc = None
+                return CommandResult.from_captures(
+                    command, stdout, stderr, INTERRUPTED_EXIT_CODE, cwd,
+                    error_suffix="Command interrupted",
+                    usage=ResourceUsage.from_rusage(started)
+                )
+            
+            # The shell's children are not reaped by us, so only wall time is known
+            usage = ResourceUsage.from_rusage(started)
+            if timed_out:
+                self._terminate()
+                self._proc = None
+                return CommandResult.from_captures(
+                    command, stdout, stderr, -1, cwd,
+                    error_suffix=f"Command timed out after {timeout} seconds",
+                    usage=usage
+                )
+            
+            if status is None:
+                # The shell exited before printing the sentinel
+                self._proc.wait()
+                return_code = self._proc.returncode
+                self._proc = None
+            elif status[0] is None:
+                # The command never ran: its exit status is not the shell's
+                self._terminate()
+                self._proc = None
+                return CommandResult.from_captures(
+                    command, stdout, stderr, -1, cwd,
+                    error_suffix="Shell session exited before reading the command",
+                    usage=usage
+                )
+            else:
+                return_code, new_cwd = status
+                self.cwd = new_cwd
+                if new_cwd != os.getcwd() and os.path.isdir(new_cwd):
+                    os.chdir(new_cwd)
+            
+            return CommandResult.from_captures(command, stdout, stderr, return_code, cwd,
+                                               usage=usage)
+    
+    def _collect(self, stdout: OutputCapture, stderr: OutputCapture, on_output, timeout):
+        """Read both pipes until each carries the sentinel or hits EOF"""
+        token = self._token.encode()
+        proc = self._proc
+        mux = PipeMultiplexer({'stdout': proc.stdout, 'stderr': proc.stderr}, self.READ_SIZE)
+        buffers = {'stdout': bytearray(), 'stderr': bytearray()}
+        decoders = {name: _utf8_decoder() for name in buffers}
+        captures = {'stdout': stdout, 'stderr': stderr}
+        status = None
+        
+        def emit(name, data, final=False):
+            captures[name].write(bytes(data))
+            if on_output:
+                text = decoders[name].decode(bytes(data), final=final)
+                if text:
+                    on_output(name, text)
+        
+        with mux:
+            for name, chunk in mux.read(timeout):
+                buf = buffers[name]
+                if not chunk:
+                    emit(name, buf, final=True)
+                    buf.clear()
+                    continue
+                buf.extend(chunk)
+                
+                index = buf.find(token)
+                if index == -1:
+                    # Hold back a possible partial sentinel at the end
+                    keep = len(token) - 1
+                    if len(buf) > keep:
+                        emit(name, buf[:len(buf) - keep])
+                        del buf[:len(buf) - keep]
+                    continue
+                
+                newline = buf.find(b'\n', index)
+                if newline == -1:
+                    continue  # Sentinel line not complete yet
+                emit(name, buf[:index], final=True)
+                if name == 'stdout':
+                    fields = buf[index + len(token):newline].decode(
+                        'utf-8', errors='replace').strip().split(' ', 1)
+                    try:
+                        status = (int(fields[0]), fields[1] if len(fields) > 1 else self.cwd)
+                    except ValueError:
+                        status = (None, self.cwd)  # "-": the command was not read
+                buf.clear()
+                mux.unregister(name)
+        
+        return status, mux.timed_out
+
+
+# Where shell versions are remembered between runs
+DEFAULT_SHELL_CACHE = Path.home() / '.nlsh' / 'shell_cache.json'
+
+
+class ShellInfoCache:
+    """
+    Shell versions keyed on the binary's path, inode and mtime.
+    
+    Entries are loaded from disk once and kept in memory, so `$SHELL
+    --version` only runs the first time a shell binary is seen and again
+    after it is upgraded or replaced.
+    """
+    
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path) if path else DEFAULT_SHELL_CACHE
+        self._entries: Optional[dict] = None
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _stamp(shell_path: str) -> list:
+        """Identity of the binary behind a shell path (follows symlinks)"""
+        stat = os.stat(shell_path)
+        return [stat.st_ino, stat.st_mtime_ns]
+    
+    def _load(self) -> dict:
+        if self._entries is None:
+            try:
+                with open(self.path) as f:
+                    self._entries = json.load(f)
+                if not isinstance(self._entries, dict):
+                    self._entries = {}
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+    
+    def _save(self):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+            with open(temp_path, 'w') as f:
+                json.dump(self._entries, f, indent=2)
+            os.replace(temp_path, self.path)
+        except OSError:
+            pass  # The in-memory copy still serves this session
+    
+    def get_version(self, shell_path: str, probe: Callable[[], str]) -> str:
+        """Return the cached version of a shell, calling probe() on a miss"""
+        try:
+            stamp = self._stamp(shell_path)
+        except OSError:
+            return probe()
+        
+        with self._lock:
+            entry = self._load().get(shell_path)
+            if entry and entry.get('stamp') == stamp:
+                return entry['version']
+        
+        version = probe()
+        with self._lock:
+            self._load()[shell_path] = {'stamp': stamp, 'version': version}
+            self._save()
+        return version
+
+
+# Shared by all ShellManagers in the process
+SHELL_INFO_CACHE = ShellInfoCache()
+
+
+class ShellManager:
+    """
+    Manages shell detection and command execution.
+    
+    Every command runs in its own process group, so a timeout or Ctrl-C
+    stops the whole pipeline and anything it started, not just the shell.
+    `timeout` applies to captured commands (`execute_command`), and
+    `live_timeout` to commands shown live or streamed; None means no limit.
+    """
+    
+    def __init__(self, persistent: bool = False, capture_head_bytes: int = DEFAULT_HEAD_BYTES,
+                 capture_tail_bytes: int = DEFAULT_TAIL_BYTES, spill_dir: Optional[str] = None,
+                 timeout: Optional[float] = DEFAULT_COMMAND_TIMEOUT,
+                 live_timeout: Optional[float] = None,
+                 shell_cache: Optional[ShellInfoCache] = None):
+        self.shell_cache = shell_cache or SHELL_INFO_CACHE
+        self._running = set()  # Process groups of concurrently run commands
+        self._running_lock = threading.Lock()
+        self._shell_path = None  # (environment it was resolved for, path)
         self.detected_shell = self._detect_shell()
+        self.persistent = persistent
+        self.timeout = timeout
+        self.live_timeout = live_timeout
+        self.capture_head_bytes = capture_head_bytes
+        self.capture_tail_bytes = capture_tail_bytes
+        self.spill_dir = spill_dir
+        self._session: Optional[ShellSession] = None
+    
+    @property
+    def session(self) -> Optional[ShellSession]:
+        """The long-lived shell session, if session mode is usable"""
+        if not self.persistent or self.detected_shell not in SESSION_SHELLS:
+            return None
+        if self._session is None:
+            self._session = ShellSession(self.get_shell_path(), capture_factory=self.new_capture)
+        return self._session
+    
+    def new_capture(self) -> OutputCapture:
+        """Create an output capture using this manager's window settings"""
+        return OutputCapture(self.capture_head_bytes, self.capture_tail_bytes, self.spill_dir)
+    
+    def close(self):
+        """Release the shell session, if one was started"""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
         
     def _detect_shell(self) -> str:
         """Detect the user's current shell"""
@@ -46,6 +755,14 @@ class ShellManager:
     
     def get_shell_path(self) -> str:
         """Get the full path to the detected shell"""
+        # Resolved once per $SHELL/$PATH rather than on every command
+        key = (os.environ.get('SHELL'), os.environ.get('PATH'))
+        if self._shell_path is None or self._shell_path[0] != key:
+            self._shell_path = (key, self._resolve_shell_path())
+        return self._shell_path[1]
+    
+    def _resolve_shell_path(self) -> str:
+        """Look up the shell binary in the environment and PATH"""
         shell_path = os.environ.get('SHELL')
         if shell_path and shutil.which(shell_path):
             return shell_path
@@ -60,45 +777,91 @@ class ShellManager:
     def execute_command(self, command: str) -> CommandResult:
         """Execute a command in the detected shell"""
         cwd = os.getcwd()
-        shell_path = self.get_shell_path()
         
-        try:
-            # Execute command through the user's shell
-            if self.detected_shell == 'fish':
-                # Fish shell needs special handling
-                result = subprocess.run(
-                    [shell_path, '-c', command],
-                    capture_output=True,
-                    text=True,
-                    cwd=cwd,
-                    timeout=30  # 30 second timeout
-                )
-            else:
-                # Most shells (bash, zsh, sh) use -c flag
-                result = subprocess.run(
-                    [shell_path, '-c', command],
-                    capture_output=True,
-                    text=True,
-                    cwd=cwd,
-                    timeout=30
+        session = self.session
+        if session:
+            try:
+                return session.run(command, timeout=self.timeout)
+            except Exception as e:
+                return CommandResult(
+                    command=command,
+                    output="",
+                    error=f"Failed to execute command: {e}",
+                    return_code=-1,
+                    cwd=cwd
                 )
-            
-            return CommandResult(
-                command=command,
-                output=result.stdout,
-                error=result.stderr,
-                return_code=result.returncode,
-                cwd=cwd
+        
+        return self._run_piped(command, cwd, timeout=self.timeout)
+    
+    def _run_piped(self, command: str, cwd: str,
+                   on_output: Optional[Callable[[str, str], None]] = None,
+                   timeout: Optional[float] = None, interactive: bool = True) -> CommandResult:
+        """
+        Run a command with piped stdout/stderr into bounded captures.
+        
+        The command gets its own process group. If `interactive`, that group
+        is made the terminal's foreground group while it runs so it can still
+        read the terminal and receives Ctrl-C directly; otherwise its stdin
+        is /dev/null. On timeout the whole group is killed.
+        """
+        try:
+            started = time.monotonic()
+            proc = subprocess.Popen(
+                [self.get_shell_path(), '-c', command],
+                stdin=None if interactive else subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=cwd,
+                **process_group_kwargs()
             )
+            if not interactive:
+                with self._running_lock:
+                    self._running.add(proc.pid)
             
-        except subprocess.TimeoutExpired:
-            return CommandResult(
-                command=command,
-                output="",
-                error="Command timed out after 30 seconds",
-                return_code=-1,
-                cwd=cwd
+            captures = {'stdout': self.new_capture(), 'stderr': self.new_capture()}
+            decoders = {name: _utf8_decoder() for name in captures}
+            error_suffix = ""
+            timed_out = False
+            
+            terminal = foreground(proc.pid) if interactive else nullcontext()
+            with terminal, Watchdog(proc.pid, timeout) as watchdog:
+                try:
+                    # Drain both pipes as data arrives. The watchdog kills the
+                    # group on time; the read timeout covers a process that
+                    # left the group while still holding a pipe open.
+                    with PipeMultiplexer({'stdout': proc.stdout, 'stderr': proc.stderr}) as mux:
+                        for name, chunk in mux.read(timeout):
+                            captures[name].write(chunk)
+                            if on_output:
+                                text = decoders[name].decode(chunk, final=not chunk)
+                                if text:
+                                    on_output(name, text)
+                    timed_out = mux.timed_out
+                    if timed_out:
+                        kill_process_group(proc.pid)
+                    if not interactive:
+                        with self._running_lock:
+                            self._running.discard(proc.pid)
+                    return_code, usage = wait_with_usage(proc, started, watchdog)
+                except KeyboardInterrupt:
+                    # Only reached when the terminal could not be handed over
+                    kill_process_group(proc.pid)
+                    _, usage = wait_with_usage(proc, started, watchdog)
+                    return_code = INTERRUPTED_EXIT_CODE
+                    error_suffix = "Command interrupted"
+            
+            proc.stdout.close()
+            proc.stderr.close()
+            
+            if watchdog.expired or timed_out:
+                return_code = -1
+                error_suffix = f"Command timed out after {timeout} seconds"
+            
+            return CommandResult.from_captures(
+                command, captures['stdout'], captures['stderr'], return_code, cwd,
+                error_suffix=error_suffix, usage=usage
             )
+            
         except Exception as e:
             return CommandResult(
                 command=command,
@@ -108,164 +871,228 @@ class ShellManager:
                 cwd=cwd
             )
 
-    async def execute_command_streaming(self, command: str) -> AsyncIterator[tuple[str, str]]:
+    def execute_commands_concurrently(
+        self, commands: List[str],
+        on_output: Optional[Callable[[int, str, str], None]] = None,
+        on_done: Optional[Callable[[int, CommandResult], None]] = None
+    ) -> List[CommandResult]:
+        """
+        Run independent commands at the same time, each in a fresh shell.
+        
+        Commands get /dev/null as stdin and keep nlsh's working directory
+        (in persistent mode, the session's); variables exported in the
+        session are not visible to them. Ctrl-C kills every command still
+        running. `live_timeout` applies to each command.
+        
+        Args:
+            commands: Command lines to run
+            on_output: Optional callback receiving (index, stream_type, text)
+            on_done: Optional callback receiving (index, result) as each finishes
+        
+        Returns:
+            List[CommandResult]: Results in the order of `commands`
+        """
+        cwd = os.getcwd()
+        
+        def run(index: int) -> CommandResult:
+            forward = (lambda stream_type, text: on_output(index, stream_type, text)) if on_output else None
+            result = self._run_piped(commands[index], cwd, on_output=forward,
+                                     timeout=self.live_timeout, interactive=False)
+            if on_done:
+                on_done(index, result)
+            return result
+        
+        with ThreadPoolExecutor(max_workers=max(len(commands), 1)) as pool:
+            futures = [pool.submit(run, index) for index in range(len(commands))]
+            try:
+                return [future.result() for future in futures]
+            except KeyboardInterrupt:
+                with self._running_lock:
+                    running = list(self._running)
+                for pid in running:
+                    kill_process_group(pid)
+                return [future.result() for future in futures]
+    
+    async def execute_command_streaming(self, command: str, line_mode: bool = True,
+                                        chunk_size: int = STREAM_CHUNK_SIZE,
+                                        max_queued: int = STREAM_QUEUE_SIZE
+                                        ) -> AsyncIterator[tuple[str, str]]:
         """
         Execute a command with streaming output.
         
+        One reader task per pipe feeds a bounded queue, so output is yielded
+        in arrival order and a slow consumer pauses the readers (and, through
+        the full pipe, the command) instead of buffering without limit. If the
+        consumer stops early or is cancelled, or the command runs longer than
+        `live_timeout`, the command's whole process group is killed. The
+        command's stdin is /dev/null.
+        
+        Args:
+            command: Command line to run
+            line_mode: Yield one item per line; otherwise yield raw chunks
+            chunk_size: Maximum bytes read from a pipe at a time; no item
+                yielded is longer, in session mode too
+            max_queued: Maximum items buffered ahead of the consumer
+        
         Yields:
             tuple[str, str]: (stream_type, content) where stream_type is 'stdout', 'stderr', or 'exit'
         """
         cwd = os.getcwd()
         shell_path = self.get_shell_path()
         
+        if self.session:
+            async for item in self._session_streaming(command, line_mode, chunk_size, max_queued):
+                yield item
+            return
+        
+        proc = None
+        readers = []
         try:
-            # Create subprocess with pipes for real-time output
-            if self.detected_shell == 'fish':
-                proc = await asyncio.create_subprocess_exec(
-                    shell_path, '-c', command,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE,
-                    cwd=cwd
-                )
-            else:
-                proc = await asyncio.create_subprocess_exec(
-                    shell_path, '-c', command,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE,
-                    cwd=cwd
-                )
-            
-            # Stream output in real-time
-            async def read_stream(stream, stream_type):
-                while True:
-                    line = await stream.readline()
-                    if not line:
-                        break
-                    yield (stream_type, line.decode('utf-8', errors='replace'))
-            
-            # Create tasks for reading both stdout and stderr
-            stdout_task = asyncio.create_task(
-                self._collect_stream_output(read_stream(proc.stdout, 'stdout'))
-            )
-            stderr_task = asyncio.create_task(
-                self._collect_stream_output(read_stream(proc.stderr, 'stderr'))
+            proc = await asyncio.create_subprocess_exec(
+                shell_path, '-c', command,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=cwd,
+                **process_group_kwargs()
             )
             
-            # Yield output as it comes
-            while not proc.returncode and (not stdout_task.done() or not stderr_task.done()):
-                if not stdout_task.done():
-                    try:
-                        stream_type, content = await asyncio.wait_for(stdout_task, timeout=0.1)
-                        yield (stream_type, content)
-                        stdout_task = asyncio.create_task(
-                            self._collect_stream_output(read_stream(proc.stdout, 'stdout'))
-                        )
-                    except asyncio.TimeoutError:
-                        pass
-                
-                if not stderr_task.done():
-                    try:
-                        stream_type, content = await asyncio.wait_for(stderr_task, timeout=0.1)
-                        yield (stream_type, content)
-                        stderr_task = asyncio.create_task(
-                            self._collect_stream_output(read_stream(proc.stderr, 'stderr'))
-                        )
-                    except asyncio.TimeoutError:
-                        pass
-                
-                await asyncio.sleep(0.01)  # Small delay to prevent busy waiting
+            queue: asyncio.Queue = asyncio.Queue(maxsize=max_queued)
+            readers = [
+                asyncio.create_task(
+                    _pump_stream(proc.stdout, 'stdout', queue, line_mode, chunk_size)),
+                asyncio.create_task(
+                    _pump_stream(proc.stderr, 'stderr', queue, line_mode, chunk_size)),
+            ]
             
-            # Wait for process to complete
-            await proc.wait()
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.live_timeout if self.live_timeout is not None else None
             
-            # Cancel any remaining tasks
-            stdout_task.cancel()
-            stderr_task.cancel()
+            # Each reader puts a (stream_type, None) marker when its pipe closes
+            open_pipes = len(readers)
+            while open_pipes:
+                try:
+                    remaining = None if deadline is None else max(deadline - loop.time(), 0)
+                    stream_type, content = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    yield ('stderr', f"Command timed out after {self.live_timeout} seconds\n")
+                    yield ('exit', '-1')
+                    return
+                if content is None:
+                    open_pipes -= 1
+                    continue
+                yield (stream_type, content)
             
-            # Yield exit code
+            await proc.wait()
             yield ('exit', str(proc.returncode))
             
         except Exception as e:
             yield ('stderr', f"Failed to execute command: {e}\n")
             yield ('exit', '-1')
-
-    async def _collect_stream_output(self, stream_generator):
-        """Helper to collect single output from stream generator"""
-        async for stream_type, content in stream_generator:
-            return (stream_type, content)
-        return None
+        finally:
+            for reader in readers:
+                reader.cancel()
+            if proc is not None and proc.returncode is None:
+                kill_process_group(proc.pid)
+                await proc.wait()
     
-    def execute_command_with_live_output(self, command: str) -> CommandResult:
+    async def _session_streaming(self, command: str, line_mode: bool, chunk_size: int,
+                                 max_queued: int) -> AsyncIterator[tuple[str, str]]:
+        """
+        Stream a command run in the session shell from a worker thread,
+        framed into lines or chunks like the output of a separate process
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max_queued)
+        cancelled = threading.Event()
+        framers = {name: _StreamFramer(line_mode, chunk_size) for name in ('stdout', 'stderr')}
+        
+        def put(stream_type, content):
+            if cancelled.is_set():
+                return
+            # Block the worker until the consumer has room (backpressure)
+            asyncio.run_coroutine_threadsafe(queue.put((stream_type, content)), loop).result()
+        
+        def on_output(stream_type, content, final=False):
+            for item in framers[stream_type].feed(content, final):
+                put(stream_type, item)
+        
+        def run():
+            try:
+                result = self.session.run(command, on_output=on_output,
+                                          timeout=self.live_timeout)
+                for name in framers:
+                    on_output(name, '', final=True)
+                put('exit', str(result.return_code))
+            except Exception as e:
+                put('stderr', f"Failed to execute command: {e}\n")
+                put('exit', '-1')
+        
+        worker = loop.run_in_executor(None, run)
+        finished = False
+        try:
+            while not finished:
+                stream_type, content = await queue.get()
+                finished = stream_type == 'exit'
+                yield (stream_type, content)
+        finally:
+            if not finished:
+                cancelled.set()
+                self.session.interrupt()
+                # Unblock a worker waiting on a full queue
+                while not queue.empty():
+                    queue.get_nowait()
+            await worker
+    
+    def execute_command_with_live_output(self, command: str, mode: Optional[str] = None) -> CommandResult:
         """
         Execute a command with live output displayed to console.
         Returns the complete result after execution.
+        
+        Args:
+            command: Command line to run
+            mode: 'pipe' to capture stdout/stderr through pipes, 'pty' to run
+                the command on a pseudo-terminal with passthrough, or None to
+                pick PTY for known interactive programs and pipes otherwise
         """
         cwd = os.getcwd()
-        shell_path = self.get_shell_path()
         
-        try:
-            # Execute command with real-time output
-            if self.detected_shell == 'fish':
-                proc = subprocess.Popen(
-                    [shell_path, '-c', command],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    cwd=cwd,
-                    bufsize=1,  # Line buffering
-                    universal_newlines=True
-                )
-            else:
-                proc = subprocess.Popen(
-                    [shell_path, '-c', command],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    cwd=cwd,
-                    bufsize=1,  # Line buffering
-                    universal_newlines=True
+        if mode is None:
+            mode = 'pty' if self._can_use_pty() and is_interactive_command(command) else 'pipe'
+        if mode == 'pty':
+            return self.execute_command_pty(command)
+        
+        session = self.session
+        if session:
+            try:
+                return session.run(command, on_output=_ConsoleOutput(),
+                                   timeout=self.live_timeout)
+            except Exception as e:
+                return CommandResult(
+                    command=command,
+                    output="",
+                    error=f"Failed to execute command: {e}",
+                    return_code=-1,
+                    cwd=cwd
                 )
-            
-            stdout_lines = []
-            stderr_lines = []
-            
-            # Read and display output in real-time
-            while True:
-                # Check if process is still running
-                if proc.poll() is not None:
-                    break
-                
-                # Read stdout if available
-                if proc.stdout:
-                    line = proc.stdout.readline()
-                    if line:
-                        print(line, end='', flush=True)
-                        stdout_lines.append(line)
-                
-                # Read stderr if available  
-                if proc.stderr:
-                    line = proc.stderr.readline()
-                    if line:
-                        print(line, end='', file=sys.stderr, flush=True)
-                        stderr_lines.append(line)
-            
-            # Get any remaining output
-            remaining_stdout, remaining_stderr = proc.communicate()
-            if remaining_stdout:
-                print(remaining_stdout, end='', flush=True)
-                stdout_lines.append(remaining_stdout)
-            if remaining_stderr:
-                print(remaining_stderr, end='', file=sys.stderr, flush=True)
-                stderr_lines.append(remaining_stderr)
-            
-            return CommandResult(
-                command=command,
-                output=''.join(stdout_lines),
-                error=''.join(stderr_lines),
-                return_code=proc.returncode,
-                cwd=cwd
-            )
-            
+        
+        return self._run_piped(command, cwd, on_output=_ConsoleOutput(),
+                               timeout=self.live_timeout)
+    
+    def execute_command_pty(self, command: str) -> CommandResult:
+        """
+        Execute a command on a pseudo-terminal, relaying it to the real one.
+        
+        Colours, progress bars and full-screen programs work as in a normal
+        shell. Output is merged into `output`, of which only a bounded copy is
+        kept. PTY commands always run in a fresh shell, so exported variables
+        from a persistent session are not visible to them.
+        """
+        cwd = os.getcwd()
+        stdout = self.new_capture()
+        stderr = self.new_capture()
+        try:
+            return_code, usage = run_in_pty([self.get_shell_path(), '-c', command], cwd, stdout)
         except Exception as e:
             return CommandResult(
                 command=command,
@@ -274,6 +1101,15 @@ class ShellManager:
                 return_code=-1,
                 cwd=cwd
             )
+        return CommandResult.from_captures(command, stdout, stderr, return_code, cwd,
+                                           usage=usage)
+    
+    def _can_use_pty(self) -> bool:
+        """PTY passthrough only makes sense when attached to a terminal"""
+        try:
+            return sys.stdin.isatty() and sys.stdout.isatty()
+        except (AttributeError, ValueError):
+            return False
     
     def get_shell_info(self) -> dict:
         """Get information about the detected shell for LLM context"""
@@ -285,7 +1121,11 @@ class ShellManager:
         }
     
     def _get_shell_version(self) -> str:
-        """Get the version of the detected shell"""
+        """Get the version of the detected shell, from the cache when possible"""
+        return self.shell_cache.get_version(self.get_shell_path(), self._probe_shell_version)
+    
+    def _probe_shell_version(self) -> str:
+        """Run the shell to find out its version"""
         try:
             version_commands = {
                 'bash': '--version',
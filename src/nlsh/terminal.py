@@ -0,0 +1,195 @@
+"""PTY-backed command execution with terminal passthrough"""
+
+import errno
+import fcntl
+import os
+import pty
+import selectors
+import signal
+import subprocess
+import sys
+import termios
+import time
+import tty
+from typing import List, Optional, Tuple
+
+from .capture import OutputCapture
+from .process import ResourceUsage, wait_with_usage
+
+# Bytes moved per read between the terminal and the PTY
+RELAY_CHUNK_SIZE = 65536
+
+# Programs that need a real terminal to be usable
+INTERACTIVE_COMMANDS = {
+    'top', 'htop', 'btop', 'less', 'more', 'most', 'man', 'vi', 'vim', 'nvim', 'nano',
+    'emacs', 'ssh', 'mosh', 'tmux', 'screen', 'watch', 'ncdu', 'tig', 'fzf', 'mc',
+    'ipython', 'psql', 'mysql', 'sqlite3',
+}
+
+# Interpreters and shells that are only interactive when run without arguments
+REPL_COMMANDS = {'python', 'python3', 'node', 'irb', 'bash', 'zsh', 'fish', 'sh'}
+
+# git subcommands and flags that open an editor or prompt interactively
+INTERACTIVE_GIT = {'add -p', 'add -i', 'add --patch', 'add --interactive', 'commit',
+                   'rebase -i', 'rebase --interactive', 'log', 'diff', 'show'}
+
+
+def is_interactive_command(command: str) -> bool:
+    """Guess whether a command line needs a terminal rather than pipes"""
+    words = command.strip().split()
+    # Skip leading environment assignments and sudo
+    while words and ('=' in words[0] and not words[0].startswith('=') or words[0] == 'sudo'):
+        words = words[1:]
+    if not words:
+        return False
+    
+    program = os.path.basename(words[0])
+    if program == 'git' and len(words) > 1:
+        rest = ' '.join(words[1:])
+        if words[1] == 'commit':
+            return '-m' not in words[2:] and '--message' not in rest
+        return any(rest == sub or rest.startswith(sub + ' ') for sub in INTERACTIVE_GIT)
+    
+    if program in REPL_COMMANDS:
+        return len(words) == 1
+    
+    return program in INTERACTIVE_COMMANDS
+
+
+def _stream_fd(stream) -> Optional[int]:
+    """File descriptor behind a standard stream, if it has one"""
+    try:
+        return stream.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _terminal_fd(stream) -> Optional[int]:
+    """File descriptor of a standard stream if it is a terminal"""
+    fd = _stream_fd(stream)
+    return fd if fd is not None and os.isatty(fd) else None
+
+
+def _copy_window_size(source_fd: Optional[int], target_fd: int):
+    """Give the PTY the same size as the real terminal"""
+    if source_fd is None:
+        return
+    try:
+        size = fcntl.ioctl(source_fd, termios.TIOCGWINSZ, b'\0' * 8)
+        fcntl.ioctl(target_fd, termios.TIOCSWINSZ, size)
+    except OSError:
+        pass
+
+
+def _make_controlling_terminal():
+    """Run in the child: adopt the PTY on stdin as controlling terminal"""
+    fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+
+def run_in_pty(argv: List[str], cwd: str, capture: OutputCapture) -> Tuple[int, ResourceUsage]:
+    """
+    Run a command attached to a new pseudo-terminal.
+    
+    Output is relayed to the real stdout in large chunks while a bounded copy
+    is written to `capture`. Keystrokes from a terminal stdin are forwarded
+    raw, so full-screen and prompting programs behave as they would in a
+    normal shell, and terminal resizes are passed on to the PTY.
+    
+    Returns:
+        Tuple[int, ResourceUsage]: The command's exit code and resource usage
+    """
+    master_fd, slave_fd = pty.openpty()
+    stdin_fd = _terminal_fd(sys.stdin)
+    stdout_fd = _stream_fd(sys.stdout)
+    size_fd = _terminal_fd(sys.stdout) or stdin_fd
+    _copy_window_size(size_fd, slave_fd)
+    sys.stdout.flush()
+    
+    started = time.monotonic()
+    try:
+        proc = subprocess.Popen(
+            argv,
+            stdin=slave_fd,
+            stdout=slave_fd,
+            stderr=slave_fd,
+            cwd=cwd,
+            start_new_session=True,
+            preexec_fn=_make_controlling_terminal
+        )
+    finally:
+        os.close(slave_fd)
+    
+    # Forward terminal resizes while the command runs
+    previous_winch = None
+    
+    def on_resize(signum, frame):
+        _copy_window_size(size_fd, master_fd)
+        if callable(previous_winch):
+            previous_winch(signum, frame)
+    
+    try:
+        previous_winch = signal.signal(signal.SIGWINCH, on_resize)
+    except ValueError:
+        pass  # Not in the main thread
+    
+    saved_attrs = None
+    if stdin_fd is not None:
+        saved_attrs = termios.tcgetattr(stdin_fd)
+        tty.setraw(stdin_fd)
+    
+    selector = selectors.DefaultSelector()
+    selector.register(master_fd, selectors.EVENT_READ)
+    if stdin_fd is not None:
+        selector.register(stdin_fd, selectors.EVENT_READ)
+    
+    try:
+        while True:
+            try:
+                events = selector.select()
+            except InterruptedError:
+                continue
+            
+            done = False
+            for key, _ in events:
+                if key.fd == master_fd:
+                    try:
+                        data = os.read(master_fd, RELAY_CHUNK_SIZE)
+                    except OSError as e:
+                        if e.errno != errno.EIO:
+                            raise
+                        data = b''  # Linux reports EIO once the child side closes
+                    if not data:
+                        done = True
+                        break
+                    _write_all(stdout_fd, data)
+                    capture.write(data)
+                else:
+                    data = os.read(stdin_fd, RELAY_CHUNK_SIZE)
+                    if not data:
+                        selector.unregister(stdin_fd)
+                        continue
+                    _write_all(master_fd, data)
+            if done:
+                break
+    finally:
+        selector.close()
+        if saved_attrs is not None:
+            termios.tcsetattr(stdin_fd, termios.TCSADRAIN, saved_attrs)
+        if previous_winch is not None:
+            signal.signal(signal.SIGWINCH, previous_winch)
+        os.close(master_fd)
+        capture.close()
+    
+    return wait_with_usage(proc, started)
+
+
+def _write_all(fd: Optional[int], data: bytes):
+    """Write a whole chunk to a descriptor, or to sys.stdout when it has none"""
+    if fd is None:
+        sys.stdout.write(data.decode('utf-8', errors='replace'))
+        sys.stdout.flush()
+        return
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
@@ -1,6 +1,7 @@
 """Utility functions for nlsh"""
 
 import sys
+from typing import Optional
 from rich.console import Console
 
 console = Console()
@@ -37,4 +38,37 @@ def confirm_action(message: str = "Continue?") -> bool:
             raise KeyboardInterrupt
         except EOFError:
             console.print("\n🚪 [blue]Exiting...[/blue]")
-            sys.exit(0) 
\ No newline at end of file
+            sys.exit(0)
+
+
+def choose_option(message: str, count: int) -> Optional[int]:
+    """
+    Let the user pick one of `count` numbered options
+    
+    Args:
+        message: The question to display
+        count: How many options were listed, numbered from 1
+    
+    Returns:
+        Optional[int]: The number picked, or None for an empty answer; exits on q
+    """
+    while True:
+        try:
+            console.print(f"[bold yellow]{message} (1-{count}/Enter/q):[/bold yellow] ", end="")
+            response = input().strip().lower()
+            
+            if not response:
+                return None
+            elif response in ['q', 'quit']:
+                console.print("🚪 [blue]Exiting...[/blue]")
+                sys.exit(0)
+            elif response.isdigit() and 1 <= int(response) <= count:
+                return int(response)
+            else:
+                console.print(f"[red]Please enter a number from 1 to {count}, or just Enter to skip.[/red]")
+        except KeyboardInterrupt:
+            console.print("\n🛑 [red]Interrupted[/red]")
+            raise KeyboardInterrupt
+        except EOFError:
+            console.print("\n🚪 [blue]Exiting...[/blue]")
+            sys.exit(0)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Tests for bounded output capture and spill-to-disk"""
+
+import hashlib
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, 'src')
+
+from nlsh.capture import OutputCapture
+from nlsh.shell import CommandResult, ShellManager
+from nlsh.history import HistoryManager
+
+
+def test_small_output_stays_in_memory():
+    """Output within the window is kept whole and never spilled"""
+    with tempfile.TemporaryDirectory() as tmp:
+        capture = OutputCapture(head_bytes=16, tail_bytes=16, spill_dir=tmp)
+        capture.write(b"hello ")
+        capture.write(b"world")
+        capture.close()
+        
+        assert not capture.truncated
+        assert capture.text() == "hello world"
+        assert capture.open().read() == b"hello world"
+        assert os.listdir(tmp) == []
+
+
+def test_large_output_spills_to_disk():
+    """Large output keeps head and tail in memory and the rest on disk"""
+    with tempfile.TemporaryDirectory() as tmp:
+        capture = OutputCapture(head_bytes=10, tail_bytes=10, spill_dir=tmp)
+        data = b"".join(b"%05d\n" % i for i in range(1000))
+        for start in range(0, len(data), 97):
+            capture.write(data[start:start + 97])
+        capture.close()
+        
+        assert capture.truncated
+        assert capture.size == len(data)
+        assert capture.excerpt() == data[:10] + data[-10:]
+        assert "bytes omitted" in capture.text()
+        with capture.open() as stream:
+            assert stream.read() == data
+        assert bytes(capture.mmap()[:12]) == data[:12]
+
+
+def test_shell_manager_bounds_result():
+    """CommandResult holds an excerpt and exposes the full stream lazily"""
+    with tempfile.TemporaryDirectory() as tmp:
+        shell_manager = ShellManager(capture_head_bytes=100, capture_tail_bytes=100, spill_dir=tmp)
+        result = shell_manager.execute_command("seq 1 10000")
+        
+        assert result.return_code == 0
+        assert result.output_truncated
+        assert result.output.startswith("1\n2\n")
+        assert result.output.endswith("9999\n10000\n")
+        assert len(result.output) < 400
+        with result.open_output() as stream:
+            assert stream.read().decode().splitlines() == [str(i) for i in range(1, 10001)]
+
+
+def test_history_stores_excerpt_and_spill_reference():
+    """History keeps a bounded excerpt plus the spill file reference"""
+    with tempfile.TemporaryDirectory() as tmp:
+        shell_manager = ShellManager(capture_head_bytes=100, capture_tail_bytes=100, spill_dir=tmp)
+        history_manager = HistoryManager(db_path=os.path.join(tmp, 'history.db'))
+        
+        result = shell_manager.execute_command("seq 1 10000")
+        history_manager.log_shell_command("seq 1 10000", result)
+        
+        entry = history_manager.get_recent_commands(limit=1)[0]
+        data = entry['data']
+        assert data['output'] == result.output
+        assert data['output_size'] == result.stdout_capture.size
+        assert data['output_spill'] == result.stdout_capture.spill_path
+        assert os.path.exists(data['output_spill'])
+
+
+def test_binary_output_is_summarised():
+    """Binary output keeps its bytes but reads and stores as a summary"""
+    with tempfile.TemporaryDirectory() as tmp:
+        shell_manager = ShellManager(spill_dir=tmp)
+        result = shell_manager.execute_command("printf 'PK\\003\\004\\000\\001\\377\\376'")
+        
+        assert result.output_is_binary
+        assert result.output_bytes == b'PK\x03\x04\x00\x01\xff\xfe'
+        assert result.output.startswith("[binary data: 8 bytes, sha256 ")
+        
+        history_manager = HistoryManager(db_path=os.path.join(tmp, 'history.db'))
+        history_manager.log_shell_command("zip", result)
+        data = history_manager.get_recent_commands(1)[0]['data']
+        assert data['output'] == result.output
+        assert data['output_size'] == 8
+        assert data['output_sha256'] == hashlib.sha256(result.output_bytes).hexdigest()
+
+
+def test_text_output_is_decoded_lazily(monkeypatch):
+    """Output is decoded once, on first access, and non-UTF-8 text is not binary"""
+    decoded = []
+    text = OutputCapture.text
+    monkeypatch.setattr(OutputCapture, 'text', lambda self: decoded.append(self) or text(self))
+    capture = OutputCapture()
+    capture.write("café ".encode('latin-1') * 100)
+    result = CommandResult.from_captures("cat", capture, OutputCapture(), 0, "/")
+    
+    assert decoded == []
+    assert not result.output_is_binary
+    assert result.output.startswith("caf� ")
+    assert result.output.startswith("caf� ")
+    assert decoded == [capture]
+    assert result.error == ""
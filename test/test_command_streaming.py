@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Tests for the async command streaming engine"""
+
+import asyncio
+import sys
+
+sys.path.insert(0, 'src')
+
+from nlsh.shell import ShellManager
+from nlsh.streaming import AsyncStreamingResponse
+
+
+async def _collect(stream):
+    return [item async for item in stream]
+
+
+def test_streaming_preserves_order_and_exit_code():
+    """Lines arrive in order, partial lines are completed, exit code is last"""
+    shell_manager = ShellManager()
+    items = asyncio.run(_collect(shell_manager.execute_command_streaming(
+        "echo one; printf 'tw'; printf 'o\\n'; echo three; exit 3"
+    )))
+    assert items == [
+        ('stdout', 'one\n'),
+        ('stdout', 'two\n'),
+        ('stdout', 'three\n'),
+        ('exit', '3'),
+    ]
+
+
+def test_streaming_chunk_mode():
+    """Chunk mode yields raw data that adds up to the full output"""
+    shell_manager = ShellManager()
+    items = asyncio.run(_collect(shell_manager.execute_command_streaming(
+        "head -c 200000 /dev/zero | tr '\\0' x", line_mode=False, chunk_size=4096
+    )))
+    output = ''.join(content for stream_type, content in items if stream_type == 'stdout')
+    assert len(output) == 200000
+    assert all(len(content) <= 4096 for stream_type, content in items if stream_type == 'stdout')
+    assert items[-1] == ('exit', '0')
+
+
+def test_session_streaming_modes():
+    """The persistent session yields lines and bounded chunks like a separate process"""
+    shell_manager = ShellManager(persistent=True)
+    try:
+        if shell_manager.session is None:
+            return  # Detected shell does not support session mode
+        items = asyncio.run(_collect(shell_manager.execute_command_streaming(
+            "head -c 200000 /dev/zero | tr '\\0' x", line_mode=False, chunk_size=4096
+        )))
+        output = ''.join(content for stream_type, content in items if stream_type == 'stdout')
+        assert len(output) == 200000
+        assert all(len(content) <= 4096 for stream_type, content in items if stream_type == 'stdout')
+        assert items[-1] == ('exit', '0')
+        
+        items = asyncio.run(_collect(shell_manager.execute_command_streaming(
+            "echo one; printf 'tw'; sleep 0.1; printf 'o\\nthr'; exit 3"
+        )))
+        assert items == [
+            ('stdout', 'one\n'),
+            ('stdout', 'two\n'),
+            ('stdout', 'thr'),
+            ('exit', '3'),
+        ]
+    finally:
+        shell_manager.close()
+
+
+def test_streaming_cancellation_kills_command():
+    """Stopping the consumer early kills the running command"""
+    shell_manager = ShellManager()
+    
+    async def run():
+        stream = shell_manager.execute_command_streaming("echo started; sleep 30")
+        async for stream_type, content in stream:
+            assert content == 'started\n'
+            break
+        await stream.aclose()
+    
+    asyncio.run(asyncio.wait_for(run(), timeout=5))
+
+
+def test_stream_command_output_consumer():
+    """AsyncStreamingResponse consumes the engine's output unchanged"""
+    shell_manager = ShellManager()
+    response = AsyncStreamingResponse()
+    exit_code = asyncio.run(response.stream_command_output(
+        shell_manager.execute_command_streaming("echo hi; exit 2")
+    ))
+    assert exit_code == 2
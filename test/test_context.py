@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""Tests for the filesystem context and its directory cache"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, 'src')
+
+from nlsh.context import ContextManager
+
+
+def _age(path: str, seconds: float = 60):
+    # Past the window in which a directory's mtime cannot be trusted yet
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_unchanged_directories_are_not_rescanned():
+    """Only a directory whose entries changed is listed again"""
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ('a', 'b'):
+            os.mkdir(os.path.join(tmp, name))
+            with open(os.path.join(tmp, name, 'file.txt'), 'w') as f:
+                f.write(name)
+            _age(os.path.join(tmp, name))
+        _age(tmp)
+        context_manager = ContextManager()
+        
+        first = context_manager._get_filesystem_context(tmp)
+        assert [f.name for f in first['.']] == ['a', 'b']
+        assert (context_manager.scan_stats.hits, context_manager.scan_stats.misses) == (0, 3)
+        
+        assert context_manager._get_filesystem_context(tmp) == first
+        assert (context_manager.scan_stats.hits, context_manager.scan_stats.misses) == (3, 3)
+        
+        with open(os.path.join(tmp, 'b', 'new.txt'), 'w') as f:
+            f.write('new')
+        third = context_manager._get_filesystem_context(tmp)
+        assert [f.name for f in third['./b']] == ['file.txt', 'new.txt']
+        assert (context_manager.scan_stats.hits, context_manager.scan_stats.misses) == (5, 4)
+        assert context_manager.scan_stats.last_scan_ms > 0
+
+
+def test_scan_cache_is_bounded():
+    with tempfile.TemporaryDirectory() as tmp:
+        context_manager = ContextManager(scan_cache_dirs=2)
+        for name in ('a', 'b', 'c'):
+            os.mkdir(os.path.join(tmp, name))
+            _age(os.path.join(tmp, name))
+            context_manager._scan_directory(os.path.join(tmp, name))
+        
+        assert list(context_manager._scan_cache) == [os.path.join(tmp, 'b'), os.path.join(tmp, 'c')]
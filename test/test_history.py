@@ -0,0 +1,539 @@
+#!/usr/bin/env python3
+"""Tests for the SQLite history store"""
+
+import csv
+import glob
+import gzip
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, 'src')
+
+from nlsh import capture, history
+from nlsh.history import HistoryManager
+from nlsh.history_retention import RetentionPolicy
+from nlsh.history_schema import SCHEMA_VERSION
+from nlsh.shell import CommandResult
+
+
+def test_shared_connection_uses_wal():
+    """The history database is opened once in WAL mode"""
+    with tempfile.TemporaryDirectory() as tmp:
+        history_manager = HistoryManager(db_path=os.path.join(tmp, 'history.db'))
+        with history_manager._connection() as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+        history_manager.close()
+
+
+def test_logging_from_several_threads():
+    """Background jobs may log concurrently through the shared connection"""
+    with tempfile.TemporaryDirectory() as tmp:
+        history_manager = HistoryManager(db_path=os.path.join(tmp, 'history.db'))
+        
+        def log_many(worker):
+            for i in range(50):
+                history_manager.log_tool_call('tool', {'worker': worker, 'i': i}, 'ok')
+        
+        threads = [threading.Thread(target=log_many, args=(w,)) for w in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert history_manager.get_command_stats()['by_type'] == {'tool_call': 200}
+        history_manager.close()
+
+
+def test_queued_entries_are_visible_before_flush():
+    """Session history includes entries the writer has not stored yet"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'history.db')
+        history_manager = HistoryManager(db_path=db_path, flush_interval=60)
+        history_manager.log_tool_call('first', {}, 'one')
+        history_manager.log_tool_call('second', {}, 'two')
+        
+        entries = history_manager.get_session_history()
+        assert [e['data']['tool_name'] for e in entries] == ['first', 'second']
+        
+        # Nothing has reached the database yet
+        other = HistoryManager(db_path=db_path, write_behind=False)
+        assert other.get_session_history(history_manager.session_id) == []
+        
+        history_manager.close()
+        stored = other.get_session_history(history_manager.session_id)
+        assert [e['data']['tool_name'] for e in stored] == ['first', 'second']
+        other.close()
+
+
+def test_queue_is_flushed_on_sigterm():
+    """Entries queued when nlsh is terminated are still written"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'history.db')
+        script = (
+            "import os, signal, sys; sys.path.insert(0, 'src')\n"
+            "from nlsh.history import HistoryManager\n"
+            f"h = HistoryManager(db_path={db_path!r}, flush_interval=60)\n"
+            "h.log_tool_call('tool', {}, 'queued')\n"
+            "os.kill(os.getpid(), signal.SIGTERM)\n"
+        )
+        proc = subprocess.run([sys.executable, '-c', script])
+        assert proc.returncode == -signal.SIGTERM
+        
+        history_manager = HistoryManager(db_path=db_path, write_behind=False)
+        assert history_manager.get_command_stats()['by_type'] == {'tool_call': 1}
+        history_manager.close()
+
+
+def test_full_text_search_ranks_and_highlights():
+    """Search matches words, phrases and prefixes, best match first"""
+    with tempfile.TemporaryDirectory() as tmp:
+        history_manager = HistoryManager(db_path=os.path.join(tmp, 'history.db'))
+        history_manager.log_llm_interaction('find large log files', 'Use du', ['du -sh /var/log'])
+        history_manager.log_tool_call('execute_shell_command', {'command': 'ls'}, 'large.txt')
+        history_manager.log_llm_interaction('show disk usage', 'Here', ['df -h'])
+        
+        results = history_manager.search_history('large')
+        assert [e['entry_type'] for e in results] == ['llm_interaction', 'tool_call']
+        assert '\x01large\x02' in results[0]['snippet']
+        
+        phrase = history_manager.search_history('"large log"')
+        assert [e['data']['user_prompt'] for e in phrase] == ['find large log files']
+        
+        assert len(history_manager.search_history('dis*')) == 1
+        # Not valid FTS5 syntax, searched as plain words instead
+        assert len(history_manager.search_history('du -sh')) == 1
+        assert history_manager.search_history('large', entry_type='tool_call')[0]['id'] == 2
+        history_manager.close()
+
+
+def test_legacy_database_is_migrated():
+    """A version 1 database gains typed, queryable columns"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'history.db')
+        conn = sqlite3.connect(db_path)
+        conn.execute("""
+            CREATE TABLE history_entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL,
+                session_id TEXT NOT NULL, entry_type TEXT NOT NULL,
+                cwd TEXT NOT NULL, data TEXT NOT NULL
+            )
+        """)
+        conn.executemany(
+            "INSERT INTO history_entries (timestamp, session_id, entry_type, cwd, data) "
+            "VALUES (?, 'old', 'shell_command', '/', ?)",
+            [('2024-05-01T12:00:00', json.dumps({'command': f'make {i}', 'return_code': i % 2}))
+             for i in range(1200)]
+        )
+        conn.execute(
+            "INSERT INTO history_entries (timestamp, session_id, entry_type, cwd, data) "
+            "VALUES ('2024-05-01T12:00:00', 'old', 'llm_interaction', '/', ?)",
+            (json.dumps({'user_prompt': 'build the release binaries', 'executed_commands': ['make release'],
+                         'execution_results': [{'return_code': 0}]}),)
+        )
+        conn.commit()
+        conn.close()
+        
+        history_manager = HistoryManager(db_path=db_path)
+        history_manager._migrator.join()
+        with history_manager._connection() as conn:
+            assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        
+        failed = history_manager.find_entries(failed=True, limit=1000)
+        assert len(failed) == 600
+        assert failed[0]['command'] == 'make 1199'
+        assert failed[0]['ts_epoch'] == int(datetime(2024, 5, 1, 12).timestamp() * 1000)
+        assert len(history_manager.find_entries(command_prefix='make 11', limit=1000)) == 111
+        # Indexed in the background rather than by the migration
+        assert [e['command'] for e in history_manager.search_history('1199')] == ['make 1199']
+        with history_manager._connection() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM history_fts").fetchone()[0] == 1201
+            assert conn.execute("SELECT COUNT(*) FROM history_backfills").fetchone()[0] == 0
+        shell_commands = history_manager.get_command_stats()['shell_commands']
+        assert (shell_commands['runs'], shell_commands['failures']) == (1200, 600)
+        assert history_manager.recall("build release binaries", cwd='/')[0].commands == ['make release']
+        history_manager.close()
+
+
+def test_large_payloads_are_deduplicated_and_compressed():
+    """Repeated output is stored once, compressed, and read back intact"""
+    with tempfile.TemporaryDirectory() as tmp:
+        history_manager = HistoryManager(db_path=os.path.join(tmp, 'history.db'))
+        listing = '\n'.join(f'-rw-r--r-- 1 user staff {i} file{i}.txt' for i in range(200))
+        for _ in range(5):
+            history_manager.log_tool_call('execute_shell_command', {'command': 'ls -l'}, listing)
+        history_manager.log_tool_call('execute_shell_command', {'command': 'true'}, 'short')
+        
+        entries = history_manager.get_session_history()
+        assert [e['data']['tool_result'] for e in entries] == [listing] * 5 + ['short']
+        assert history_manager.search_history('file199.txt')[0]['data']['tool_result'] == listing
+        with history_manager._connection() as conn:
+            stored = conn.execute("SELECT data FROM history_entries WHERE id = 1").fetchone()[0]
+            assert listing not in stored
+        
+        blob_store = history_manager.get_command_stats()['blob_store']
+        assert blob_store['blobs'] == 1 and blob_store['references'] == 5
+        assert blob_store['logged_bytes'] == 5 * len(listing)
+        assert blob_store['stored_bytes'] < len(listing) / 2
+        
+        # Blobs go once the last entry using them is removed
+        with history_manager._connection() as conn:
+            conn.execute("UPDATE history_entries SET ts_epoch = 0")
+        history_manager.cleanup_old_entries(30)
+        assert history_manager.get_command_stats()['blob_store']['blobs'] == 0
+        history_manager.close()
+
+
+def test_iterate_and_export_in_batches():
+    """Entries are paged by id and exported as (gzipped) NDJSON"""
+    with tempfile.TemporaryDirectory() as tmp:
+        history_manager = HistoryManager(db_path=os.path.join(tmp, 'history.db'))
+        for i in range(25):
+            history_manager.log_tool_call('tool', {'i': i}, 'ok')
+        history_manager.log_llm_interaction('prompt')
+        
+        ids = [e['id'] for e in history_manager.iter_entries(entry_type='tool_call', batch_size=4)]
+        assert ids == list(range(1, 26))
+        newest = history_manager.iter_entries(newest_first=True, batch_size=4)
+        assert next(newest)['entry_type'] == 'llm_interaction'
+        assert list(history_manager.iter_entries(since=datetime(2999, 1, 1))) == []
+        
+        path = os.path.join(tmp, 'history.ndjson.gz')
+        assert history_manager.export_history(path, entry_type='tool_call') == 25
+        with gzip.open(path, 'rt') as f:
+            lines = [json.loads(line) for line in f]
+        assert [line['data']['tool_args']['i'] for line in lines] == list(range(25))
+        history_manager.close()
+
+
+def test_recent_session_entries_window():
+    """Recent entries come from memory, or from the index past the window"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'history.db')
+        history_manager = HistoryManager(db_path=db_path, session_window=5, flush_interval=60)
+        for i in range(8):
+            history_manager.log_tool_call('tool', {'i': i}, 'ok')
+        
+        recent = history_manager.get_recent_session_entries(3)
+        assert [e['data']['tool_args']['i'] for e in recent] == [5, 6, 7]
+        assert all(e['id'] is None for e in recent)  # Still queued
+        
+        # More than the window holds: read back from the database
+        history_manager.flush()
+        history_manager.log_tool_call('tool', {'i': 8}, 'ok')
+        recent = history_manager.get_recent_session_entries(7)
+        assert [e['data']['tool_args']['i'] for e in recent] == [2, 3, 4, 5, 6, 7, 8]
+        assert recent[0]['id'] == 3 and recent[-1]['id'] is None
+        history_manager.close()
+        
+        other = HistoryManager(db_path=db_path)
+        stored = other.get_recent_session_entries(2, history_manager.session_id)
+        assert [e['data']['tool_args']['i'] for e in stored] == [7, 8]
+        other.close()
+
+
+def test_rollups_match_a_rebuild():
+    """Stats kept up as entries are written equal a recount from the rows"""
+    with tempfile.TemporaryDirectory() as tmp:
+        history_manager = HistoryManager(db_path=os.path.join(tmp, 'history.db'))
+        for i in range(6):
+            result = CommandResult(command='make', output='', error='', return_code=i % 3,
+                                   cwd='/', wall_time_ms=100 * i)
+            history_manager.log_shell_command('make' if i < 4 else 'ls', result)
+        history_manager.log_llm_interaction('prompt', llm_model='gpt-4')
+        
+        stats = history_manager.get_command_stats()
+        assert stats['total_entries'] == 7
+        assert stats['shell_commands'] == {'runs': 6, 'failures': 4, 'failure_rate': 4 / 6,
+                                           'mean_time_ms': 250}
+        assert stats['top_failing_commands'][0] == {
+            'command': 'make', 'runs': 4, 'failures': 2, 'failure_rate': 0.5, 'mean_time_ms': 150}
+        assert stats['by_model'] == {'gpt-4': 1}
+        
+        history_manager.rebuild_rollups()
+        assert history_manager.get_command_stats() == stats
+        
+        # Entries removed by retention leave the rollups too
+        with history_manager._connection() as conn:
+            conn.execute("UPDATE history_entries SET ts_epoch = 0 WHERE command = 'ls'")
+        history_manager.rebuild_rollups()
+        history_manager.cleanup_old_entries(30)
+        stats = history_manager.get_command_stats()
+        assert stats['shell_commands']['runs'] == 4
+        assert [c['command'] for c in stats['top_commands']] == ['make']
+        history_manager.close()
+
+
+def test_retention_policy():
+    """Old entries are deleted, older output dropped, and size keeps the newest"""
+    with tempfile.TemporaryDirectory() as tmp:
+        history_manager = HistoryManager(db_path=os.path.join(tmp, 'history.db'))
+        for i in range(300):
+            result = CommandResult(command=f'cat file{i}', output=os.urandom(1500).hex(), error='',
+                                   return_code=0, cwd='/', wall_time_ms=1)
+            history_manager.log_shell_command(f'cat file{i}', result)
+        day_ms = 24 * 3600 * 1000
+        with history_manager._connection() as conn:
+            conn.execute("UPDATE history_entries SET ts_epoch = ts_epoch - ? WHERE id <= 100",
+                         (100 * day_ms,))
+            conn.execute("UPDATE history_entries SET ts_epoch = ts_epoch - ? WHERE id <= 20",
+                         (400 * day_ms,))
+        
+        report = history_manager.prune(RetentionPolicy(max_age_days=365, payload_max_age_days=30))
+        assert report.deleted_entries == 20
+        assert report.dropped_payloads == 80
+        assert report.deleted_blobs == 100
+        entries = history_manager.find_entries(limit=1000)
+        assert len(entries) == 280
+        assert entries[-1]['command'] == 'cat file20'
+        assert entries[-1]['data']['output'] == '' and entries[-1]['data']['payload_dropped']
+        assert len(entries[0]['data']['output']) == 3000
+        # Commands stay searchable once their output is gone
+        assert [e['command'] for e in history_manager.search_history('file20')] == ['cat file20']
+        assert history_manager.get_command_stats()['total_entries'] == 280
+        
+        report = history_manager.prune(RetentionPolicy(max_age_days=None, payload_max_age_days=None,
+                                                       max_db_bytes=300 * 1024))
+        entries = history_manager.find_entries(limit=1000)
+        assert 0 < len(entries) < 280
+        assert entries[0]['command'] == 'cat file299'
+        assert report.deleted_entries == 280 - len(entries)
+        history_manager.close()
+
+
+def test_no_retention_by_default(monkeypatch):
+    """Without NLSH_HISTORY_* settings nothing is ever deleted or dropped"""
+    for name in ('NLSH_HISTORY_MAX_AGE_DAYS', 'NLSH_HISTORY_PAYLOAD_DAYS', 'NLSH_HISTORY_MAX_MB'):
+        monkeypatch.delenv(name, raising=False)
+    with tempfile.TemporaryDirectory() as tmp:
+        monkeypatch.setattr(capture, 'DEFAULT_SPILL_DIR', Path(tmp) / 'spill')
+        spill_file = _old_spill_file(tmp)
+        history_manager = HistoryManager(db_path=os.path.join(tmp, 'history.db'), write_behind=False,
+                                         retention=RetentionPolicy.from_env())
+        assert history_manager.retention is None
+        for i in range(5):
+            result = CommandResult(command=f'cat file{i}', output='x' * 5000, error='',
+                                   return_code=0, cwd='/', wall_time_ms=1)
+            history_manager.log_shell_command(f'cat file{i}', result)
+        with history_manager._connection() as conn:
+            conn.execute("UPDATE history_entries SET ts_epoch = ts_epoch - ?", (5000 * 24 * 3600 * 1000,))
+        
+        report = history_manager.prune()
+        assert (report.deleted_entries, report.dropped_payloads, report.deleted_spill_files) == (0, 0, 0)
+        entries = history_manager.find_entries(limit=10)
+        assert len(entries) == 5
+        assert all(len(entry['data']['output']) == 5000 for entry in entries)
+        assert os.path.exists(spill_file)
+        history_manager.close()
+
+
+def _old_spill_file(tmp: str, days: int = 100) -> str:
+    os.makedirs(os.path.join(tmp, 'spill'), exist_ok=True)
+    path = os.path.join(tmp, 'spill', f'output-old-{days}.log')
+    with open(path, 'w') as f:
+        f.write('full output')
+    then = time.time() - days * 24 * 3600
+    os.utime(path, (then, then))
+    return path
+
+
+def test_retention_removes_old_spill_files(monkeypatch):
+    """Both cleanup_old_entries and the background retention delete old spill files"""
+    with tempfile.TemporaryDirectory() as tmp:
+        monkeypatch.setattr(capture, 'DEFAULT_SPILL_DIR', Path(tmp) / 'spill')
+        history_manager = HistoryManager(db_path=os.path.join(tmp, 'history.db'), write_behind=False,
+                                         retention=RetentionPolicy(max_age_days=30))
+        old, recent = _old_spill_file(tmp, 100), _old_spill_file(tmp, 1)
+        history_manager.cleanup_old_entries(30)
+        assert not os.path.exists(old) and os.path.exists(recent)
+        
+        old = _old_spill_file(tmp, 100)
+        while True:
+            history_manager._retention_tick()
+            if history_manager._retention_run is None:
+                break
+        assert not os.path.exists(old) and os.path.exists(recent)
+        history_manager.close()
+
+
+def test_concurrent_sessions_lose_nothing():
+    """Several nlsh processes writing at once all get their entries stored"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'history.db')
+        script = (
+            "import sys; sys.path.insert(0, 'src')\n"
+            "from nlsh.history import HistoryManager\n"
+            f"h = HistoryManager(db_path={db_path!r}, flush_batch_size=5)\n"
+            "for i in range(100):\n"
+            "    h.log_tool_call('tool', {'i': i}, sys.argv[1] * 2000)\n"
+            "h.close()\n"
+        )
+        procs = [subprocess.Popen([sys.executable, '-c', script, str(n)]) for n in range(6)]
+        assert all(proc.wait() == 0 for proc in procs)
+        
+        history_manager = HistoryManager(db_path=db_path, write_behind=False)
+        assert history_manager.get_command_stats()['by_type'] == {'tool_call': 600}
+        history_manager.close()
+
+
+def test_entries_are_set_aside_while_locked(monkeypatch):
+    """Entries that cannot be written at exit are added by the next session"""
+    monkeypatch.setattr(history, 'WRITE_RETRIES', 0)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'history.db')
+        history_manager = HistoryManager(db_path=db_path, flush_interval=60)
+        history_manager.log_tool_call('tool', {}, 'queued')
+        history_manager._conn.execute("PRAGMA busy_timeout=10")
+        
+        other = sqlite3.connect(db_path)
+        other.execute("BEGIN IMMEDIATE")
+        history_manager.close()
+        other.rollback()
+        other.close()
+        assert len(glob.glob(os.path.join(tmp, 'history.db.pending-*.jsonl'))) == 1
+        
+        history_manager = HistoryManager(db_path=db_path, write_behind=False)
+        entries = history_manager.find_entries()
+        assert [e['data']['tool_result'] for e in entries] == ['queued']
+        assert glob.glob(os.path.join(tmp, 'history.db.pending-*')) == []
+        history_manager.close()
+
+
+def test_import_shell_history():
+    """bash, zsh and fish history are imported once, with their own times"""
+    with tempfile.TemporaryDirectory() as tmp:
+        files = {
+            'bash_history': b"#1700000000\nls -la\n#1700000060\nfor f in *; do\n  echo $f\ndone\n",
+            'plain_history': b"make\nmake test\nmake\n",
+            # Extended format; a trailing backslash continues the command, and
+            # zsh "metafies" bytes from 0x83 up (here the \xc3\xa9 of an e-acute)
+            'zsh_history': b": 1700000100:0;echo caf\xc3\x83\x89\n: 1700000200:3;git commit \\\n-m wip\n",
+            'fish_history': b"- cmd: echo a\\\\b\\nc\n  when: 1700000300\n  paths:\n    - b\n",
+        }
+        for name, content in files.items():
+            with open(os.path.join(tmp, name), 'wb') as f:
+                f.write(content)
+        history_manager = HistoryManager(db_path=os.path.join(tmp, 'history.db'), write_behind=False)
+        
+        report = history_manager.import_shell_history(os.path.join(tmp, 'bash_history'))
+        assert (report.format, report.commands, report.imported) == ('bash', 2, 2)
+        report = history_manager.import_shell_history(os.path.join(tmp, 'plain_history'))
+        assert (report.commands, report.imported) == (3, 3)
+        report = history_manager.import_shell_history(os.path.join(tmp, 'zsh_history'))
+        assert (report.format, report.imported) == ('zsh', 2)
+        report = history_manager.import_shell_history(os.path.join(tmp, 'fish_history'))
+        assert (report.format, report.imported) == ('fish', 1)
+        
+        commands = {e['command']: e for e in history_manager.find_entries(entry_type='shell_command')}
+        assert set(commands) == {'ls -la', 'for f in *; do\n  echo $f\ndone', 'make', 'make test',
+                                 'echo café', 'git commit \n-m wip', 'echo a\\b\nc'}
+        assert commands['ls -la']['ts_epoch'] == 1700000000 * 1000
+        assert commands['ls -la']['session_id'] == 'import_bash'
+        assert commands['echo a\\b\nc']['timestamp'] == datetime.fromtimestamp(1700000300).isoformat()
+        assert history_manager.get_command_stats()['by_type'] == {'shell_command': 8}
+        
+        # Nothing is added twice, including untimestamped commands
+        with open(os.path.join(tmp, 'plain_history'), 'ab') as f:
+            f.write(b"git status\n")
+        for name in files:
+            report = history_manager.import_shell_history(os.path.join(tmp, name))
+            assert report.duplicates == report.commands - (name == 'plain_history')
+        assert history_manager.get_command_stats()['total_entries'] == 9
+        assert [e['command'] for e in history_manager.search_history('status')] == ['git status']
+        history_manager.close()
+
+
+def test_import_keeps_old_commands_without_retention(monkeypatch):
+    """`nlsh history import` only leaves out old commands when an age limit is set"""
+    from typer.testing import CliRunner
+    from nlsh.cli import app
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        monkeypatch.setenv('HOME', tmp)
+        monkeypatch.delenv('NLSH_HISTORY_MAX_AGE_DAYS', raising=False)
+        path = os.path.join(tmp, 'old_history')
+        with open(path, 'w') as f:
+            f.write(': 1000000000:0;ls /old\n: %d:0;ls /new\n' % int(time.time()))
+        
+        result = CliRunner().invoke(app, ['history', 'import', path, '-f', 'zsh'])
+        assert result.exit_code == 0, result.output
+        assert 'Imported 2 of 2' in result.output
+        
+        monkeypatch.setenv('NLSH_HISTORY_MAX_AGE_DAYS', '365')
+        os.remove(os.path.join(tmp, '.nlsh', 'history.db'))
+        result = CliRunner().invoke(app, ['history', 'import', path, '-f', 'zsh'])
+        assert 'Imported 1 of 2' in result.output
+
+
+def test_analytics_export_is_partitioned_and_incremental():
+    """Typed fields are flattened into date partitions; a second export adds only new rows"""
+    with tempfile.TemporaryDirectory() as tmp:
+        history_manager = HistoryManager(db_path=os.path.join(tmp, 'history.db'), write_behind=False)
+        history_manager.log_shell_command('make', CommandResult(
+            command='make', output='x' * 5000, error='', return_code=2, cwd='/src', wall_time_ms=40))
+        history_manager.log_llm_interaction('build it', generated_commands=['make'],
+                                            llm_model='test-model', llm_time_ms=900)
+        output_dir = os.path.join(tmp, 'analytics')
+        
+        report = history_manager.export_analytics(output_dir, format='csv')
+        assert (report.rows, report.files, report.last_id) == (2, 1, 2)
+        day = datetime.now().date().isoformat()
+        with gzip.open(os.path.join(output_dir, f'date={day}', 'part-000000000001.csv.gz'), 'rt') as f:
+            rows = list(csv.DictReader(f))
+        assert [(r['entry_type'], r['command'], r['return_code'], r['execution_time_ms']) for r in rows] == [
+            ('shell_command', 'make', '2', '40'), ('llm_interaction', '', '', '')]
+        assert (rows[1]['llm_model'], rows[1]['llm_time_ms'], rows[1]['generated_commands']) == (
+            'test-model', '900', '1')
+        
+        history_manager.log_shell_command('ls', CommandResult(
+            command='ls', output='', error='', return_code=0, cwd='/'))
+        report = history_manager.export_analytics(output_dir)
+        assert (report.format, report.since_id, report.rows, report.last_id) == ('csv', 2, 1, 3)
+        assert history_manager.export_analytics(output_dir).rows == 0
+        assert len(glob.glob(os.path.join(output_dir, '*', '*'))) == 2
+        history_manager.close()
+
+
+def test_recall_commands_of_similar_prompts():
+    """Paraphrased requests recall commands that succeeded; other arguments or failures do not"""
+    with tempfile.TemporaryDirectory() as tmp:
+        history_manager = HistoryManager(db_path=os.path.join(tmp, 'history.db'), write_behind=False)
+        
+        def log(prompt, command, return_code=0):
+            result = CommandResult(command=command, output='', error='', return_code=return_code, cwd=tmp)
+            history_manager.log_llm_interaction(prompt, executed_commands=[command],
+                                                execution_results=[result])
+        
+        log("find all python files larger than 1MB", "find . -name '*.py' -size +1M")
+        log("switch to the develop branch", "git checkout develop")
+        log("show disk usage of this directory", "du -sh .")
+        log("compress the logs directory", "tar czf logs.tgz logs", return_code=2)
+        cwd = os.getcwd()
+        
+        matches = history_manager.recall("which python files are larger than 1MB", cwd=cwd)
+        assert [m.commands for m in matches] == [["find . -name '*.py' -size +1M"]]
+        assert 0.6 <= matches[0].score <= 1
+        assert history_manager.recall("switch to develop branch", cwd=cwd)[0].commands == ["git checkout develop"]
+        # Another file type, branch or size asks for something else
+        assert history_manager.recall("find all rust files larger than 1MB", cwd=cwd) == []
+        assert history_manager.recall("find all python files larger than 5MB", cwd=cwd) == []
+        assert history_manager.recall("switch to the main branch", cwd=cwd) == []
+        assert history_manager.recall("compress the logs directory", cwd=cwd) == []
+        assert history_manager.recall("what's the weather tomorrow", cwd=cwd) == []
+        
+        # Deleted entries leave the index
+        with history_manager._connection() as conn:
+            conn.execute("DELETE FROM history_entries WHERE entry_type = 'llm_interaction'")
+            conn.commit()
+            assert conn.execute("SELECT COUNT(*) FROM recall_terms").fetchone()[0] == 0
+        assert history_manager.recall("show disk usage of this directory", cwd=cwd) == []
+        history_manager.close()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Tests for background job control"""
+
+import os
+import signal
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, 'src')
+
+from nlsh.jobs import JobManager, RingBuffer
+from nlsh.shell import ShellManager
+from nlsh.history import HistoryManager
+
+
+def test_job_runs_in_background_and_is_logged():
+    """start() returns at once and the finished job is logged"""
+    with tempfile.TemporaryDirectory() as tmp:
+        history_manager = HistoryManager(db_path=os.path.join(tmp, 'history.db'))
+        job_manager = JobManager(
+            ShellManager(),
+            on_finish=lambda job: history_manager.log_shell_command(job.command, job.result)
+        )
+        
+        started = time.monotonic()
+        job = job_manager.start("sleep 0.3; echo built")
+        assert time.monotonic() - started < 0.2
+        assert job.status == 'running'
+        assert [j.id for j in job_manager.jobs()] == [job.id]
+        
+        assert job.finished.wait(5)
+        assert job.status == 'done'
+        assert job.result.output == "built\n"
+        assert job_manager.pop_finished() == [job]
+        assert job_manager.jobs() == []
+        
+        data = history_manager.get_recent_commands(1)[0]['data']
+        assert data['command'] == "sleep 0.3; echo built"
+        assert data['output'] == "built\n"
+
+
+def test_kill_and_foreground():
+    """kill signals the job; fg replays buffered output then waits"""
+    job_manager = JobManager(ShellManager())
+    
+    sleeper = job_manager.start("sleep 30")
+    job_manager.kill(job_manager.get(f"%{sleeper.id}"))
+    assert sleeper.finished.wait(5)
+    assert sleeper.status == signal.SIGTERM.name
+    
+    talker = job_manager.start("echo early; sleep 0.3; echo late")
+    time.sleep(0.1)
+    seen = []
+    result = job_manager.wait(talker, lambda stream_type, text: seen.append(text))
+    assert result.return_code == 0
+    assert ''.join(seen) == "early\nlate\n"
+
+
+def test_ring_buffer_keeps_recent_output():
+    """The ring buffer drops the oldest bytes and partial first line"""
+    buffer = RingBuffer(capacity=16)
+    for i in range(10):
+        buffer.write(f"line {i}\n".encode())
+    assert buffer.total == 70
+    assert buffer.text() == "line 8\nline 9\n"
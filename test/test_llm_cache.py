@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Tests for the persistent LLM response cache"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, 'src')
+
+from nlsh.context import ContextInfo
+from nlsh.llm_cache import ResponseCache, is_cacheable
+
+
+def _context(cwd: str) -> ContextInfo:
+    return ContextInfo(cwd=cwd, shell_info={'name': 'bash'}, filesystem={}, environment={},
+                       system_info={}, session_history=[{'command': 'anything'}])
+
+
+def test_key_follows_prompt_mode_model_and_directory():
+    """Whitespace and session history do not matter; the directory's contents do"""
+    with tempfile.TemporaryDirectory() as tmp:
+        context = _context(tmp)
+        key = ResponseCache.key("list  big files ", "command", "openai:gpt", context)
+        
+        assert ResponseCache.key("list big files", "command", "openai:gpt", _context(tmp)) == key
+        assert ResponseCache.key("list big files", "chat", "openai:gpt", context) != key
+        assert ResponseCache.key("list big files", "command", "anthropic:x", context) != key
+        
+        with open(os.path.join(tmp, 'new.txt'), 'w') as f:
+            f.write('x')
+        assert ResponseCache.key("list big files", "command", "openai:gpt", context) != key
+        
+        os.makedirs(os.path.join(tmp, '.git', 'refs', 'heads'))
+        with open(os.path.join(tmp, '.git', 'HEAD'), 'w') as f:
+            f.write('ref: refs/heads/main\n')
+        with open(os.path.join(tmp, '.git', 'refs', 'heads', 'main'), 'w') as f:
+            f.write('a' * 40)
+        in_repo = ResponseCache.key("list big files", "command", "openai:gpt", context)
+        with open(os.path.join(tmp, '.git', 'refs', 'heads', 'main'), 'w') as f:
+            f.write('b' * 40)
+        assert ResponseCache.key("list big files", "command", "openai:gpt", context) != in_repo
+
+
+def test_ttl_lru_and_counters():
+    """Expired entries miss, the least recently used go first, stats add up"""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ResponseCache(os.path.join(tmp, 'llm_cache.db'), ttl_s=3600, max_bytes=25)
+        cache.put('a', 'command', 'm', 'x' * 10)
+        cache.put('b', 'command', 'm', 'y' * 10)
+        assert cache.get('a') == 'x' * 10  # Now more recently used than b
+        cache.put('c', 'command', 'm', 'z' * 10)
+        
+        assert cache.get('b') is None
+        assert cache.get('a') == 'x' * 10
+        assert cache.get('c') == 'z' * 10
+        
+        cache.ttl_s = 1
+        cache._conn.execute("UPDATE responses SET created = ? WHERE key = 'a'", (time.time() - 2,))
+        assert cache.get('a') is None
+        
+        cache.skip()
+        stats = cache.stats()
+        assert (stats.hits, stats.misses, stats.stores, stats.skipped, stats.evictions) == (3, 2, 3, 1, 1)
+        assert (stats.entries, stats.size_bytes) == (1, 10)
+        cache.close()
+        
+        # Counters outlive the session
+        assert ResponseCache(os.path.join(tmp, 'llm_cache.db')).stats().hits == 3
+
+
+def test_only_read_only_tool_calls_are_cacheable():
+    assert is_cacheable([])
+    assert is_cacheable([{'name': 'list_files', 'args': {}}, {'name': 'git_status', 'args': {}}])
+    assert not is_cacheable([{'name': 'read_file', 'args': {}},
+                             {'name': 'execute_shell_command', 'args': {'command': 'ls'}}])
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Tests for the event-driven reader of subprocess pipes"""
+
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, 'src')
+
+from nlsh.shell import PipeMultiplexer
+
+
+def _spawn(command: str) -> subprocess.Popen:
+    return subprocess.Popen(['/bin/sh', '-c', command], stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def _read_all(command: str, read_size: int = 65536, timeout: float = 10):
+    proc = _spawn(command)
+    try:
+        with PipeMultiplexer({'stdout': proc.stdout, 'stderr': proc.stderr}, read_size) as mux:
+            return list(mux.read(timeout)), mux.timed_out
+    finally:
+        proc.kill()
+        proc.wait()
+        proc.stdout.close()
+        proc.stderr.close()
+
+
+def test_stdout_and_stderr_interleave_in_arrival_order():
+    chunks, timed_out = _read_all(
+        "echo out1; sleep 0.1; echo err1 >&2; sleep 0.1; echo out2; sleep 0.1; echo err2 >&2")
+    assert not timed_out
+    assert [chunk for chunk in chunks if chunk[1]] == [
+        ('stdout', b'out1\n'),
+        ('stderr', b'err1\n'),
+        ('stdout', b'out2\n'),
+        ('stderr', b'err2\n'),
+    ]
+    # One empty chunk per pipe marks its EOF
+    assert sorted(name for name, chunk in chunks if not chunk) == ['stderr', 'stdout']
+
+
+def test_eof_on_one_pipe_while_the_other_stays_open():
+    """A closed stderr is reported at once; stdout is still read to its end"""
+    chunks, timed_out = _read_all("exec 2>&-; sleep 0.2; echo late")
+    assert not timed_out
+    assert chunks == [('stderr', b''), ('stdout', b'late\n'), ('stdout', b'')]
+
+
+def test_timeout_stops_reading():
+    started = time.monotonic()
+    chunks, timed_out = _read_all("echo early; sleep 5", timeout=0.3)
+    assert timed_out
+    assert time.monotonic() - started < 2
+    assert chunks == [('stdout', b'early\n')]
+
+
+def test_output_larger_than_the_pipe_buffer():
+    """Neither pipe can fill up and stall the command while the other is read"""
+    chunks, timed_out = _read_all(
+        "head -c 300000 /dev/zero | tr '\\0' e >&2; head -c 300000 /dev/zero | tr '\\0' o",
+        read_size=4096)
+    assert not timed_out
+    assert all(len(chunk) <= 4096 for name, chunk in chunks)
+    for name, byte in (('stdout', b'o'), ('stderr', b'e')):
+        assert b''.join(chunk for chunk_name, chunk in chunks if chunk_name == name) == byte * 300000
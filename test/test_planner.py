@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Tests for the llm: mode execution planner"""
+
+import sys
+import time
+
+sys.path.insert(0, 'src')
+
+from nlsh.planner import plan_commands, is_independent
+from nlsh.shell import ShellManager
+
+
+def test_read_only_commands_are_independent():
+    """Queries can run side by side; writes and state changes cannot"""
+    assert is_independent("du -sh /var 2>/dev/null")
+    assert is_independent("find . -name '*.py' | wc -l")
+    assert is_independent("git status --short")
+    assert not is_independent("cd src")
+    assert not is_independent("export FOO=1")
+    assert not is_independent("ls > listing.txt")
+    assert not is_independent("find . -name '*.pyc' -delete")
+    assert not is_independent("git branch feature")
+    assert not is_independent("ls && rm -rf build")
+
+
+def test_substitutions_and_file_outputs_are_barriers():
+    """Commands hidden in substitutions, or output written to files, are side effects"""
+    assert not is_independent('echo "$(rm -rf /tmp/x)"')
+    assert not is_independent("cat `touch /tmp/pwn`")
+    assert not is_independent("diff <(ls a) <(ls b)")
+    assert not is_independent("ls >(tee out)")
+    assert not is_independent("find . -fprint0 out")
+    assert not is_independent("git diff --output=x")
+    assert not is_independent("git log --output x")
+    assert is_independent("git diff --stat")
+
+
+def test_date_and_hostname_only_display():
+    """Setting the clock or host name is a barrier; showing them is not"""
+    assert is_independent("date")
+    assert is_independent("date -u +%Y-%m-%dT%H:%M:%S")
+    assert is_independent("date --iso-8601=seconds")
+    assert is_independent("hostname -f")
+    assert not is_independent("date -s '2024-01-01 00:00'")
+    assert not is_independent("date --set=tomorrow")
+    assert not is_independent("date 010100002024")
+    assert not is_independent("hostname newname")
+    assert not is_independent("hostname -F /etc/hostname")
+
+
+def test_plan_keeps_barriers_in_order():
+    """Commands with side effects split the plan into ordered stages"""
+    stages = plan_commands(["du -sh a", "du -sh b", "cd src", "ls", "git log -3", "rm x"])
+    
+    assert [(stage.commands, stage.parallel) for stage in stages] == [
+        (["du -sh a", "du -sh b"], True),
+        (["cd src"], False),
+        (["ls", "git log -3"], True),
+        (["rm x"], False),
+    ]
+
+
+def test_concurrent_commands_overlap():
+    """Independent commands take about as long as the slowest one"""
+    shell_manager = ShellManager()
+    seen = []
+    started = time.monotonic()
+    results = shell_manager.execute_commands_concurrently(
+        ["sleep 0.5; echo one", "sleep 0.5; echo two", "sleep 0.5; exit 3"],
+        on_done=lambda index, result: seen.append(index)
+    )
+    
+    assert time.monotonic() - started < 1.4
+    assert [r.output for r in results] == ["one\n", "two\n", ""]
+    assert results[2].return_code == 3
+    assert sorted(seen) == [0, 1, 2]
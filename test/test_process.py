@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Tests for process-group timeouts and resource accounting"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, 'src')
+
+from nlsh.shell import ShellManager
+from nlsh.history import HistoryManager
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def test_timeout_kills_whole_process_group():
+    """A timeout also stops background children of the command"""
+    with tempfile.TemporaryDirectory() as tmp:
+        pid_file = os.path.join(tmp, 'child.pid')
+        shell_manager = ShellManager(timeout=0.5)
+        started = time.monotonic()
+        result = shell_manager.execute_command(f"sleep 30 & echo $! > {pid_file}; wait")
+        
+        assert time.monotonic() - started < 5
+        assert result.return_code == -1
+        assert "timed out" in result.error
+        
+        with open(pid_file) as f:
+            child = int(f.read())
+        for _ in range(50):
+            if not _alive(child):
+                break
+            time.sleep(0.05)
+        assert not _alive(child)
+
+
+def test_resource_usage_is_recorded():
+    """Wall time, CPU time and peak memory are measured with wait4"""
+    shell_manager = ShellManager()
+    result = shell_manager.execute_command("i=0; while [ $i -lt 20000 ]; do i=$((i+1)); done")
+    
+    assert result.return_code == 0
+    assert result.wall_time_ms is not None
+    assert result.user_time_ms + result.sys_time_ms > 0
+    assert result.max_rss_kb > 0
+    assert result.to_dict()['max_rss_kb'] == result.max_rss_kb
+
+
+def test_resource_usage_is_stored_in_history():
+    """Logged shell commands keep their timings"""
+    with tempfile.TemporaryDirectory() as tmp:
+        history_manager = HistoryManager(db_path=os.path.join(tmp, 'history.db'))
+        result = ShellManager().execute_command("echo hi")
+        history_manager.log_shell_command("echo hi", result)
+        
+        data = history_manager.get_recent_commands(1)[0]['data']
+        assert data['execution_time_ms'] == result.wall_time_ms
+        assert data['max_rss_kb'] == result.max_rss_kb
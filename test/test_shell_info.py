@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""Tests for cached shell introspection"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, 'src')
+
+from nlsh.shell import ShellManager, ShellInfoCache
+
+
+def _fake_shell(directory: str, version: str) -> str:
+    """Write a shell stand-in that prints a version and counts its runs"""
+    path = os.path.join(directory, 'fakesh')
+    with open(path, 'w') as f:
+        f.write(f"#!/bin/sh\necho run >> {directory}/runs\necho '{version}'\n")
+    os.chmod(path, 0o755)
+    return path
+
+
+def _runs(directory: str) -> int:
+    try:
+        with open(os.path.join(directory, 'runs')) as f:
+            return len(f.readlines())
+    except FileNotFoundError:
+        return 0
+
+
+def test_shell_version_is_cached_across_managers(monkeypatch):
+    """The shell is only asked for its version once per binary"""
+    with tempfile.TemporaryDirectory() as tmp:
+        monkeypatch.setenv('SHELL', _fake_shell(tmp, 'fakesh 1.0'))
+        cache_path = os.path.join(tmp, 'shell_cache.json')
+        
+        first = ShellManager(shell_cache=ShellInfoCache(cache_path))
+        assert first.get_shell_info()['version'] == 'fakesh 1.0'
+        assert first.get_shell_info()['version'] == 'fakesh 1.0'
+        
+        # A new process would start with an empty in-memory cache
+        second = ShellManager(shell_cache=ShellInfoCache(cache_path))
+        assert second.get_shell_info()['version'] == 'fakesh 1.0'
+        assert _runs(tmp) == 1
+
+
+def test_shell_version_refreshes_when_binary_changes(monkeypatch):
+    """Replacing the shell binary invalidates its cached version"""
+    with tempfile.TemporaryDirectory() as tmp:
+        shell_path = _fake_shell(tmp, 'fakesh 1.0')
+        monkeypatch.setenv('SHELL', shell_path)
+        shell_manager = ShellManager(shell_cache=ShellInfoCache(os.path.join(tmp, 'cache.json')))
+        assert shell_manager.get_shell_info()['version'] == 'fakesh 1.0'
+        
+        # Rewrite the binary in place and make sure its mtime moves on
+        stat = os.stat(shell_path)
+        _fake_shell(tmp, 'fakesh 2.0')
+        os.utime(shell_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        
+        assert shell_manager.get_shell_info()['version'] == 'fakesh 2.0'
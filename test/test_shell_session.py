@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Tests for the persistent shell session"""
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, 'src')
+
+from nlsh.capture import OutputCapture
+from nlsh.shell import ShellManager, ShellSession
+
+
+def test_session_keeps_state():
+    """cd and export persist between commands in a session"""
+    original_cwd = os.getcwd()
+    session = ShellSession('/bin/sh')
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = os.path.realpath(tmp)
+            result = session.run(f"cd {tmp} && export NLSH_TEST_VAR=hello")
+            assert result.return_code == 0
+            
+            result = session.run("pwd; echo $NLSH_TEST_VAR; echo oops >&2; false")
+            assert result.output == f"{tmp}\nhello\n"
+            assert result.error == "oops\n"
+            assert result.return_code == 1
+            assert session.cwd == tmp
+            os.chdir(original_cwd)
+    finally:
+        os.chdir(original_cwd)
+        session.close()
+
+
+def test_session_output_without_trailing_newline():
+    """Output that does not end in a newline is kept intact"""
+    session = ShellSession('/bin/sh')
+    try:
+        result = session.run("printf 'no newline'")
+        assert result.output == "no newline"
+        assert result.return_code == 0
+    finally:
+        session.close()
+
+
+def test_session_restarts_after_exit():
+    """A shell that exits is restarted on the next command"""
+    session = ShellSession('/bin/sh')
+    try:
+        result = session.run("exit 7")
+        assert result.return_code == 7
+        
+        result = session.run("echo back")
+        assert result.output == "back\n"
+        assert session.restarts == 1
+    finally:
+        session.close()
+
+
+def test_session_timeout():
+    """A command exceeding the timeout is killed and reported"""
+    session = ShellSession('/bin/sh')
+    try:
+        result = session.run("sleep 5", timeout=0.2)
+        assert result.return_code == -1
+        assert "timed out" in result.error
+        assert session.run("echo ok").output == "ok\n"
+    finally:
+        session.close()
+
+
+def test_session_with_socket_stdin(monkeypatch):
+    """A stdin that cannot be reopened (neither tty nor pipe) is replaced, not fatal"""
+    ours, theirs = socket.socketpair()
+    monkeypatch.setattr(sys, 'stdin', ours.makefile('r'))
+    try:
+        for shell_path in filter(None, ('/bin/sh', shutil.which('bash'))):
+            session = ShellSession(shell_path)
+            try:
+                with tempfile.TemporaryDirectory() as tmp:
+                    marker = os.path.join(tmp, 'ran')
+                    result = session.run(f"touch {marker}; echo hi; cat")
+                    assert (result.output, result.return_code) == ("hi\n", 0)
+                    assert os.path.exists(marker)
+                    assert session.run("echo again").output == "again\n"
+                    assert session.restarts == 0
+            finally:
+                session.close()
+    finally:
+        sys.stdin.close()
+        ours.close()
+        theirs.close()
+
+
+def test_session_that_cannot_start_is_an_error():
+    """A shell exiting before it reads a command does not pass for that command's exit"""
+    session = ShellSession('/bin/false')
+    with pytest.raises(RuntimeError):
+        session.run("echo hi")
+    
+    session = ShellSession('/bin/sh')
+    try:
+        session.start()
+        # With no command left to read, the shell says so rather than exiting 0
+        session._proc.stdin.close()
+        status, timed_out = session._collect(OutputCapture(), OutputCapture(), None, 5)
+        assert status == (None, session.cwd) and not timed_out
+    finally:
+        session.close()
+
+
+def test_shell_manager_session_mode():
+    """ShellManager routes commands through the session when persistent"""
+    original_cwd = os.getcwd()
+    shell_manager = ShellManager(persistent=True)
+    try:
+        if shell_manager.session is None:
+            return  # Detected shell does not support session mode
+        shell_manager.execute_command("export NLSH_TEST_VAR=kept")
+        result = shell_manager.execute_command("echo $NLSH_TEST_VAR")
+        assert result.output == "kept\n"
+    finally:
+        shell_manager.close()
+        os.chdir(original_cwd)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""Tests for PTY execution mode"""
+
+import sys
+import tempfile
+
+sys.path.insert(0, 'src')
+
+from nlsh.shell import ShellManager
+from nlsh.terminal import is_interactive_command
+
+
+def test_interactive_command_detection():
+    """Full-screen programs use the PTY, ordinary commands use pipes"""
+    assert is_interactive_command("top")
+    assert is_interactive_command("less README.md")
+    assert is_interactive_command("git add -p")
+    assert is_interactive_command("python")
+    assert not is_interactive_command("python script.py")
+    assert not is_interactive_command("git commit -m 'message'")
+    assert not is_interactive_command("git status")
+    assert not is_interactive_command("ls -la")
+
+
+def test_pty_mode_runs_on_terminal():
+    """PTY mode gives the command a terminal and captures its output"""
+    with tempfile.TemporaryDirectory() as tmp:
+        shell_manager = ShellManager(spill_dir=tmp)
+        result = shell_manager.execute_command_with_live_output(
+            "test -t 1 && echo on-a-tty; exit 4", mode='pty'
+        )
+        assert result.return_code == 4
+        assert "on-a-tty" in result.output
+
+
+def test_pipe_mode_has_no_terminal():
+    """Pipe mode keeps stdout captured through a pipe"""
+    shell_manager = ShellManager()
+    result = shell_manager.execute_command_with_live_output(
+        "test -t 1 && echo on-a-tty || echo piped", mode='pipe'
+    )
+    assert result.output == "piped\n"